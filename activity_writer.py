@@ -0,0 +1,125 @@
+import queue
+
+from config import Config
+from database import log_activities
+from flusher import BackgroundFlusher
+
+# What to do with a new row when the queue is full
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+
+class ActivityWriter(BackgroundFlusher):
+    """Writes user activity rows from a background thread
+
+    Requests only put the row on a bounded queue. The writer inserts
+    whatever has queued up every flush_interval seconds (sooner once
+    batch_size rows are waiting) with one executemany per batch, so a
+    request never waits for a SQLite commit. When the queue is full the
+    overflow policy drops the new row, drops the oldest queued row, or
+    blocks the request for up to block_timeout seconds before dropping.
+    A max_queue of 0 writes every row inline, as before.
+    """
+    thread_name = 'activity-writer'
+    flush_error = 'Error writing user activity'
+
+    def __init__(self, max_queue, batch_size, flush_interval, overflow, block_timeout):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown activity overflow policy {overflow!r}, use one of {', '.join(OVERFLOW_POLICIES)}")
+        super().__init__(flush_interval)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def submit(self, row):
+        """Queue a row for writing"""
+        if not self.max_queue:
+            self._write([row])
+            return
+        self._ensure_flusher()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._overflow(row)
+        if self._queue.qsize() >= self.batch_size:
+            self.wake()
+
+    def _overflow(self, row):
+        if self.overflow == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                pass
+        elif self.overflow == BLOCK:
+            self.wake()
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+        self._count('dropped')
+
+    def _write(self, rows):
+        try:
+            log_activities(rows)
+        except Exception as e:
+            self._count('errors')
+            self._count('dropped', len(rows))
+            print(f"Error writing user activity: {str(e)}")
+            return
+        self._count('written', len(rows))
+        self._count('batches')
+
+    def flush(self):
+        """Write everything queued so far"""
+        with self._flush_lock:
+            while True:
+                rows = []
+                while len(rows) < self.batch_size:
+                    try:
+                        rows.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not rows:
+                    return
+                self._write(rows)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "overflow": self.overflow,
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "errors": self.errors
+            }
+
+
+# Create global instance for use across the application
+activity_writer = ActivityWriter(
+    max_queue=Config.ACTIVITY_QUEUE_SIZE,
+    batch_size=Config.ACTIVITY_BATCH_SIZE,
+    flush_interval=Config.ACTIVITY_FLUSH_INTERVAL,
+    overflow=Config.ACTIVITY_OVERFLOW,
+    block_timeout=Config.ACTIVITY_BLOCK_TIMEOUT
+)
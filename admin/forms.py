@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, DateField, TimeField, IntegerField, BooleanField
-from wtforms.validators import DataRequired, Length, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, DateField, TimeField, IntegerField, BooleanField, FloatField
+from wtforms.validators import DataRequired, Length, ValidationError, Optional, URL, NumberRange
 import datetime
+from origins import invalid_entries
 
 class LoginForm(FlaskForm):
     """Form for admin login"""
@@ -23,12 +24,26 @@ class APIKeyForm(FlaskForm):
     
     allowed_origins = StringField('Allowed Origins', render_kw={"placeholder": "Enter allowed origins (space-separated)"})
     
+    webhook_url = StringField('Webhook URL', validators=[Optional(), URL(require_tld=False)],
+                              render_kw={"placeholder": "https://example.com/hooks/verification"})
+
+    rate_limit_rps = FloatField('Requests per Second', validators=[Optional(), NumberRange(min=0)], default=0,
+                                render_kw={"placeholder": "0 for no limit"})
+
+    rate_limit_burst = IntegerField('Burst', validators=[Optional(), NumberRange(min=0)], default=0,
+                                    render_kw={"placeholder": "0 for one second's worth"})
+    
     submit = SubmitField('Save')
     
     def validate_hit_limit(self, field):
         if field.data < 1:
             raise ValidationError('Hit limit must be at least 1')
 
+    def validate_allowed_origins(self, field):
+        errors = invalid_entries((field.data or '').split())
+        if errors:
+            raise ValidationError('; '.join(errors))
+
 class ChangePasswordForm(FlaskForm):
     """Form for changing admin password"""
     current_password = PasswordField('Current Password', validators=[DataRequired()])
@@ -4,13 +4,32 @@ from datetime import datetime, timedelta
 import json
 
 from admin.forms import LoginForm, APIKeyForm, ChangePasswordForm
-from models import key_store, user_store, stats, APIKey, user_activity
+from models import key_store, stats, APIKey, user_activity
 from middleware import require_admin
 from database import get_user, get_user_by_id
+from upstream import engine
+from captcha_tickets import ticket_store
+from captcha_reservoir import captcha_reservoir
+from result_cache import result_cache
+from single_flight import single_flight
+from jobs import job_queue
+from activity_writer import activity_writer
 
 # Create Blueprint
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
+def get_system_stats():
+    """Collect runtime state of the upstream engine and captcha subsystems"""
+    return {
+        'pool': engine.get_stats(),
+        'tickets': ticket_store.get_stats(),
+        'reservoir': captcha_reservoir.get_stats(),
+        'result_cache': result_cache.get_stats(),
+        'single_flight': single_flight.get_stats(),
+        'jobs': job_queue.get_stats(),
+        'activity': activity_writer.get_stats()
+    }
+
 @admin.route('/')
 @admin.route('/dashboard')
 @require_admin
@@ -91,7 +110,8 @@ def dashboard():
                            hourly_labels=json.dumps(hours),
                            hourly_data=json.dumps(hourly_counts),
                            activity_data=activity_data,
-                           page_range=page_range)
+                           page_range=page_range,
+                           system=get_system_stats())
 
 @admin.route('/login', methods=['GET', 'POST'])
 def login():
@@ -149,7 +169,10 @@ def add_key():
             expiry_date=expiry_str,
             hit_limit=form.hit_limit.data,
             allowed_origins=form.allowed_origins.data.split(),
-            active=True  # New keys are active by default
+            active=True,  # New keys are active by default
+            webhook_url=form.webhook_url.data or None,
+            rate_limit_rps=form.rate_limit_rps.data or 0,
+            rate_limit_burst=form.rate_limit_burst.data or 0
         )
         
         # Add to store
@@ -177,6 +200,9 @@ def edit_key(key_id):
         api_key.expiry_date = form.expiry_date.data.strftime("%Y-%m-%d %I:%M:%S %p")
         api_key.hit_limit = form.hit_limit.data
         api_key.allowed_origins = form.allowed_origins.data.split()
+        api_key.webhook_url = form.webhook_url.data or None
+        api_key.rate_limit_rps = form.rate_limit_rps.data or 0
+        api_key.rate_limit_burst = form.rate_limit_burst.data or 0
         
         # Save changes
         key_store.add_key(api_key)
@@ -270,6 +296,12 @@ def api_stats():
         'data': daily_data
     })
 
+@admin.route('/api/system')
+@require_admin
+def api_system():
+    """API endpoint for getting upstream engine and captcha reservoir state"""
+    return jsonify(get_system_stats())
+
 @admin.route('/api/activity')
 @require_admin
 def api_activity():
@@ -304,3 +336,29 @@ def delete_activities():
         success = delete_user_activities()
         
     return jsonify({'success': success})
+
+@admin.route('/cache/invalidate', methods=['POST'])
+@require_admin
+def invalidate_cache():
+    """Drop cached verification results, for one record or all of them"""
+    data = request.get_json(silent=True) or request.form
+    reg_number = data.get('reg_number')
+    dob = data.get('dob')
+
+    if reg_number and dob:
+        removed = 1 if result_cache.invalidate(reg_number, dob) else 0
+    elif data.get('all'):
+        removed = result_cache.clear()
+    elif request.is_json:
+        return jsonify({
+            'success': False,
+            'error': 'Provide reg_number and dob, or all'
+        }), 400
+    else:
+        flash('Enter a registration number and date of birth to invalidate', 'danger')
+        return redirect(url_for('admin.dashboard'))
+
+    if request.is_json:
+        return jsonify({'success': True, 'removed': removed})
+    flash(f'Removed {removed} cached verification result(s)', 'success')
+    return redirect(url_for('admin.dashboard'))
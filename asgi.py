@@ -0,0 +1,379 @@
+"""ASGI entry point
+
+Serves /api/captcha, /api/verify and /api/verify/batch on the event loop so
+requests waiting on the upstream site do not hold a worker thread; every
+other route is the regular Flask app behind a WSGI adapter.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, cleanup, map_verification_data
+from batch_verify import batch_items, count_items, batch_error, batch_workers, averify_item, batch_summary
+from captcha_images import render_captcha, EXTENSIONS
+from captcha_reservoir import captcha_reservoir
+from captcha_tickets import ticket_store, TicketError
+from jobs import job_queue
+from engines import PoolExhausted, UpstreamError
+from middleware import APIRequest, authorize_api_request
+from metrics import metrics
+from models import stats, user_activity
+from result_cache import result_cache, cache_bypassed
+from single_flight import single_flight, verification_key
+from upstream import engine
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 256 * 1024
+
+
+class AsyncRequest:
+    """The bits of an ASGI HTTP request the API handlers use"""
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.remote_addr = scope['client'][0] if scope.get('client') else None
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.body = body
+
+    @property
+    def origin(self):
+        return self.headers.get('origin') or self.headers.get('referer')
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+    def api_request(self, endpoint):
+        return APIRequest(
+            api_key=self.headers.get('x-api-key'),
+            endpoint=endpoint,
+            method=self.method,
+            path=self.path,
+            remote_addr=self.remote_addr,
+            origin_header=self.origin
+        )
+
+
+class AsyncResponse:
+    def __init__(self, body, status=200, content_type='application/json', headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    async def send(self, send):
+        headers = [(b'content-type', self.content_type.encode('latin-1')),
+                   (b'content-length', str(len(self.body)).encode('latin-1'))]
+        headers.extend((k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in self.headers.items())
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class AsyncStreamResponse:
+    """A response whose body is sent chunk by chunk as an async generator yields it"""
+    def __init__(self, chunks, status=200, content_type='application/x-ndjson'):
+        self.chunks = chunks
+        self.status = status
+        self.content_type = content_type
+
+    async def send(self, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [(b'content-type', self.content_type.encode('latin-1'))]})
+        try:
+            async for chunk in self.chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            await self.chunks.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def json_response(data, status=200, headers=None):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    return AsyncResponse(body, status=status, headers=headers)
+
+
+def pool_busy_response(error):
+    """Build a 503 response for requests that could not get an upstream session"""
+    return json_response({
+        'success': False,
+        'error': str(error)
+    }, status=503, headers={'Retry-After': error.retry_after})
+
+
+async def register_request(success=True, endpoint=None):
+    # Stats live in SQLite, keep the write off the event loop
+    await asyncio.to_thread(stats.register_request, success=success, endpoint=endpoint)
+
+
+async def take_captcha():
+    """Get a lease holding a fresh captcha, preferring the pre-warmed reservoir"""
+    entry = await asyncio.to_thread(captcha_reservoir.take)
+    if entry:
+        return entry.lease, entry.image
+    return await engine.aopen_captcha()
+
+
+async def api_get_captcha(req):
+    try:
+        lease, captcha_image = await take_captcha()
+        await register_request(success=True, endpoint='api_get_captcha')
+        data, mimetype = render_captcha(captcha_image, req.headers.get('accept'), req.args.get('format'))
+        return AsyncResponse(data, content_type=mimetype, headers={
+            'Content-Disposition': f"inline; filename=captcha.{EXTENSIONS.get(mimetype, 'bin')}",
+            'Vary': 'Accept',
+            'X-Captcha-Token': ticket_store.issue(lease),
+            'X-Captcha-Expires-In': ticket_store.ttl
+        })
+    except PoolExhausted as e:
+        await register_request(success=False)
+        return pool_busy_response(e)
+    except Exception as e:
+        logger.exception("API Error capturing captcha: %s", e)
+        await register_request(success=False)
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+def verification_details(req, mapped_result_data, cached, endpoint):
+    return {
+        'nameEn': mapped_result_data.get('nameEn', ''),
+        'brn': mapped_result_data.get('brn', ''),
+        'dob': mapped_result_data.get('dob', ''),
+        'birthPlaceEn': mapped_result_data.get('birthPlaceEn', ''),
+        'status': 'Success',
+        'cached': cached,
+        'endpoint': endpoint,
+        'method': req.method,
+        'path': req.path,
+        'remote_addr': req.remote_addr,
+        'origin': req.origin or req.remote_addr or 'unknown'
+    }
+
+
+async def log_verification(req, mapped_result_data, cached=False):
+    details = verification_details(req, mapped_result_data, cached, 'api_verify')
+    await asyncio.to_thread(user_activity.add_activity, req.headers.get('x-api-key'), 'api_verify', details, True)
+
+
+async def api_verify(req):
+    lease = None
+    error = None
+    try:
+        data = req.json()
+        if not data:
+            return json_response({
+                'error': 'Request must include JSON data'
+            }, status=400)
+
+        reg_number = data.get('reg_number')
+        dob = data.get('dob')
+        captcha = data.get('captcha')
+        ticket = data.get('captcha_token') or req.headers.get('x-captcha-token')
+        use_cache = not cache_bypassed(req.headers.get('cache-control'))
+
+        # A cached record needs no captcha and never touches the upstream
+        if reg_number and dob and use_cache:
+            cached = await asyncio.to_thread(result_cache.get, reg_number, dob)
+            if cached is not None:
+                if ticket:
+                    await asyncio.to_thread(ticket_store.discard, ticket)
+                await log_verification(req, cached, cached=True)
+                return json_response({'success': True, 'data': cached}, headers={'X-Cache': 'HIT'})
+
+        if not all([reg_number, dob, captcha]):
+            return json_response({
+                'error': 'Missing required fields: reg_number, dob, and captcha are required'
+            }, status=400)
+
+        # Route the answer to the session that served the captcha
+        try:
+            if ticket:
+                lease = ticket_store.redeem(ticket)
+            else:
+                lease = await asyncio.to_thread(engine.checkout)
+        except (TicketError, UpstreamError) as e:
+            await register_request(success=False)
+            return json_response({
+                'success': False,
+                'error': str(e)
+            }, status=400)
+
+        try:
+            result_data, coalesced = await single_flight.arun(
+                verification_key(reg_number, dob),
+                lambda: engine.asubmit(lease, reg_number, dob, captcha)
+            )
+        except PoolExhausted:
+            # The breaker refused the call, answered with 503 below
+            raise
+        except UpstreamError as e:
+            error = e
+            await register_request(success=False)
+            return json_response({
+                'success': False,
+                'error': str(e)
+            })
+        except Exception as e:
+            error = e
+            logger.exception("API Error extracting data: %s", e)
+            await register_request(success=False)
+            return json_response({
+                'success': False,
+                'error': 'Could not extract verification data'
+            }, status=500)
+
+        mapped_result_data = map_verification_data(result_data)
+        if use_cache:
+            await asyncio.to_thread(result_cache.set, reg_number, dob, mapped_result_data)
+        await log_verification(req, mapped_result_data)
+        headers = {'X-Cache': 'MISS'} if result_cache.enabled else None
+        return json_response({'success': True, 'data': mapped_result_data}, headers=headers)
+    except PoolExhausted as e:
+        await register_request(success=False)
+        return pool_busy_response(e)
+    except Exception as e:
+        error = e
+        logger.exception("API Error in verify: %s", e)
+        await register_request(success=False)
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+    finally:
+        if lease:
+            await engine.arelease(lease, error=error)
+
+
+async def log_batch(req, outcomes):
+    """Log an entry for every verified batch item, the way /api/verify logs its record"""
+    api_key = req.headers.get('x-api-key')
+    entries = [verification_details(req, outcome['data'], outcome['cached'], 'api_verify_batch')
+               for outcome in outcomes if outcome['success']]
+
+    def add_entries():
+        for details in entries:
+            user_activity.add_activity(api_key, 'api_verify_batch', details, True)
+
+    await asyncio.to_thread(add_entries)
+
+
+def ndjson_line(data):
+    return (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+async def api_verify_batch(req):
+    items = batch_items(req.json())
+    error_message = batch_error(items)
+    if error_message:
+        await register_request(success=False)
+        return json_response({
+            'error': error_message
+        }, status=400)
+    use_cache = not cache_bypassed(req.headers.get('cache-control'))
+    slots = asyncio.Semaphore(batch_workers(engine, items))
+
+    async def run(index, item):
+        async with slots:
+            return await averify_item(engine, map_verification_data, index, item, use_cache)
+
+    async def generate():
+        # Each line goes out as soon as its item finishes, in completion order
+        outcomes = []
+        tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                outcome = await next_done
+                outcomes.append(outcome)
+                yield ndjson_line(outcome)
+        finally:
+            # A client that hangs up cancels the items still waiting
+            for task in tasks:
+                task.cancel()
+            summary = batch_summary(outcomes)
+            # Every item counts as a request of its own, in one write
+            await asyncio.to_thread(stats.register_requests, summary['succeeded'], summary['failed'])
+            await log_batch(req, outcomes)
+        yield ndjson_line({'summary': summary})
+
+    return AsyncStreamResponse(generate())
+
+
+# (method, path) -> (endpoint, handler, hits charged to the API key for a parsed body,
+#                    whether authorization counts the request in the stats)
+ASYNC_ROUTES = {
+    ('GET', '/api/captcha'): ('api_get_captcha', api_get_captcha, None, True),
+    ('POST', '/api/verify'): ('api_verify', api_verify, None, True),
+    ('POST', '/api/verify/batch'): ('api_verify_batch', api_verify_batch, count_items, False),
+}
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_SIZE:
+            return None
+        if not message.get('more_body'):
+            return body
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            captcha_reservoir.start()
+            job_queue.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(cleanup)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+flask_application = WsgiToAsgi(app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await handle_lifespan(receive, send)
+
+    route = ASYNC_ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if not route:
+        return await flask_application(scope, receive, send)
+
+    endpoint, handler, hits, register_success = route
+    body = await read_body(receive)
+    if body is None:
+        return await json_response({'error': 'Request body too large'}, status=413).send(send)
+
+    req = AsyncRequest(scope, body)
+    metrics.start_request()
+    count = hits(req.json()) if hits else 1
+    api_request = req.api_request(endpoint)
+    error_message, status = await asyncio.to_thread(authorize_api_request, api_request, count, register_success)
+    if error_message:
+        response = json_response({
+            'success': False,
+            'error': error_message
+        }, status=status, headers={'Retry-After': api_request.retry_after} if api_request.retry_after else None)
+    else:
+        response = await handler(req)
+    if metrics.enabled:
+        server_timing = metrics.server_timing()
+        if server_timing and isinstance(response, AsyncResponse):
+            response.headers['Server-Timing'] = server_timing
+        metrics.end_request(endpoint, req.method, response.status)
+    await response.send(send)
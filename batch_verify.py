@@ -0,0 +1,141 @@
+import asyncio
+import logging
+
+from captcha_tickets import ticket_store, TicketError
+from config import Config
+from engines import PoolExhausted, UpstreamError
+from result_cache import result_cache
+from single_flight import single_flight, verification_key
+
+logger = logging.getLogger(__name__)
+
+
+def batch_items(data):
+    """Return the items of a batch request body, or None when it is malformed"""
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return None
+    return items
+
+
+def count_items(data):
+    """How many hits a batch request body is charged
+
+    One per item, or a single hit for a body batch_error() rejects, so a
+    refused batch costs what any other bad request does.
+    """
+    items = batch_items(data)
+    return 1 if batch_error(items) else len(items)
+
+
+def batch_error(items):
+    """Check a batch before running it, returning an error message or None"""
+    if items is None:
+        return 'Request must include a non-empty "items" array of objects'
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return f'A batch can hold at most {Config.BATCH_MAX_ITEMS} items'
+    return None
+
+
+def batch_workers(engine, items):
+    """Run at most as many items at once as the engine has upstream sessions for"""
+    return max(1, min(len(items), Config.BATCH_MAX_WORKERS, engine.blocking_workers))
+
+
+def _outcome(index, item, success, **fields):
+    outcome = {'index': index, 'success': success}
+    if 'id' in item:
+        outcome['id'] = item['id']
+    outcome.update(fields)
+    return outcome
+
+
+def _fields(item):
+    return item.get('reg_number'), item.get('dob'), item.get('captcha'), item.get('captcha_token')
+
+
+def verify_item(engine, map_result, index, item, use_cache=True):
+    """Verify one batch item, returning its result line instead of raising"""
+    reg_number, dob, captcha, ticket = _fields(item)
+    lease = None
+    error = None
+    try:
+        if reg_number and dob and use_cache:
+            cached = result_cache.get(reg_number, dob)
+            if cached is not None:
+                if ticket:
+                    ticket_store.discard(ticket)
+                return _outcome(index, item, True, data=cached, cached=True)
+
+        if not all([reg_number, dob, captcha, ticket]):
+            return _outcome(index, item, False,
+                            error='Missing required fields: reg_number, dob, captcha and captcha_token are required')
+
+        lease = ticket_store.redeem(ticket)
+        result_data, coalesced = single_flight.run(
+            verification_key(reg_number, dob),
+            lambda: engine.submit(lease, reg_number, dob, captcha)
+        )
+        mapped_result_data = map_result(result_data)
+        if use_cache:
+            result_cache.set(reg_number, dob, mapped_result_data)
+        return _outcome(index, item, True, data=mapped_result_data, cached=False)
+    except (TicketError, UpstreamError, PoolExhausted) as e:
+        error = e
+        return _outcome(index, item, False, error=str(e))
+    except Exception as e:
+        error = e
+        logger.exception("API Error in batch item %s: %s", index, e)
+        return _outcome(index, item, False, error='Could not extract verification data')
+    finally:
+        if lease:
+            ticket_store.release(lease, error=error)
+
+
+async def averify_item(engine, map_result, index, item, use_cache=True):
+    """Async variant of verify_item"""
+    reg_number, dob, captcha, ticket = _fields(item)
+    lease = None
+    error = None
+    try:
+        if reg_number and dob and use_cache:
+            cached = await asyncio.to_thread(result_cache.get, reg_number, dob)
+            if cached is not None:
+                if ticket:
+                    await asyncio.to_thread(ticket_store.discard, ticket)
+                return _outcome(index, item, True, data=cached, cached=True)
+
+        if not all([reg_number, dob, captcha, ticket]):
+            return _outcome(index, item, False,
+                            error='Missing required fields: reg_number, dob, captcha and captcha_token are required')
+
+        lease = ticket_store.redeem(ticket)
+        result_data, coalesced = await single_flight.arun(
+            verification_key(reg_number, dob),
+            lambda: engine.asubmit(lease, reg_number, dob, captcha)
+        )
+        mapped_result_data = map_result(result_data)
+        if use_cache:
+            await asyncio.to_thread(result_cache.set, reg_number, dob, mapped_result_data)
+        return _outcome(index, item, True, data=mapped_result_data, cached=False)
+    except (TicketError, UpstreamError, PoolExhausted) as e:
+        error = e
+        return _outcome(index, item, False, error=str(e))
+    except Exception as e:
+        error = e
+        logger.exception("API Error in batch item %s: %s", index, e)
+        return _outcome(index, item, False, error='Could not extract verification data')
+    finally:
+        if lease:
+            await engine.arelease(lease, error=error)
+
+
+def batch_summary(outcomes):
+    """Count the outcomes of a finished batch for the last stream line and the stats"""
+    succeeded = sum(1 for outcome in outcomes if outcome['success'])
+    return {
+        'total': len(outcomes),
+        'succeeded': succeeded,
+        'failed': len(outcomes) - succeeded,
+        'cached': sum(1 for outcome in outcomes if outcome.get('cached'))
+    }
@@ -0,0 +1 @@
+# Benchmarks and a local stand-in for the upstream verification site
@@ -0,0 +1,234 @@
+"""Local stand-in for everify.bdris.gov.bd
+
+Serves a verification form and result page with the same element ids and
+layout the engines rely on, so they can be exercised without touching the
+real service:
+
+    python -m bench.fake_upstream --port 8090
+    UPSTREAM_URL=http://127.0.0.1:8090/ VERIFY_ENGINE=http python app.py
+
+Any non-empty captcha answer is accepted unless --strict-captcha is given;
+the answer "wrong" is always rejected. Registration numbers starting with
+"0" have no record.
+
+--latency/--jitter slow down every page and captcha response, and
+--error-rate answers that share of them with a 503, to see how the service
+behaves when the real site struggles:
+
+    python -m bench.fake_upstream --latency 0.5 --jitter 0.3 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import random
+import secrets
+import threading
+import time
+from io import BytesIO
+
+from flask import Flask, request, session, send_file, abort
+from markupsafe import escape
+from PIL import Image, ImageDraw
+
+FORM_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Birth and Death Registration Information System</title>
+    <link rel="stylesheet" href="/static/site.css">
+    <script src="/static/site.js"></script>
+</head>
+<body>
+<div class="header"><img src="/static/logo.png" alt="logo"></div>
+<div class="container">
+    {errors}
+    <form id="ubrnsearchform" action="/" method="post">
+        <input type="hidden" name="__RequestVerificationToken" value="{csrf}">
+        <input type="text" id="ubrn" name="ubrn" value="">
+        <input type="text" id="BirthDate" name="BirthDate" value="">
+        <img id="CaptchaImage" src="/DefaultCaptcha/Generate?t={token}" alt="captcha">
+        <input type="hidden" id="CaptchaDeText" name="CaptchaDeText" value="{token}">
+        <input type="text" id="CaptchaInputText" name="CaptchaInputText" value="">
+        <input type="submit" value="Search">
+    </form>
+</div>
+</body>
+</html>
+"""
+
+RESULT_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Birth Registration Record</title></head>
+<body>
+<div class="header"><img src="/static/logo.png" alt="logo"></div>
+<div class="container">
+    <p>Birth Registration Record Verification</p>
+    <p>Address: <span><em>{address}.</em></span></p>
+    <div>
+        <div>
+            <table>
+                <tr><td>Registration Date</td><td>Registration Office</td><td>Issuance Date</td></tr>
+                <tr><td>নিবন্ধনের তারিখ</td><td>নিবন্ধন কার্যালয়</td><td>প্রদানের তারিখ</td></tr>
+                <tr><td>{registered}</td><td>{office}</td><td>{issued}</td></tr>
+                <tr><td>Date of Birth</td><td>Birth Registration Number</td><td>Sex</td></tr>
+                <tr><td>{dob}</td><td>{brn}</td><td>{sex}</td></tr>
+            </table>
+        </div>
+        <div>
+            <div>
+                <table>
+                    <tbody>
+                        <tr><td>নিবন্ধিত ব্যক্তির নাম</td><td>{name_bn}</td><td>Registered Person Name</td><td>{name_en}</td></tr>
+                        <tr><td>জন্মস্থান</td><td>ঢাকা</td><td>Place of Birth</td><td>{birth_place}</td></tr>
+                        <tr><td>পিতার নাম</td><td>{father_bn}</td><td>Father's Name</td><td>{father_en}</td></tr>
+                        <tr><td>পিতার জাতীয়তা</td><td>বাংলাদেশী</td><td>Father's Nationality</td><td>BANGLADESHI</td></tr>
+                        <tr><td>মাতার নাম</td><td>{mother_bn}</td><td>Mother's Name</td><td>{mother_en}</td></tr>
+                        <tr><td>মাতার জাতীয়তা</td><td>বাংলাদেশী</td><td>Mother's Nationality</td><td>BANGLADESHI</td></tr>
+                    </tbody>
+                </table>
+            </div>
+        </div>
+    </div>
+</div>
+</body>
+</html>
+"""
+
+ERRORS = '<div class="validation-summary-errors"><ul><li>{message}</li></ul></div>'
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+FIRST_NAMES = ['RAHIM', 'KARIM', 'NUSRAT', 'FARHANA', 'TANVIR', 'SADIA', 'ARIF', 'MIM']
+LAST_NAMES = ['AHMED', 'HOSSAIN', 'RAHMAN', 'ISLAM', 'KHAN', 'CHOWDHURY']
+
+
+def make_record(brn, dob):
+    """Build a deterministic fake record for a registration number"""
+    seed = int(hashlib.sha256(f'{brn}|{dob}'.encode()).hexdigest(), 16)
+    first = FIRST_NAMES[seed % len(FIRST_NAMES)]
+    last = LAST_NAMES[(seed >> 8) % len(LAST_NAMES)]
+    try:
+        year, month, day = (int(part) for part in dob.split('-'))
+        dob_text = f'{day:02d} {MONTHS[month - 1]} {year}'
+    except (ValueError, IndexError):
+        dob_text = dob
+    return {
+        'brn': brn,
+        'dob': dob_text,
+        'sex': 'MALE' if seed % 2 else 'FEMALE',
+        'registered': f'{(seed % 28) + 1:02d} {MONTHS[(seed >> 4) % 12]} 2015',
+        'issued': f'{(seed % 27) + 1:02d} {MONTHS[(seed >> 6) % 12]} 2016',
+        'office': 'DHAKA NORTH CITY CORPORATION, ZONE-3',
+        'address': 'HOUSE 12, ROAD 5, DHANMONDI, DHAKA',
+        'birth_place': 'DHAKA',
+        'name_en': f'{first} {last}',
+        'name_bn': 'রহিম আহমেদ',
+        'father_en': f'ABDUL {last}',
+        'father_bn': 'আব্দুল আহমেদ',
+        'mother_en': f'AYESHA {last}',
+        'mother_bn': 'আয়েশা আহমেদ'
+    }
+
+
+def render_captcha(text):
+    """Draw a captcha image for the given text"""
+    image = Image.new('RGB', (120, 40), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((20, 12), text, fill='black')
+    output = BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def create_app(strict_captcha=False, asset_delay=0, latency=0, jitter=0, error_rate=0):
+    """Create the stand-in upstream application
+
+    asset_delay makes every /static request take that many seconds, like the
+    real site's stylesheets, scripts and images over a slow link. Form,
+    captcha and search responses take latency plus up to jitter seconds, and
+    error_rate of them fail with a 503.
+    """
+    app = Flask(__name__)
+    app.secret_key = secrets.token_hex(16)
+    captchas = {}
+    lock = threading.Lock()
+
+    @app.before_request
+    def inject_faults():
+        if request.path.startswith('/static/'):
+            return None
+        if latency or jitter:
+            time.sleep(latency + random.uniform(0, jitter))
+        if error_rate and random.random() < error_rate:
+            return 'Service Unavailable', 503
+        return None
+
+    def form_page(errors=''):
+        token = secrets.token_hex(8)
+        with lock:
+            captchas[token] = secrets.token_hex(3)
+        session['captcha'] = token
+        return FORM_PAGE.format(errors=errors, csrf=secrets.token_hex(8), token=token)
+
+    @app.route('/', methods=['GET'])
+    def form():
+        return form_page()
+
+    @app.route('/DefaultCaptcha/Generate')
+    def captcha_image():
+        with lock:
+            text = captchas.get(request.args.get('t', ''))
+        if not text:
+            abort(404)
+        return send_file(BytesIO(render_captcha(text)), mimetype='image/png')
+
+    @app.route('/', methods=['POST'])
+    def search():
+        token = request.form.get('CaptchaDeText', '')
+        answer = request.form.get('CaptchaInputText', '').strip()
+        with lock:
+            expected = captchas.pop(token, None)
+
+        # The captcha must belong to this cookie session
+        if expected is None or session.get('captcha') != token:
+            return form_page(ERRORS.format(message='Captcha has expired, please try again'))
+        if not answer or answer == 'wrong' or (strict_captcha and answer != expected):
+            return form_page(ERRORS.format(message='Captcha mismatch'))
+
+        brn = request.form.get('ubrn', '').strip()
+        dob = request.form.get('BirthDate', '').strip()
+        if not brn or brn.startswith('0'):
+            return form_page(ERRORS.format(message='No record found'))
+
+        record = {key: escape(value) for key, value in make_record(brn, dob).items()}
+        return RESULT_PAGE.format(**record)
+
+    @app.route('/static/<path:name>')
+    def static_asset(name):
+        # Stand-ins for the stylesheets, scripts and images the real site loads
+        if asset_delay:
+            time.sleep(asset_delay)
+        if name.endswith('.css'):
+            return 'body { font-family: sans-serif; }', 200, {'Content-Type': 'text/css'}
+        if name.endswith('.js'):
+            return 'window.siteLoaded = true;', 200, {'Content-Type': 'application/javascript'}
+        return send_file(BytesIO(render_captcha('logo')), mimetype='image/png')
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in of the upstream verification site')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--strict-captcha', action='store_true',
+                        help='only accept the captcha text that was actually drawn')
+    parser.add_argument('--asset-delay', type=float, default=0,
+                        help='seconds every stylesheet, script and image request takes')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds every page, captcha and search response takes')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='up to this many random extra seconds on top of --latency')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of page, captcha and search responses that fail with a 503')
+    args = parser.parse_args()
+    create_app(strict_captcha=args.strict_captcha, asset_delay=args.asset_delay, latency=args.latency,
+               jitter=args.jitter, error_rate=args.error_rate).run(host=args.host, port=args.port, threaded=True)
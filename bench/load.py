@@ -0,0 +1,301 @@
+"""Load and latency benchmark for the API
+
+Drives the captcha + verify flow (GET /api/captcha, then POST /api/verify
+with the returned token) from concurrent clients and reports throughput,
+latency percentiles and the per-stage breakdown from Server-Timing headers
+as JSON, so runs can be saved and compared:
+
+    python -m bench.load --concurrency 8 --flows 400 --output before.json
+    python -m bench.load --concurrency 8 --flows 400 --latency 0.3 --jitter 0.2 --error-rate 0.02
+    python -m bench.load --concurrency 8 --flows 400 --compare before.json
+    python -m bench.load --url http://127.0.0.1:5000 --api-key KEY --concurrency 16
+
+Without --url the app is served in this process (through the ASGI entry
+point with --asgi) against a local stand-in upstream started on a free port,
+using a throwaway database and API key. With --url, the server should run
+with METRICS_ENABLED=true for the stage breakdown.
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import secrets
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from bench.page_load import start_fake_upstream
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values):
+    """Latency summary in milliseconds"""
+    values = sorted(values)
+    if not values:
+        return None
+    summary = {f'p{p}': round(percentile(values, p) * 1000, 1) for p in PERCENTILES}
+    summary['mean'] = round(statistics.mean(values) * 1000, 1)
+    summary['max'] = round(values[-1] * 1000, 1)
+    return summary
+
+
+def parse_server_timing(header):
+    """Map each Server-Timing entry to its duration in seconds"""
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                try:
+                    stages[name.strip()] = float(value) / 1000
+                except ValueError:
+                    pass
+    return stages
+
+
+class Recorder:
+    """Collects request outcomes from every client thread"""
+    def __init__(self):
+        self.requests = {}
+        self.flows = []
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, status, elapsed, server_timing):
+        with self._lock:
+            entry = self.requests.setdefault(endpoint, {'latencies': [], 'statuses': {}, 'stages': {}})
+            entry['latencies'].append(elapsed)
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            for stage, seconds in parse_server_timing(server_timing).items():
+                entry['stages'].setdefault(stage, []).append(seconds)
+
+    def flow(self, elapsed, success):
+        with self._lock:
+            self.flows.append((elapsed, success))
+
+
+def run_flow(client, api_key, recorder, index):
+    headers = {'X-API-Key': api_key}
+    started = time.perf_counter()
+
+    response = client.get('/api/captcha', headers=headers)
+    recorder.request('api_captcha', response.status_code, time.perf_counter() - started,
+                     response.headers.get('Server-Timing'))
+    token = response.headers.get('X-Captcha-Token')
+    if response.status_code != 200 or not token:
+        recorder.flow(time.perf_counter() - started, False)
+        return
+
+    # A fresh registration number per flow, so nothing is served from the cache or coalesced
+    payload = {
+        'reg_number': f'{19900000000000000 + index * 7919 % 10000000000000:017d}',
+        'dob': '2010-03-05',
+        'captcha': 'abc',
+        'captcha_token': token
+    }
+    verify_started = time.perf_counter()
+    response = client.post('/api/verify', headers=dict(headers, **{'Cache-Control': 'no-cache'}), json=payload)
+    recorder.request('api_verify', response.status_code, time.perf_counter() - verify_started,
+                     response.headers.get('Server-Timing'))
+    success = response.status_code == 200 and (response.json() or {}).get('success') is True
+    recorder.flow(time.perf_counter() - started, success)
+
+
+def run_clients(base_url, api_key, concurrency, flows, duration, timeout):
+    import httpx
+
+    recorder = Recorder()
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def client_loop():
+        with httpx.Client(base_url=base_url, timeout=timeout) as client:
+            while True:
+                index = next(counter)
+                if (flows and index >= flows) or (deadline and time.perf_counter() >= deadline):
+                    return
+                try:
+                    run_flow(client, api_key, recorder, index)
+                except Exception as e:
+                    recorder.request('client_error', e.__class__.__name__, 0, None)
+                    recorder.flow(0, False)
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def build_report(args, recorder, elapsed):
+    succeeded = sum(1 for _, success in recorder.flows if success)
+    endpoints = {}
+    for endpoint, entry in sorted(recorder.requests.items()):
+        endpoints[endpoint] = {
+            'requests': len(entry['latencies']),
+            'statuses': {str(status): count for status, count in sorted(entry['statuses'].items(), key=str)},
+            'latency_ms': summarize(entry['latencies']),
+            'stages_ms': {stage: summarize(values) for stage, values in sorted(entry['stages'].items())}
+        }
+    return {
+        'config': {
+            'url': args.url,
+            'asgi': args.asgi,
+            'engine': args.engine,
+            'concurrency': args.concurrency,
+            'flows': args.flows,
+            'duration': args.duration,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate
+        },
+        'elapsed_s': round(elapsed, 3),
+        'flows': {
+            'completed': len(recorder.flows),
+            'succeeded': succeeded,
+            'success_rate': round(succeeded / len(recorder.flows), 4) if recorder.flows else None,
+            'throughput_per_s': round(succeeded / elapsed, 2) if elapsed else None,
+            'latency_ms': summarize([flow_elapsed for flow_elapsed, success in recorder.flows if success])
+        },
+        'endpoints': endpoints
+    }
+
+
+def compare(base, current):
+    """Print how a run moved against a saved one"""
+    def row(label, before, after):
+        if before is None or after is None:
+            print(f"  {label:<34} {before!s:>10} {after!s:>10}")
+            return
+        change = (after - before) / before * 100 if before else 0
+        print(f"  {label:<34} {before:>10} {after:>10} {change:>+8.1f}%")
+
+    print(f"  {'':<34} {'base':>10} {'current':>10} {'change':>9}")
+    row('throughput (flows/s)', base['flows']['throughput_per_s'], current['flows']['throughput_per_s'])
+    row('success rate', base['flows']['success_rate'], current['flows']['success_rate'])
+    for p in PERCENTILES:
+        row(f'flow p{p} ms', (base['flows']['latency_ms'] or {}).get(f'p{p}'),
+            (current['flows']['latency_ms'] or {}).get(f'p{p}'))
+    for endpoint, entry in current['endpoints'].items():
+        before = base['endpoints'].get(endpoint, {})
+        for p in PERCENTILES:
+            row(f'{endpoint} p{p} ms', (before.get('latency_ms') or {}).get(f'p{p}'),
+                (entry['latency_ms'] or {}).get(f'p{p}'))
+        for stage, summary in entry['stages_ms'].items():
+            row(f'{endpoint} {stage} p95 ms', ((before.get('stages_ms') or {}).get(stage) or {}).get('p95'),
+                (summary or {}).get('p95'))
+
+
+def serve_app(asgi):
+    """Serve the app in this process on a free port, returning (base_url, stop)"""
+    if asgi:
+        import socket
+        import uvicorn
+        from asgi import application
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning'))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+        return f'http://127.0.0.1:{port}', stop
+
+    from werkzeug.serving import make_server
+    from app import app, cleanup
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        cleanup()
+    return f'http://127.0.0.1:{server.server_port}', stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure API throughput and latency under concurrent load')
+    parser.add_argument('--url', help='benchmark a running server instead of an in-process one')
+    parser.add_argument('--api-key', help='API key to use with --url')
+    parser.add_argument('--asgi', action='store_true', help='serve the in-process app through asgi.application')
+    parser.add_argument('--engine', default='http', help='verification engine for the in-process app')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--flows', type=int, default=200, help='captcha + verify flows to run (0 for no limit)')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (0 for no limit)')
+    parser.add_argument('--timeout', type=float, default=60, help='client timeout per request')
+    parser.add_argument('--latency', type=float, default=0, help='stand-in upstream: seconds per response')
+    parser.add_argument('--jitter', type=float, default=0, help='stand-in upstream: random extra seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='stand-in upstream: share of 503 responses')
+    parser.add_argument('--output', help='write the JSON report here as well')
+    parser.add_argument('--compare', help='a saved JSON report to compare this run against')
+    args = parser.parse_args()
+    if not args.flows and not args.duration:
+        parser.error('give --flows or --duration')
+    if args.url and not args.api_key:
+        parser.error('--url needs --api-key')
+
+    stop = None
+    upstream = None
+    if args.url:
+        base_url, api_key = args.url.rstrip('/'), args.api_key
+    else:
+        upstream, upstream_url = start_fake_upstream(latency=args.latency, jitter=args.jitter,
+                                                     error_rate=args.error_rate)
+        # Config reads these at import time
+        os.environ['UPSTREAM_URL'] = upstream_url
+        os.environ['VERIFY_ENGINE'] = args.engine
+        os.environ['METRICS_ENABLED'] = 'true'
+        os.environ.setdefault('RESULT_CACHE_ENABLED', 'false')
+
+        # Per-request access logs from both servers would drown the report
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        import database
+        database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='bench-load-'), 'app.db')
+        database.init_db()
+        from models import key_store, APIKey
+        api_key = secrets.token_hex(16)
+        key_store.add_key(APIKey('bench', '2099-12-31 11:59:59 PM', 0, key=api_key))
+        base_url, stop = serve_app(args.asgi)
+
+    try:
+        recorder, elapsed = run_clients(base_url, api_key, args.concurrency, args.flows, args.duration, args.timeout)
+    finally:
+        if stop:
+            stop()
+        if upstream:
+            upstream.shutdown()
+
+    report = build_report(args, recorder, elapsed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Per-record cost of mapping raw upstream fields to the API result
+
+Maps a set of generated records two ways and reports microseconds per record:
+
+  legacy    closures, strptime('%d %B %Y') per date field and a
+            per-character Latin check (what map_verification_data used to do)
+  compiled  the table-driven plan in mapping.py
+
+    python -m bench.mapping --records 2000 --rounds 20
+
+Both mappers are first checked to give the same output for every record.
+The compiled mapper memoizes date conversions, so rounds after the first
+mostly hit that cache, as repeated dates do in production.
+"""
+import argparse
+import statistics
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from bench.fake_upstream import make_record
+from mapping import _map_verification_data
+
+
+def legacy_title_case_if_latin(text):
+    if not isinstance(text, str):
+        return text
+    if any('a' <= c.lower() <= 'z' for c in text):
+        return text.title()
+    return text
+
+
+def legacy_format_date(date_str):
+    try:
+        dt = datetime.strptime(date_str, "%d %B %Y")
+        return dt.strftime("%d/%m/%Y")
+    except Exception:
+        return date_str
+
+
+def legacy_map(raw_data):
+    def get(key):
+        val = raw_data.get(key, "")
+        if key in ["Registration Date", "Issuance Date", "Date of Birth", "birthPlaceEn"]:
+            val = legacy_format_date(val)
+        return legacy_title_case_if_latin(val)
+    return OrderedDict([
+        ("office", get("Registration Office")),
+        ("address", legacy_title_case_if_latin(raw_data.get("address", ""))),
+        ("register", get("Registration Date")),
+        ("issue", get("Issuance Date")),
+        ("brn", get("Birth Registration Number")),
+        ("dob", get("Date of Birth")),
+        ("sex", get("Sex")),
+        ("nameEn", get("Registered Person Name")),
+        ("nameBn", raw_data.get("নিবন্ধিত ব্যক্তির নাম", "")),
+        ("fatherNameEn", get("Father's Name")),
+        ("fatherNameBn", raw_data.get("পিতার নাম", "")),
+        ("fatherNationalityEn", get("Father's Nationality")),
+        ("fatherNationalityBn", raw_data.get("পিতার জাতীয়তা", raw_data.get("পিতার জাতীয়তা", ""))),
+        ("motherNameEn", get("Mother's Name")),
+        ("motherNameBn", raw_data.get("মাতার নাম", "")),
+        ("motherNationalityEn", get("Mother's Nationality")),
+        ("motherNationalityBn", raw_data.get("মাতার জাতীয়তা", raw_data.get("মাতার জাতীয়তা", ""))),
+        ("birthPlaceEn", get("birthPlaceEn")),
+        ("birthPlaceBn", raw_data.get("জন্মস্থান", "")),
+    ])
+
+
+def make_raw(index):
+    """Raw fields shaped like the engines' extraction output"""
+    year = 1950 + index % 70
+    dob = f'{year}-{index % 12 + 1:02d}-{index % 28 + 1:02d}'
+    record = make_record(f'{year}{index:013d}', dob)
+    return {
+        'Registration Date': record['registered'],
+        'Registration Office': record['office'],
+        'Issuance Date': record['issued'],
+        'Date of Birth': record['dob'],
+        'Birth Registration Number': record['brn'],
+        'Sex': record['sex'],
+        'নিবন্ধিত ব্যক্তির নাম': record['name_bn'],
+        'Registered Person Name': record['name_en'],
+        'জন্মস্থান': 'ঢাকা',
+        'Place of Birth': record['birth_place'],
+        'পিতার নাম': record['father_bn'],
+        "Father's Name": record['father_en'],
+        'পিতার জাতীয়তা': 'বাংলাদেশী',
+        "Father's Nationality": 'BANGLADESHI',
+        'মাতার নাম': record['mother_bn'],
+        "Mother's Name": record['mother_en'],
+        'মাতার জাতীয়তা': 'বাংলাদেশী',
+        "Mother's Nationality": 'BANGLADESHI',
+        'address': record['address'],
+        'birthPlaceEn': record['birth_place']
+    }
+
+
+def run(mapper, records, rounds):
+    per_record = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for raw in records:
+            mapper(raw)
+        per_record.append((time.perf_counter() - started) / len(records) * 1e6)
+    return {
+        'first_round_us': round(per_record[0], 2),
+        'median_us': round(statistics.median(per_record), 2),
+        'min_us': round(min(per_record), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-record mapping cost')
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    records = [make_raw(i) for i in range(args.records)]
+    mismatches = sum(1 for raw in records if legacy_map(raw) != _map_verification_data(raw))
+    if mismatches:
+        raise SystemExit(f'{mismatches} records map differently')
+
+    results = {'legacy': run(legacy_map, records, args.rounds),
+               'compiled': run(_map_verification_data, records, args.rounds)}
+    print(f"{'mapper':<10} {'first round':>12} {'median':>10} {'best':>10}  (us per record)")
+    for name, result in results.items():
+        print(f"{name:<10} {result['first_round_us']:>12} {result['median_us']:>10} {result['min_us']:>10}")
+    print(f"speedup (median): {results['legacy']['median_us'] / results['compiled']['median_us']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
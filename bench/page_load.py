@@ -0,0 +1,111 @@
+"""Page load benchmark for the browser engine
+
+Loads the verification form and captures its captcha repeatedly with the
+old settings (normal load strategy, nothing blocked) and the configured
+ones (eager strategy plus resource blocking), then compares time and bytes:
+
+    python -m bench.page_load --runs 20 --asset-delay 0.2
+    python -m bench.page_load --url https://everify.bdris.gov.bd/ --runs 5
+
+Without --url a local stand-in upstream is started on a free port.
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+
+# Resources the page fetched and the bytes that came over the wire for them
+TRANSFER_SCRIPT = """
+    var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+    var bytes = 0;
+    for (var i = 0; i < entries.length; i++) {
+        bytes += entries[i].transferSize || 0;
+    }
+    return {requests: entries.length, bytes: bytes};
+"""
+
+
+def start_fake_upstream(asset_delay=0, **faults):
+    from werkzeug.serving import make_server
+    from bench.fake_upstream import create_app
+
+    server = make_server('127.0.0.1', 0, create_app(asset_delay=asset_delay, **faults), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/'
+
+
+def run_profile(name, runs, page_load_strategy, blocked_urls):
+    from browser_pool import create_driver
+    from engines.selenium_engine import load_fresh_captcha
+
+    driver = create_driver(page_load_strategy=page_load_strategy, blocked_urls=blocked_urls)
+    timings, transfers, failures = [], [], 0
+    try:
+        # Warm up so Chrome start-up and connection setup don't count
+        load_fresh_captcha(driver)
+        for _ in range(runs):
+            started = time.perf_counter()
+            image = load_fresh_captcha(driver)
+            elapsed = time.perf_counter() - started
+            if not image:
+                failures += 1
+                continue
+            timings.append(elapsed)
+            transfers.append(driver.execute_script(TRANSFER_SCRIPT))
+    finally:
+        driver.quit()
+
+    return {
+        'profile': name,
+        'strategy': page_load_strategy,
+        'blocked': len(blocked_urls),
+        'runs': len(timings),
+        'failures': failures,
+        'p50': statistics.median(timings) if timings else None,
+        'p95': sorted(timings)[int(0.95 * (len(timings) - 1))] if timings else None,
+        'requests': statistics.mean(t['requests'] for t in transfers) if transfers else None,
+        'kb': statistics.mean(t['bytes'] for t in transfers) / 1024 if transfers else None
+    }
+
+
+def print_report(results):
+    print(f"{'profile':<10} {'strategy':<8} {'blocked':>7} {'runs':>5} {'fail':>5} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'requests':>9} {'KB':>8}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['strategy']:<8} {r['blocked']:>7} {r['runs']:>5} {r['failures']:>5} "
+              f"{(r['p50'] or 0) * 1000:>8.0f} {(r['p95'] or 0) * 1000:>8.0f} "
+              f"{r['requests'] or 0:>9.1f} {r['kb'] or 0:>8.1f}")
+    if len(results) == 2 and results[0]['p50'] and results[1]['p50']:
+        print(f"\np50 speed-up: {results[0]['p50'] / results[1]['p50']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare page load settings for the browser engine')
+    parser.add_argument('--url', help='upstream form URL (default: start a local stand-in)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--asset-delay', type=float, default=0.2,
+                        help='per-asset delay of the local stand-in, in seconds')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_fake_upstream(args.asset_delay)
+    # Config reads the upstream URL at import time
+    os.environ['UPSTREAM_URL'] = url
+
+    from config import Config
+    try:
+        results = [
+            run_profile('baseline', args.runs, 'normal', []),
+            run_profile('optimized', args.runs, Config.BROWSER_PAGE_LOAD_STRATEGY, Config.BROWSER_BLOCKED_URLS)
+        ]
+    finally:
+        if server:
+            server.shutdown()
+    print_report(results)
+
+
+if __name__ == '__main__':
+    main()
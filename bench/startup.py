@@ -0,0 +1,73 @@
+"""Cold start profile
+
+Imports the app in a fresh interpreter, the way a new gunicorn worker does,
+and reports the slowest imports (from `python -X importtime`), the total
+import time and the time to serve a first request:
+
+    python -m bench.startup
+    python -m bench.startup --module asgi --top 30
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from app import app
+app.test_client().get('/admin/login')
+served = time.perf_counter()
+heavy = [name for name in ('selenium', 'webdriver_manager', 'PIL', 'httpx', 'lxml') if name in __import__('sys').modules]
+print(f"{{(imported - started) * 1000:.1f}} {{(served - imported) * 1000:.1f}} {{','.join(heavy)}}")
+"""
+
+
+def parse_importtime(output):
+    """Parse `-X importtime` lines into (self_us, cumulative_us, module) tuples"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report where a new worker spends its start-up time')
+    parser.add_argument('--module', default='app', help='module a worker imports (app or asgi)')
+    parser.add_argument('--top', type=int, default=20, help='number of imports to list')
+    args = parser.parse_args()
+
+    profile = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {args.module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if profile.returncode != 0:
+        print(profile.stderr)
+        sys.exit(profile.returncode)
+    rows = parse_importtime(profile.stderr)
+
+    print(f"Slowest imports for 'import {args.module}' (cumulative, ms):")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:>8.1f} {self_us / 1000:>8.1f}  {name}")
+
+    timing = subprocess.run(
+        [sys.executable, '-c', FIRST_REQUEST.format(module=args.module)],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if timing.returncode != 0:
+        print(timing.stderr)
+        sys.exit(timing.returncode)
+    import_ms, first_request_ms, heavy = (timing.stdout.strip().splitlines()[-1].split(' ') + [''])[:3]
+    print(f"\nimport {args.module}: {import_ms} ms, first request: {first_request_ms} ms")
+    print(f"heavy modules loaded at start-up: {heavy or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
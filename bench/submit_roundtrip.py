@@ -0,0 +1,117 @@
+"""Submit round-trip benchmark for the browser engine
+
+Verifies the same record repeatedly two ways and reports WebDriver commands
+and wall time per verification:
+
+  legacy  fill and click, look for validation errors, wait for the result
+          table, then run the extraction script (what the engine used to do)
+  pinned  one async call to the pinned verify script
+
+    python -m bench.submit_roundtrip --runs 20
+    python -m bench.submit_roundtrip --runs 20 --asset-delay 0.2
+
+A local stand-in upstream is started on a free port.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from bench.page_load import start_fake_upstream
+
+LEGACY_FILL_SCRIPT = """
+    document.getElementById('ubrn').value = arguments[0];
+    document.getElementById('BirthDate').value = arguments[1];
+    document.getElementById('CaptchaInputText').value = arguments[2];
+    document.querySelector('#ubrnsearchform input[type="submit"]').click();
+"""
+
+# Stands in for the old extraction script, which cost one more command
+LEGACY_EXTRACT_SCRIPT = "return document.querySelectorAll('table').length;"
+
+
+class CommandCounter:
+    """Counts the WebDriver commands a driver sends"""
+    def __init__(self, driver):
+        self.count = 0
+        self._execute = driver.execute
+
+        def execute(command, params=None):
+            self.count += 1
+            return self._execute(command, params)
+        driver.execute = execute
+
+
+def legacy_submit(driver, reg_number, dob, captcha):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    driver.execute_script(LEGACY_FILL_SCRIPT, reg_number, dob, captcha)
+    if driver.find_elements(By.CLASS_NAME, 'validation-summary-errors'):
+        raise Exception('validation error')
+    WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.TAG_NAME, 'table')))
+    return driver.execute_script(LEGACY_EXTRACT_SCRIPT)
+
+
+def run(engine, mode, runs):
+    timings, commands, failures = [], [], 0
+    for i in range(runs):
+        slot, _ = engine.open_captcha()
+        counter = CommandCounter(slot.driver)
+        error = None
+        started = time.perf_counter()
+        try:
+            if mode == 'legacy':
+                legacy_submit(slot.driver, f'1990{i:013d}', '2010-03-05', 'abc')
+            else:
+                engine.submit(slot, f'1990{i:013d}', '2010-03-05', 'abc')
+            timings.append(time.perf_counter() - started)
+            commands.append(counter.count)
+        except Exception as e:
+            error = e
+            failures += 1
+        finally:
+            del slot.driver.execute
+            engine.release(slot, error=error)
+    return {
+        'mode': mode,
+        'runs': len(timings),
+        'failures': failures,
+        'commands': statistics.mean(commands) if commands else None,
+        'p50': statistics.median(timings) if timings else None,
+        'p95': sorted(timings)[int(0.95 * (len(timings) - 1))] if timings else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare WebDriver round trips per verification')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--asset-delay', type=float, default=0)
+    args = parser.parse_args()
+
+    server, url = start_fake_upstream(args.asset_delay)
+    # Config reads these at import time
+    os.environ['UPSTREAM_URL'] = url
+    os.environ['BROWSER_POOL_SIZE'] = '1'
+    os.environ['BROWSER_WARM_SPARE'] = 'false'
+
+    from engines.selenium_engine import create_selenium_engine
+    engine = create_selenium_engine()
+    try:
+        # Warm up so Chrome start-up doesn't count
+        slot, _ = engine.open_captcha()
+        engine.release(slot)
+        results = [run(engine, 'legacy', args.runs), run(engine, 'pinned', args.runs)]
+    finally:
+        engine.shutdown()
+        server.shutdown()
+
+    print(f"{'mode':<8} {'runs':>5} {'fail':>5} {'commands':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['runs']:>5} {r['failures']:>5} {r['commands'] or 0:>9.1f} "
+              f"{(r['p50'] or 0) * 1000:>8.1f} {(r['p95'] or 0) * 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
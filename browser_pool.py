@@ -0,0 +1,564 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from config import Config
+from engines.base import PoolExhausted
+from metrics import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Selenium is imported where it is first needed: it takes longer to import than the
+# rest of the app together, and workers running the HTTP engine never need it
+
+def build_chrome_options(page_load_strategy=None):
+    """Build the Chrome options used for every pooled browser"""
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    # 'eager' hands the page back at DOMContentLoaded; the waits in waits.py cover the rest
+    chrome_options.page_load_strategy = page_load_strategy or Config.BROWSER_PAGE_LOAD_STRATEGY
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--window-size=1920,1080')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--proxy-server="direct://"')
+    chrome_options.add_argument('--proxy-bypass-list=*')
+    chrome_options.add_argument('--start-maximized')
+    chrome_options.add_argument('--disable-setuid-sandbox')
+    chrome_options.add_argument('--disable-infobars')
+    chrome_options.add_argument('--ignore-certificate-errors')
+    chrome_options.add_argument('--allow-running-insecure-content')
+    chrome_options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation'])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    return chrome_options
+
+
+def block_resources(driver, patterns):
+    """Stop the browser from fetching URLs matching any of the patterns (`*` wildcards)"""
+    if not patterns:
+        return
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patterns)})
+    except Exception as e:
+        # Loading everything is slower but still works
+        print(f"Failed to enable resource blocking: {e}")
+
+
+_resolved_paths = None
+_resolve_lock = threading.Lock()
+
+
+def _load_cached_paths():
+    try:
+        with open(Config.CHROMEDRIVER_CACHE_FILE) as f:
+            paths = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # A cached path is only good while the binaries are still there
+    if not paths.get('driver') or not os.path.isfile(paths['driver']):
+        return None
+    if paths.get('browser') and not os.path.isfile(paths['browser']):
+        return None
+    return paths
+
+
+def _save_cached_paths(paths):
+    try:
+        with open(Config.CHROMEDRIVER_CACHE_FILE, 'w') as f:
+            json.dump(paths, f)
+    except OSError as e:
+        print(f"Failed to cache chromedriver paths: {e}")
+
+
+def find_chrome_binary():
+    """Locate the Chrome binary, preferring CHROME_BINARY_PATH"""
+    if Config.CHROME_BINARY_PATH:
+        return Config.CHROME_BINARY_PATH
+    for name in ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def _launch(driver_path, browser_path, chrome_options):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    if browser_path:
+        chrome_options.binary_location = browser_path
+    return webdriver.Chrome(service=Service(driver_path), options=chrome_options)
+
+
+def create_driver(page_load_strategy=None, blocked_urls=None):
+    """Launch a new headless Chrome session
+
+    The chromedriver and Chrome paths that worked are cached in memory and in
+    CHROMEDRIVER_CACHE_FILE, so later launches and new workers skip the
+    resolution (and the ChromeDriverManager network lookup).
+    """
+    with metrics.span('init_driver'):
+        return _create_driver(page_load_strategy, blocked_urls)
+
+
+def _create_driver(page_load_strategy, blocked_urls):
+    global _resolved_paths
+    chrome_options = build_chrome_options(page_load_strategy)
+    blocked_urls = Config.BROWSER_BLOCKED_URLS if blocked_urls is None else blocked_urls
+
+    with _resolve_lock:
+        if _resolved_paths is None:
+            _resolved_paths = _load_cached_paths()
+        paths = _resolved_paths
+
+    driver = None
+    if paths:
+        try:
+            driver = _launch(paths['driver'], paths.get('browser'), chrome_options)
+        except Exception as e:
+            print(f"Failed to initialize with cached chromedriver path: {e}")
+            chrome_options = build_chrome_options(page_load_strategy)
+
+    if driver is None:
+        browser_path = find_chrome_binary()
+        try:
+            # First try to find Chrome in the standard Linux path (for Render)
+            driver_path = Config.CHROME_DRIVER_PATH
+            driver = _launch(driver_path, browser_path, chrome_options)
+        except Exception as e:
+            print(f"Failed to initialize with standard Chrome path: {e}")
+            try:
+                # Fallback to ChromeDriverManager (for local development)
+                from webdriver_manager.chrome import ChromeDriverManager
+
+                driver_path = ChromeDriverManager().install()
+                driver = _launch(driver_path, browser_path, build_chrome_options(page_load_strategy))
+            except Exception as e:
+                print(f"Failed to initialize driver: {e}")
+                raise
+        paths = {'driver': driver_path, 'browser': browser_path}
+        with _resolve_lock:
+            _resolved_paths = paths
+        _save_cached_paths(paths)
+
+    block_resources(driver, blocked_urls)
+    return driver
+
+
+def is_fatal_error(error):
+    """Check whether an error means the browser session itself is broken"""
+    if error is None:
+        return False
+    from selenium.common.exceptions import (WebDriverException, TimeoutException, NoSuchElementException,
+                                            StaleElementReferenceException, JavascriptException)
+    if not isinstance(error, WebDriverException):
+        return False
+    # Page-level errors leave the browser usable
+    return not isinstance(error, (TimeoutException, NoSuchElementException,
+                                  StaleElementReferenceException, JavascriptException))
+
+
+def _proc_children():
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The process name may contain spaces, fields resume after the last ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all of its descendants, or None if unknown"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            total = root.memory_info().rss
+            for child in root.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total
+        except psutil.Error:
+            return None
+
+    if not os.path.isdir('/proc'):
+        return None
+    children = _proc_children()
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            if current == pid:
+                return None
+        stack.extend(children.get(current, []))
+    return total
+
+
+def driver_rss(driver):
+    """RSS of a Chrome session: chromedriver plus the browser processes it spawned"""
+    try:
+        return process_tree_rss(driver.service.process.pid)
+    except AttributeError:
+        return None
+
+
+def ping_driver(driver, timeout):
+    """Check that a browser still answers commands within `timeout` seconds"""
+    result = {}
+
+    def ping():
+        try:
+            driver.execute_script('return 1;')
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = e
+
+    # A hung Chrome can block a command forever, so never ping from the caller's thread
+    thread = threading.Thread(target=ping, name='browser-ping', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result.get('ok', False)
+
+
+def quit_driver(driver, index=None):
+    """Quit a browser without letting a hung one block the caller"""
+    def quit():
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Error quitting browser {index}: {str(e)}")
+    threading.Thread(target=quit, name='browser-quit', daemon=True).start()
+
+
+class BrowserSlot:
+    """A single pooled browser and its health state"""
+    IDLE = 'idle'
+    BUSY = 'busy'
+    RESERVED = 'reserved'
+    UNHEALTHY = 'unhealthy'
+
+    def __init__(self, index):
+        self.index = index
+        self.driver = None
+        self.state = BrowserSlot.IDLE
+        self.requests = 0
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.last_error = None
+        self.started_at = None
+        self.checked_out_at = None
+        # Health of the current browser, reset whenever it is replaced
+        self.driver_requests = 0
+        self.rss = None
+        self.last_ping = None
+        self.recycled = 0
+        self.last_recycle_reason = None
+
+    def attach(self, driver):
+        self.driver = driver
+        self.started_at = time.time()
+        self.driver_requests = 0
+        self.rss = None
+        self.last_ping = None
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "state": self.state,
+            "running": self.driver is not None,
+            "requests": self.requests,
+            "driver_requests": self.driver_requests,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "last_error": self.last_error,
+            "started_at": self.started_at,
+            "rss_mb": round(self.rss / (1024 * 1024), 1) if self.rss is not None else None,
+            "last_ping": self.last_ping,
+            "recycled": self.recycled,
+            "last_recycle_reason": self.last_recycle_reason
+        }
+
+
+class BrowserPool:
+    """Fixed-size pool of Chrome sessions with a bounded wait queue
+
+    A watchdog thread recycles browsers that served too many requests, grew
+    too large, keep failing or stop answering, swapping in a pre-launched
+    spare so no request waits for Chrome to start.
+    """
+    def __init__(self, size, max_waiters, checkout_timeout, driver_factory=create_driver,
+                 max_requests=0, max_rss_mb=0, max_failures=0, watchdog_interval=0,
+                 ping_timeout=5, warm_spare=False):
+        self.size = max(1, size)
+        self.max_waiters = max_waiters
+        self.checkout_timeout = checkout_timeout
+        self.driver_factory = driver_factory
+        self.max_requests = max_requests
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_failures = max_failures
+        self.watchdog_interval = watchdog_interval
+        self.ping_timeout = ping_timeout
+        self.warm_spare = warm_spare
+        self.slots = [BrowserSlot(i) for i in range(self.size)]
+        self._idle = list(self.slots)
+        self._waiters = 0
+        self._cond = threading.Condition()
+        self._spare = None
+        self._spare_lock = threading.Lock()
+        self._watchdog = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self.recycled = 0
+        self.spares_used = 0
+
+    def checkout(self, timeout=None):
+        """Take a browser slot out of the pool, waiting up to `timeout` seconds"""
+        self._ensure_watchdog()
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if not self._idle:
+                if self._waiters >= self.max_waiters:
+                    raise PoolExhausted('All browsers are busy and the wait queue is full')
+                self._waiters += 1
+                try:
+                    while not self._idle:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolExhausted('Timed out waiting for a free browser')
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            # Prefer slots that already have a running browser
+            self._idle.sort(key=lambda s: s.driver is None)
+            slot = self._idle.pop(0)
+            slot.state = BrowserSlot.BUSY
+            slot.checked_out_at = time.time()
+
+        try:
+            if slot.driver is None:
+                slot.attach(self._take_spare() or self.driver_factory())
+        except Exception as e:
+            self.checkin(slot, error=e)
+            raise
+        slot.requests += 1
+        slot.driver_requests += 1
+        return slot
+
+    def checkin(self, slot, error=None):
+        """Return a slot to the pool, discarding its browser if the session broke"""
+        healthy = not is_fatal_error(error)
+        if error is None:
+            slot.consecutive_failures = 0
+        else:
+            slot.consecutive_failures += 1
+            slot.total_failures += 1
+            slot.last_error = str(error)
+        if not healthy or slot.driver is None:
+            healthy = False
+            self._quit(slot)
+        else:
+            reason = self._recycle_reason(slot)
+            if reason:
+                self._recycle(slot, reason)
+
+        with self._cond:
+            slot.state = BrowserSlot.IDLE if healthy else BrowserSlot.UNHEALTHY
+            slot.checked_out_at = None
+            self._idle.append(slot)
+            self._cond.notify()
+
+    @contextmanager
+    def browser(self, timeout=None):
+        """Check out a slot for the duration of a `with` block"""
+        slot = self.checkout(timeout)
+        try:
+            yield slot
+        except Exception as e:
+            self.checkin(slot, error=e)
+            raise
+        except BaseException:
+            self.checkin(slot)
+            raise
+        else:
+            self.checkin(slot)
+
+    def get_stats(self):
+        """Get a snapshot of the pool state"""
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": self.size - len(self._idle),
+                "waiting": self._waiters,
+                "max_waiters": self.max_waiters,
+                "spare_ready": self._spare is not None,
+                "recycled": self.recycled,
+                "spares_used": self.spares_used,
+                "slots": [slot.to_dict() for slot in self.slots]
+            }
+
+    def _recycle_reason(self, slot):
+        if self.max_requests and slot.driver_requests >= self.max_requests:
+            return f'served {slot.driver_requests} requests'
+        if self.max_failures and slot.consecutive_failures >= self.max_failures:
+            return f'{slot.consecutive_failures} consecutive failures'
+        if self.max_rss and slot.rss is not None and slot.rss >= self.max_rss:
+            return f'RSS {slot.rss // (1024 * 1024)} MB'
+        return None
+
+    def _recycle(self, slot, reason):
+        # The caller owns the slot, so nobody else is driving this browser
+        print(f"Recycling browser {slot.index}: {reason}")
+        old_driver = slot.driver
+        slot.driver = None
+        spare = self._take_spare()
+        if spare:
+            slot.attach(spare)
+        slot.recycled += 1
+        slot.last_recycle_reason = reason
+        slot.consecutive_failures = 0
+        with self._cond:
+            self.recycled += 1
+        if old_driver:
+            quit_driver(old_driver, slot.index)
+        self._wake.set()
+
+    def _take_spare(self):
+        with self._spare_lock:
+            spare, self._spare = self._spare, None
+        if spare:
+            with self._cond:
+                self.spares_used += 1
+            # Start launching the next spare straight away
+            self._wake.set()
+        return spare
+
+    def _ensure_spare(self):
+        if not self.warm_spare or self._stopped:
+            return
+        with self._spare_lock:
+            if self._spare is not None:
+                return
+        try:
+            spare = self.driver_factory()
+        except Exception as e:
+            print(f"Error launching spare browser: {str(e)}")
+            return
+        with self._spare_lock:
+            if self._spare is None and not self._stopped:
+                self._spare, spare = spare, None
+        if spare:
+            quit_driver(spare)
+
+    def _borrow_idle(self, slot):
+        # Take an idle slot away from checkout while the watchdog inspects it
+        with self._cond:
+            if slot not in self._idle or slot.state != BrowserSlot.IDLE or slot.driver is None:
+                return False
+            self._idle.remove(slot)
+            slot.state = BrowserSlot.BUSY
+            return True
+
+    def _give_back(self, slot):
+        with self._cond:
+            slot.state = BrowserSlot.IDLE if slot.driver is not None else BrowserSlot.UNHEALTHY
+            self._idle.append(slot)
+            self._cond.notify()
+
+    def inspect(self):
+        """Measure every idle browser and recycle the ones past their limits"""
+        for slot in self.slots:
+            if self._stopped or not self._borrow_idle(slot):
+                continue
+            try:
+                slot.rss = driver_rss(slot.driver)
+                if ping_driver(slot.driver, self.ping_timeout):
+                    slot.last_ping = time.time()
+                    reason = self._recycle_reason(slot)
+                else:
+                    reason = f'no answer within {self.ping_timeout}s'
+                if reason:
+                    self._recycle(slot, reason)
+            except Exception as e:
+                print(f"Error inspecting browser {slot.index}: {str(e)}")
+            finally:
+                self._give_back(slot)
+        self._ensure_spare()
+
+    def _ensure_watchdog(self):
+        if not self.watchdog_interval or self._stopped:
+            return
+        with self._cond:
+            if self._watchdog and self._watchdog.is_alive():
+                return
+            self._watchdog = threading.Thread(target=self._watchdog_loop, name='browser-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watchdog_loop(self):
+        while not self._stopped:
+            try:
+                self.inspect()
+            except Exception as e:
+                print(f"Error in browser watchdog: {str(e)}")
+            self._wake.wait(self.watchdog_interval)
+            self._wake.clear()
+
+    def _quit(self, slot):
+        driver, slot.driver = slot.driver, None
+        slot.started_at = None
+        if driver:
+            try:
+                driver.quit()
+            except Exception as e:
+                print(f"Error quitting browser {slot.index}: {str(e)}")
+
+    def shutdown(self):
+        """Quit every browser in the pool"""
+        self._stopped = True
+        self._wake.set()
+        with self._spare_lock:
+            spare, self._spare = self._spare, None
+        if spare:
+            try:
+                spare.quit()
+            except Exception as e:
+                print(f"Error quitting spare browser: {str(e)}")
+        for slot in self.slots:
+            self._quit(slot)
+
+
+# Create global instance for use across the application
+browser_pool = BrowserPool(
+    size=Config.BROWSER_POOL_SIZE,
+    max_waiters=Config.BROWSER_POOL_MAX_WAITERS,
+    checkout_timeout=Config.BROWSER_POOL_CHECKOUT_TIMEOUT,
+    max_requests=Config.BROWSER_MAX_REQUESTS,
+    max_rss_mb=Config.BROWSER_MAX_RSS_MB,
+    max_failures=Config.BROWSER_MAX_CONSECUTIVE_FAILURES,
+    watchdog_interval=Config.BROWSER_WATCHDOG_INTERVAL,
+    ping_timeout=Config.BROWSER_PING_TIMEOUT,
+    warm_spare=Config.BROWSER_WARM_SPARE
+)
@@ -0,0 +1,110 @@
+from io import BytesIO
+
+from config import Config
+
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp')
+]
+
+# Output formats a client can ask for with ?format=
+FORMATS = ('original', 'png', 'gray', 'palette', 'webp')
+
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/bmp': 'bmp',
+    'image/webp': 'webp'
+}
+
+
+def detect_mimetype(data):
+    """Guess an image's type from its leading bytes"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def parse_accept(accept):
+    """Map each media range in an Accept header to its q value"""
+    ranges = {}
+    for part in (accept or '').split(','):
+        media_type, _, params = part.strip().partition(';')
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges[media_type.strip().lower()] = quality
+    return ranges
+
+
+def accepts(ranges, mimetype):
+    if not ranges:
+        return True
+    major = mimetype.split('/')[0]
+    for candidate in (mimetype, f'{major}/*', '*/*'):
+        if candidate in ranges:
+            return ranges[candidate] > 0
+    return False
+
+
+def choose_format(data, accept=None, requested=None):
+    """Pick the output format for a captcha from ?format= or the Accept header"""
+    if requested in FORMATS:
+        return requested
+    if Config.CAPTCHA_OUTPUT_FORMAT != 'auto':
+        return Config.CAPTCHA_OUTPUT_FORMAT
+
+    ranges = parse_accept(accept)
+    # Only an explicit image/webp counts, wildcards are too common to mean it
+    if ranges.get('image/webp', 0) > 0:
+        return 'webp'
+    if accepts(ranges, detect_mimetype(data)):
+        return 'original'
+    return 'png'
+
+
+def encode_captcha(data, output_format):
+    """Re-encode captcha bytes, returning (bytes, mimetype)"""
+    if output_format == 'original':
+        return data, detect_mimetype(data)
+    if output_format == 'png' and detect_mimetype(data) == 'image/png':
+        return data, 'image/png'
+
+    try:
+        # Most captchas go out untouched, so only pay for Pillow when re-encoding
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        output = BytesIO()
+        if output_format == 'gray':
+            image.convert('L').save(output, format='PNG', optimize=True)
+        elif output_format == 'palette':
+            image.convert('RGB').quantize(colors=Config.CAPTCHA_PALETTE_COLORS).save(output, format='PNG', optimize=True)
+        elif output_format == 'webp':
+            image.convert('RGB').save(output, format='WEBP', quality=Config.CAPTCHA_WEBP_QUALITY, method=4)
+        else:
+            image.save(output, format='PNG')
+    except Exception as e:
+        # The original bytes are always a usable answer
+        print(f"Error re-encoding captcha as {output_format}: {str(e)}")
+        return data, detect_mimetype(data)
+    return output.getvalue(), 'image/webp' if output_format == 'webp' else 'image/png'
+
+
+def render_captcha(data, accept=None, requested=None):
+    """Encode a captcha for a client, returning (bytes, mimetype)"""
+    return encode_captcha(data, choose_format(data, accept, requested))
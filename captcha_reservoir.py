@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+
+from config import Config
+from engines import PoolExhausted
+from upstream import engine
+
+
+class ReservoirEntry:
+    """An engine lease that already holds a fresh captcha"""
+    def __init__(self, lease, image):
+        self.lease = lease
+        self.image = image
+        self.loaded_at = time.time()
+
+    def age(self, now=None):
+        return (now or time.time()) - self.loaded_at
+
+
+class CaptchaReservoir:
+    """Background filler that keeps pre-loaded captchas ready to hand out"""
+    def __init__(self, engine, size, max_age, refill_interval):
+        self.engine = engine
+        # Always leave one session free for on-demand work
+        self.size = max(0, min(size, engine.get_stats().get('size', size + 1) - 1))
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self._entries = deque()
+        self._pending_since = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._filler = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.load_failures = 0
+        self._refills = 0
+        self._refill_lag_total = 0.0
+        self._last_refill_lag = None
+        self._load_time_total = 0.0
+        self._loads = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def take(self):
+        """Take a ready captcha entry, or None if the reservoir is empty"""
+        if not self.enabled:
+            return None
+        self.start()
+
+        now = time.time()
+        entry = None
+        stale = []
+        with self._lock:
+            while self._entries:
+                candidate = self._entries.popleft()
+                if candidate.age(now) < self.max_age:
+                    entry = candidate
+                    break
+                stale.append(candidate)
+            self.expired += len(stale)
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._pending_since.append(now)
+        for candidate in stale:
+            self.engine.release(candidate.lease)
+
+        self._wake.set()
+        return entry
+
+    def get_stats(self):
+        """Get hit rate and refill lag figures"""
+        with self._lock:
+            taken = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": self.size,
+                "ready": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / taken, 3) if taken else None,
+                "expired": self.expired,
+                "load_failures": self.load_failures,
+                "avg_refill_lag": round(self._refill_lag_total / self._refills, 3) if self._refills else None,
+                "last_refill_lag": round(self._last_refill_lag, 3) if self._last_refill_lag is not None else None,
+                "avg_load_time": round(self._load_time_total / self._loads, 3) if self._loads else None,
+                "max_age": self.max_age
+            }
+
+    def stop(self):
+        """Stop the filler and release every pre-loaded lease"""
+        self._stopped = True
+        self._wake.set()
+        with self._lock:
+            entries = list(self._entries)
+            self._entries.clear()
+        for entry in entries:
+            self.engine.release(entry.lease)
+
+    def start(self):
+        """Start the background filler if it is not already running"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._filler and self._filler.is_alive():
+                return
+            self._filler = threading.Thread(target=self._fill_loop, name='captcha-reservoir', daemon=True)
+            self._filler.start()
+
+    def _fill_loop(self):
+        while not self._stopped:
+            try:
+                self._refresh_stale()
+                self._fill()
+            except Exception as e:
+                print(f"Error filling captcha reservoir: {str(e)}")
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+
+    def _refresh_stale(self):
+        # Drop captchas before the upstream session forgets them; _fill replaces them
+        now = time.time()
+        with self._lock:
+            stale = [e for e in self._entries if e.age(now) >= self.max_age]
+            for entry in stale:
+                self._entries.remove(entry)
+            self.expired += len(stale)
+        for entry in stale:
+            self.engine.release(entry.lease)
+
+    def _fill(self):
+        while not self._stopped:
+            with self._lock:
+                if len(self._entries) >= self.size:
+                    return
+            if not self._load():
+                return
+
+    def _load(self):
+        started = time.time()
+        try:
+            lease, image = self.engine.open_captcha(timeout=0)
+        except PoolExhausted:
+            return False
+        except Exception as e:
+            print(f"Error pre-loading captcha: {str(e)}")
+            with self._lock:
+                self.load_failures += 1
+            return False
+
+        finished = time.time()
+        with self._lock:
+            self._loads += 1
+            self._load_time_total += finished - started
+            self._entries.append(ReservoirEntry(lease, image))
+            if self._pending_since:
+                lag = finished - self._pending_since.popleft()
+                self._refills += 1
+                self._refill_lag_total += lag
+                self._last_refill_lag = lag
+        return True
+
+
+# Create global instance for use across the application
+captcha_reservoir = CaptchaReservoir(
+    engine=engine,
+    size=Config.CAPTCHA_RESERVOIR_SIZE,
+    max_age=Config.CAPTCHA_RESERVOIR_MAX_AGE,
+    refill_interval=Config.CAPTCHA_RESERVOIR_REFILL_INTERVAL
+)
@@ -0,0 +1,134 @@
+import os
+import secrets
+import threading
+import time
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from config import Config
+from upstream import engine
+
+
+class TicketError(Exception):
+    """Raised when a captcha ticket cannot be redeemed"""
+    pass
+
+
+class CaptchaTicket:
+    """An engine lease pinned to the captcha it is currently showing"""
+    def __init__(self, ticket_id, lease, ttl):
+        self.id = ticket_id
+        self.lease = lease
+        self.issued_at = time.time()
+        self.expires_at = self.issued_at + ttl
+
+
+class CaptchaTicketStore:
+    """Signed tickets that route a captcha answer back to the session that served it"""
+    def __init__(self, engine, secret_key, ttl, reap_interval):
+        self.engine = engine
+        self.ttl = ttl
+        self.reap_interval = reap_interval
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='captcha-ticket')
+        self._tickets = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.issued = 0
+        self.redeemed = 0
+        self.reclaimed = 0
+
+    def issue(self, lease):
+        """Pin a lease and return the signed ticket for it"""
+        ticket = CaptchaTicket(secrets.token_urlsafe(12), lease, self.ttl)
+        with self._lock:
+            self._tickets[ticket.id] = ticket
+            self.issued += 1
+            self._ensure_reaper()
+        # The pid lets another worker reject tickets it cannot route
+        return self._serializer.dumps({'t': ticket.id, 'p': os.getpid()})
+
+    def redeem(self, token):
+        """Take the lease pinned by a ticket; the caller must release it afterwards"""
+        try:
+            payload = self._serializer.loads(token, max_age=self.ttl)
+        except SignatureExpired:
+            raise TicketError('Captcha token has expired, please request a new captcha')
+        except BadSignature:
+            raise TicketError('Invalid captcha token')
+
+        if payload.get('p') != os.getpid():
+            raise TicketError('Captcha token was issued by another worker')
+
+        with self._lock:
+            ticket = self._tickets.pop(payload.get('t'), None)
+            if ticket:
+                self.redeemed += 1
+        if not ticket:
+            raise TicketError('Captcha token has expired or was already used')
+        return ticket.lease
+
+    def issuer(self, token):
+        """The pid of the worker that issued a ticket, or None when the token does not verify"""
+        try:
+            return self._serializer.loads(token, max_age=self.ttl).get('p')
+        except BadSignature:
+            return None
+
+    def release(self, lease, error=None):
+        """Return a redeemed lease to the engine"""
+        self.engine.release(lease, error=error)
+
+    def discard(self, token):
+        """Give up a ticket without using it"""
+        try:
+            lease = self.redeem(token)
+        except TicketError:
+            return False
+        self.release(lease)
+        return True
+
+    def reap(self):
+        """Reclaim the leases of tickets that were never redeemed"""
+        now = time.time()
+        with self._lock:
+            expired = [t for t in self._tickets.values() if t.expires_at <= now]
+            for ticket in expired:
+                del self._tickets[ticket.id]
+            self.reclaimed += len(expired)
+        for ticket in expired:
+            self.engine.release(ticket.lease)
+        return len(expired)
+
+    def get_stats(self):
+        """Get ticket counters"""
+        with self._lock:
+            return {
+                "outstanding": len(self._tickets),
+                "issued": self.issued,
+                "redeemed": self.redeemed,
+                "reclaimed": self.reclaimed,
+                "ttl": self.ttl
+            }
+
+    def _ensure_reaper(self):
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name='captcha-ticket-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error reclaiming captcha tickets: {str(e)}")
+
+
+# Create global instance for use across the application
+ticket_store = CaptchaTicketStore(
+    engine=engine,
+    secret_key=Config.SECRET_KEY,
+    ttl=Config.CAPTCHA_TICKET_TTL,
+    reap_interval=Config.CAPTCHA_TICKET_REAP_INTERVAL
+)
@@ -21,3 +21,134 @@ class Config:
     # Default API key settings
     DEFAULT_KEY_EXPIRY_DAYS = 30
     DEFAULT_HIT_LIMIT = 1000
+
+    # Upstream verification site and the engine that talks to it ('selenium' or 'http')
+    UPSTREAM_URL = os.environ.get('UPSTREAM_URL') or 'https://everify.bdris.gov.bd/'
+    VERIFY_ENGINE = os.environ.get('VERIFY_ENGINE') or 'selenium'
+    HTTP_ENGINE_MAX_SESSIONS = int(os.environ.get('HTTP_ENGINE_MAX_SESSIONS', 32))
+    HTTP_ENGINE_TIMEOUT = float(os.environ.get('HTTP_ENGINE_TIMEOUT', 15))
+    # Check the upstream's TLS certificate in the HTTP engine (the browser engine keeps
+    # Chrome's --ignore-certificate-errors); only turn off for a test upstream
+    UPSTREAM_TLS_VERIFY = os.environ.get('UPSTREAM_TLS_VERIFY', 'true').lower() in ('1', 'true', 'yes')
+
+    # Browser pool
+    CHROME_DRIVER_PATH = os.environ.get('CHROME_DRIVER_PATH') or '/usr/bin/google-chrome'
+    CHROME_BINARY_PATH = os.environ.get('CHROME_BINARY_PATH')
+    # Remembers the chromedriver/Chrome paths that worked so cold starts skip resolving them
+    CHROMEDRIVER_CACHE_FILE = os.environ.get('CHROMEDRIVER_CACHE_FILE') or os.path.join(os.path.dirname(__file__), '.chromedriver_cache.json')
+    BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 2))
+    BROWSER_POOL_MAX_WAITERS = int(os.environ.get('BROWSER_POOL_MAX_WAITERS', 16))
+    BROWSER_POOL_CHECKOUT_TIMEOUT = float(os.environ.get('BROWSER_POOL_CHECKOUT_TIMEOUT', 30))
+
+    # Page loading: 'eager' stops waiting at DOMContentLoaded, and URLs matching these
+    # patterns are never fetched. The captcha (/DefaultCaptcha/Generate) has no file
+    # extension, so blocking images by extension leaves it alone.
+    BROWSER_PAGE_LOAD_STRATEGY = os.environ.get('BROWSER_PAGE_LOAD_STRATEGY') or 'eager'
+    BROWSER_BLOCKED_URLS = [p.strip() for p in os.environ.get(
+        'BROWSER_BLOCKED_URLS',
+        '*.css,*.woff,*.woff2,*.ttf,*.otf,*.eot,*.png,*.jpg,*.jpeg,*.gif,*.svg,*.ico,*.webp,'
+        '*.mp4,*google-analytics.com*,*googletagmanager.com*,*fonts.googleapis.com*,*fonts.gstatic.com*'
+    ).split(',') if p.strip()]
+
+    # Browser watchdog (0 disables a limit); a warm spare replaces recycled browsers instantly
+    BROWSER_MAX_REQUESTS = int(os.environ.get('BROWSER_MAX_REQUESTS', 200))
+    BROWSER_MAX_RSS_MB = int(os.environ.get('BROWSER_MAX_RSS_MB', 1024))
+    BROWSER_MAX_CONSECUTIVE_FAILURES = int(os.environ.get('BROWSER_MAX_CONSECUTIVE_FAILURES', 3))
+    BROWSER_WATCHDOG_INTERVAL = float(os.environ.get('BROWSER_WATCHDOG_INTERVAL', 15))
+    BROWSER_PING_TIMEOUT = float(os.environ.get('BROWSER_PING_TIMEOUT', 5))
+    BROWSER_WARM_SPARE = os.environ.get('BROWSER_WARM_SPARE', 'true').lower() in ('1', 'true', 'yes')
+
+    # Upstream circuit breaker: opens when, over the last BREAKER_WINDOW seconds and at
+    # least BREAKER_MIN_CALLS calls, the share of failed or slow calls reaches its rate;
+    # fails fast for BREAKER_OPEN_SECONDS, then lets probe calls through
+    BREAKER_ENABLED = os.environ.get('BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    BREAKER_WINDOW = float(os.environ.get('BREAKER_WINDOW', 60))
+    BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 10))
+    BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+    BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('BREAKER_SLOW_CALL_SECONDS', 15))
+    BREAKER_SLOW_RATE = float(os.environ.get('BREAKER_SLOW_RATE', 0.8))
+    BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+    BREAKER_HALF_OPEN_PROBES = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 1))
+    # Admission control: new captchas are refused with 503 + Retry-After once this many
+    # upstream calls are running or queued (0 disables the limit)
+    UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get('UPSTREAM_MAX_IN_FLIGHT', 24))
+
+    # Captcha tickets (pin a browser between /api/captcha and /api/verify)
+    CAPTCHA_TICKET_TTL = int(os.environ.get('CAPTCHA_TICKET_TTL', 120))
+    CAPTCHA_TICKET_REAP_INTERVAL = int(os.environ.get('CAPTCHA_TICKET_REAP_INTERVAL', 5))
+
+    # Captcha reservoir (keep MAX_AGE + CAPTCHA_TICKET_TTL below the upstream session lifetime)
+    CAPTCHA_RESERVOIR_SIZE = int(os.environ.get('CAPTCHA_RESERVOIR_SIZE', 1))
+    CAPTCHA_RESERVOIR_MAX_AGE = int(os.environ.get('CAPTCHA_RESERVOIR_MAX_AGE', 180))
+    CAPTCHA_RESERVOIR_REFILL_INTERVAL = float(os.environ.get('CAPTCHA_RESERVOIR_REFILL_INTERVAL', 1))
+
+    # Verification result cache (opt-in); records are encrypted with RESULT_CACHE_ENCRYPTION_KEY
+    # (a Fernet key) or a key derived from SECRET_KEY
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 600))
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 10000))
+    RESULT_CACHE_ENCRYPTION_KEY = os.environ.get('RESULT_CACHE_ENCRYPTION_KEY')
+
+    # Concurrent identical verifications share the first one's result instead of submitting
+    # their own captcha; set to false to make every verification solve its captcha
+    SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    # Concurrent identical verifications wait this long for the one already running
+    SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 30))
+
+    # Captcha images sent to clients: 'auto' negotiates via Accept, or one of
+    # original, png, gray, palette, webp; clients can override with ?format=
+    CAPTCHA_OUTPUT_FORMAT = os.environ.get('CAPTCHA_OUTPUT_FORMAT') or 'auto'
+    CAPTCHA_WEBP_QUALITY = int(os.environ.get('CAPTCHA_WEBP_QUALITY', 80))
+    CAPTCHA_PALETTE_COLORS = int(os.environ.get('CAPTCHA_PALETTE_COLORS', 16))
+
+    # /api/verify/batch: items per request and how many run at once (further
+    # capped by the engine's upstream sessions)
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 100))
+    BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 8))
+
+    # /api/jobs: background workers per process and how often idle ones poll
+    # the queue. Jobs carry a captcha token, so they run in the worker process
+    # that issued it; keep the queue shorter than CAPTCHA_TICKET_TTL
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    # A running job whose worker vanished is retried after this long, up to JOB_MAX_ATTEMPTS runs
+    JOB_RUNNING_TIMEOUT = int(os.environ.get('JOB_RUNNING_TIMEOUT', 300))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    # Finished jobs can be polled for this long
+    JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 86400))
+    # Webhook deliveries back off exponentially from JOB_WEBHOOK_BACKOFF seconds
+    JOB_WEBHOOK_TIMEOUT = float(os.environ.get('JOB_WEBHOOK_TIMEOUT', 10))
+    JOB_WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('JOB_WEBHOOK_MAX_ATTEMPTS', 6))
+    JOB_WEBHOOK_BACKOFF = float(os.environ.get('JOB_WEBHOOK_BACKOFF', 5))
+    JOB_WEBHOOK_MAX_BACKOFF = float(os.environ.get('JOB_WEBHOOK_MAX_BACKOFF', 600))
+
+    # API keys are checked from an in-process cache; admin changes made in this
+    # process apply at once, changes from other workers within
+    # KEY_CACHE_VERSION_INTERVAL seconds (0 checks on every request). Entries are
+    # reloaded after KEY_CACHE_TTL seconds to pick up other workers' hit counts
+    KEY_CACHE_TTL = float(os.environ.get('KEY_CACHE_TTL', 30))
+    KEY_CACHE_MAX_ENTRIES = int(os.environ.get('KEY_CACHE_MAX_ENTRIES', 1000))
+    KEY_CACHE_VERSION_INTERVAL = float(os.environ.get('KEY_CACHE_VERSION_INTERVAL', 1))
+
+    # API key hits are counted in memory and added to the database every
+    # HIT_FLUSH_INTERVAL seconds, or once HIT_FLUSH_THRESHOLD hits are waiting
+    HIT_FLUSH_INTERVAL = float(os.environ.get('HIT_FLUSH_INTERVAL', 1))
+    HIT_FLUSH_THRESHOLD = int(os.environ.get('HIT_FLUSH_THRESHOLD', 100))
+
+    # User activity rows are queued and written in batches by a background thread.
+    # ACTIVITY_OVERFLOW is drop_newest, drop_oldest or block (waits up to
+    # ACTIVITY_BLOCK_TIMEOUT seconds); ACTIVITY_QUEUE_SIZE=0 writes inline
+    ACTIVITY_QUEUE_SIZE = int(os.environ.get('ACTIVITY_QUEUE_SIZE', 10000))
+    ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE', 500))
+    ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 1))
+    ACTIVITY_OVERFLOW = os.environ.get('ACTIVITY_OVERFLOW') or 'drop_newest'
+    ACTIVITY_BLOCK_TIMEOUT = float(os.environ.get('ACTIVITY_BLOCK_TIMEOUT', 0.5))
+
+    # Request stats are counted in memory and added to the stats tables every
+    # STATS_FLUSH_INTERVAL seconds (0 writes each request inline)
+    STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 5))
+
+    # Per-stage timings: Server-Timing response headers and a Prometheus /metrics
+    # endpoint (per process). METRICS_TOKEN, when set, is required as a bearer token
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
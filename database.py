@@ -1,10 +1,99 @@
 import sqlite3
 import json
+import threading
 from datetime import datetime
 import os
 
 DB_PATH = 'app.db'
 
+# Encrypted verification results, keyed by an HMAC of (registration number, date of birth)
+VERIFICATION_CACHE_SCHEMA = '''CREATE TABLE IF NOT EXISTS verification_cache (
+        cache_key TEXT PRIMARY KEY,
+        payload BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )'''
+
+# Verification jobs queued through /api/jobs and the webhook deliveries of their results
+JOBS_SCHEMA = '''CREATE TABLE IF NOT EXISTS verification_jobs (
+        id TEXT PRIMARY KEY,
+        api_key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        payload TEXT,
+        result TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        claimed_by TEXT,
+        pinned_to TEXT,
+        webhook_url TEXT,
+        webhook_status TEXT,
+        webhook_attempts INTEGER NOT NULL DEFAULT 0,
+        next_webhook_at REAL,
+        webhook_error TEXT
+    )'''
+
+JOBS_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_verification_jobs_status ON verification_jobs (status, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_verification_jobs_webhook ON verification_jobs (webhook_status, next_webhook_at)'
+]
+
+RATE_LIMIT_SCHEMA = '''CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        key_id TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )'''
+
+# Bumped by every change an admin makes to api_keys, so each worker knows to drop its cached keys
+API_KEY_VERSION_SCHEMA = '''CREATE TABLE IF NOT EXISTS api_key_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )'''
+
+# Tables added after the first release, created on existing databases by migrate_schema
+MIGRATED_TABLES = [
+    VERIFICATION_CACHE_SCHEMA,
+    'CREATE INDEX IF NOT EXISTS idx_verification_cache_access ON verification_cache (last_access)',
+    JOBS_SCHEMA,
+    *JOBS_INDEXES,
+    RATE_LIMIT_SCHEMA,
+    API_KEY_VERSION_SCHEMA
+]
+
+# Columns added after the first release, created on existing databases by migrate_schema
+API_KEY_COLUMNS = [
+    ('webhook_url', 'TEXT'),
+    ('rate_limit_rps', 'REAL NOT NULL DEFAULT 0'),
+    ('rate_limit_burst', 'INTEGER NOT NULL DEFAULT 0')
+]
+
+JOB_COLUMNS = [
+    ('pinned_to', 'TEXT')
+]
+
+MIGRATED_COLUMNS = {
+    'api_keys': API_KEY_COLUMNS,
+    'verification_jobs': JOB_COLUMNS
+}
+
+_schema_migrated = False
+_schema_lock = threading.Lock()
+
+def migrate_schema(conn):
+    """Add tables and columns introduced since a database was created"""
+    for schema in MIGRATED_TABLES:
+        conn.execute(schema)
+    for table, columns in MIGRATED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if existing:
+            for name, definition in columns:
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    conn.commit()
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -28,7 +117,10 @@ def init_db():
         hits_used INTEGER NOT NULL DEFAULT 0,
         allowed_origins TEXT NOT NULL,
         created_at TEXT NOT NULL,
-        active BOOLEAN NOT NULL DEFAULT true
+        active BOOLEAN NOT NULL DEFAULT true,
+        webhook_url TEXT,
+        rate_limit_rps REAL NOT NULL DEFAULT 0,
+        rate_limit_burst INTEGER NOT NULL DEFAULT 0
     )''')
 
     # Create stats table
@@ -66,6 +158,9 @@ def init_db():
         ip_address TEXT
     )''')
 
+    # Create the verification_cache, verification_jobs, rate_limit_buckets and api_key_version tables
+    migrate_schema(conn)
+
     # Insert initial stats record if not exists
     c.execute('INSERT OR IGNORE INTO stats (id, total_requests, successful_requests, failed_requests) VALUES (1, 0, 0, 0)')
     
@@ -135,8 +230,15 @@ def migrate_data():
     conn.close()
 
 def get_db():
+    global _schema_migrated
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
+    if not _schema_migrated:
+        # The app never runs init_db, so bring older databases up to date on first use
+        with _schema_lock:
+            if not _schema_migrated:
+                migrate_schema(conn)
+                _schema_migrated = True
     return conn
 
 # User functions
@@ -170,6 +272,30 @@ def update_api_key_hits(key_id, hits):
     conn.commit()
     conn.close()
 
+def add_api_key_hits(increments):
+    """Add hits to several keys in one transaction, {key_id: hits}"""
+    conn = get_db()
+    try:
+        # Relative updates, so increments from other workers are never overwritten
+        conn.executemany('UPDATE api_keys SET hits_used = hits_used + ? WHERE id = ?',
+                         [(hits, key_id) for key_id, hits in increments.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_api_key_version():
+    conn = get_db()
+    try:
+        row = conn.execute('SELECT version FROM api_key_version WHERE id = 1').fetchone()
+    finally:
+        conn.close()
+    return row['version'] if row else 0
+
+def bump_api_key_version(conn):
+    """Mark cached keys stale in every worker; part of the caller's transaction"""
+    conn.execute('''INSERT INTO api_key_version (id, version) VALUES (1, 1)
+        ON CONFLICT(id) DO UPDATE SET version = version + 1''')
+
 def get_all_api_keys():
     conn = get_db()
     api_keys = conn.execute('SELECT * FROM api_keys').fetchall()
@@ -205,59 +331,92 @@ def get_stats():
     return result
 
 def update_stats(success):
+    add_stats(1 if success else 0, 0 if success else 1)
+
+def add_stats(successful, failed):
+    """Add several requests to the counters in one write"""
+    add_hourly_stats({datetime.now().strftime('%Y-%m-%d %H'): (successful, failed)})
+
+def add_hourly_stats(counts):
+    """Add request counts to all counters in one transaction
+
+    counts maps an hour ('YYYY-mm-dd HH') to (successful, failed). Every
+    statement adds to what is stored, so concurrent writers never lose counts.
+    """
+    daily = {}
+    for hour, (successful, failed) in counts.items():
+        day = daily.setdefault(hour[:10], [0, 0])
+        day[0] += successful
+        day[1] += failed
+    successful = sum(day[0] for day in daily.values())
+    failed = sum(day[1] for day in daily.values())
+
     conn = get_db()
-    now = datetime.now()
-    today = now.strftime('%Y-%m-%d')
-    current_hour = now.strftime('%Y-%m-%d %H')
-    
-    # Update overall stats
-    conn.execute('''UPDATE stats SET 
-        total_requests = total_requests + 1,
-        successful_requests = successful_requests + ?,
-        failed_requests = failed_requests + ?
-        WHERE id = 1''', (1 if success else 0, 0 if success else 1))
-
-    # Update or create daily stats
-    conn.execute('''INSERT INTO daily_stats (date, total, successful, failed)
-        VALUES (?, 1, ?, ?)
-        ON CONFLICT(date) DO UPDATE SET
-        total = total + 1,
-        successful = successful + ?,
-        failed = failed + ?''',
-        (today, 1 if success else 0, 0 if success else 1,
-         1 if success else 0, 0 if success else 1))
-    
-    # Update or create hourly stats
-    conn.execute('''INSERT INTO hourly_stats (hour, total, successful, failed)
-        VALUES (?, 1, ?, ?)
-        ON CONFLICT(hour) DO UPDATE SET
-        total = total + 1,
-        successful = successful + ?,
-        failed = failed + ?''',
-        (current_hour, 1 if success else 0, 0 if success else 1,
-         1 if success else 0, 0 if success else 1))
-    
-    conn.commit()
-    conn.close()
+    try:
+        # Update overall stats
+        conn.execute('''UPDATE stats SET 
+            total_requests = total_requests + ?,
+            successful_requests = successful_requests + ?,
+            failed_requests = failed_requests + ?
+            WHERE id = 1''', (successful + failed, successful, failed))
+
+        # Update or create daily stats
+        conn.executemany('''INSERT INTO daily_stats (date, total, successful, failed)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+            total = total + excluded.total,
+            successful = successful + excluded.successful,
+            failed = failed + excluded.failed''',
+            [(date, s + f, s, f) for date, (s, f) in daily.items()])
+
+        # Update or create hourly stats
+        conn.executemany('''INSERT INTO hourly_stats (hour, total, successful, failed)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(hour) DO UPDATE SET
+            total = total + excluded.total,
+            successful = successful + excluded.successful,
+            failed = failed + excluded.failed''',
+            [(hour, s + f, s, f) for hour, (s, f) in counts.items()])
+
+        conn.commit()
+    finally:
+        conn.close()
 
 # User activity functions
-def log_activity(api_key, event_type, details, success, ip_address="N/A"):
+ACTIVITY_INSERT = '''INSERT INTO user_activity 
+        (timestamp, api_key, event_type, details, success, ip_address)
+        VALUES (?, ?, ?, ?, ?, ?)'''
+
+def activity_row(api_key, event_type, details, success, ip_address="N/A"):
+    """The user_activity row for an event, or None when it isn't logged"""
     # Skip logging if there's no name in the details
     if not details or not details.get('nameEn'):
         return None
-    conn = get_db()
     timestamp = datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')
+    return (timestamp, api_key, event_type, json.dumps(details), success, ip_address)
+
+def log_activity(api_key, event_type, details, success, ip_address="N/A"):
+    row = activity_row(api_key, event_type, details, success, ip_address)
+    if row is None:
+        return None
+    conn = get_db()
     
-    c = conn.execute('''INSERT INTO user_activity 
-        (timestamp, api_key, event_type, details, success, ip_address)
-        VALUES (?, ?, ?, ?, ?, ?)''',
-        (timestamp, api_key, event_type, json.dumps(details), success, ip_address))
+    c = conn.execute(ACTIVITY_INSERT, row)
     
     activity_id = c.lastrowid
     conn.commit()
     conn.close()
     return activity_id
 
+def log_activities(rows):
+    """Insert many activity rows in one transaction"""
+    conn = get_db()
+    try:
+        conn.executemany(ACTIVITY_INSERT, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
 def delete_user_activity(activity_id):
     """Delete a specific user activity by ID"""
     conn = get_db()
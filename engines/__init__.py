@@ -0,0 +1,14 @@
+# Backends that talk to the upstream verification site
+from engines.base import VerificationEngine, PoolExhausted, UpstreamError
+from engines.guarded import GuardedEngine, CircuitBreaker, UpstreamUnavailable
+
+
+def create_engine(name):
+    """Build the verification engine selected for this deployment"""
+    if name == 'selenium':
+        from engines.selenium_engine import create_selenium_engine
+        return create_selenium_engine()
+    if name == 'http':
+        from engines.http_engine import create_http_engine
+        return create_http_engine()
+    raise ValueError(f"Unknown verification engine: {name}")
@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolExhausted(Exception):
+    """Raised when no upstream session could be checked out of a pool"""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamError(Exception):
+    """Raised when the upstream form rejects a submission (e.g. a wrong captcha)"""
+    pass
+
+
+class VerificationEngine:
+    """Interface for the backends that talk to the upstream verification site
+
+    A lease is an engine-specific handle (a browser slot, an HTTP session)
+    that stays bound to the captcha it was opened with until it is released.
+    """
+    name = None
+    # Threads used to run blocking engine calls for the async request path
+    blocking_workers = 4
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def open_captcha(self, timeout=None):
+        """Load a fresh form and return (lease, captcha_image_bytes) in whatever format the upstream served"""
+        raise NotImplementedError
+
+    def submit(self, lease, reg_number, dob, captcha):
+        """Submit the form on a lease and return the raw result fields"""
+        raise NotImplementedError
+
+    def checkout(self, timeout=None):
+        """Take a lease showing whatever captcha it loaded last (requests without a ticket)"""
+        raise UpstreamError('A captcha token is required, please request a captcha first')
+
+    def release(self, lease, error=None):
+        """Return a lease to the engine once it is no longer needed"""
+        raise NotImplementedError
+
+    async def aopen_captcha(self, timeout=None):
+        """Async variant of open_captcha"""
+        return await self._run_blocking(self.open_captcha, timeout)
+
+    async def asubmit(self, lease, reg_number, dob, captcha):
+        """Async variant of submit"""
+        return await self._run_blocking(self.submit, lease, reg_number, dob, captcha)
+
+    async def arelease(self, lease, error=None):
+        """Async variant of release"""
+        return await self._run_blocking(self.release, lease, error)
+
+    async def _run_blocking(self, func, *args):
+        # Waiting callers queue on the event loop, only running calls hold a thread
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.blocking_workers,
+                    thread_name_prefix=f'{self.name}-engine'
+                )
+        loop = asyncio.get_running_loop()
+        # Carry context variables over, as asyncio.to_thread does, so spans reach the request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args))
+
+    def get_stats(self):
+        """Get a snapshot of the engine state"""
+        return {"engine": self.name}
+
+    def shutdown(self):
+        """Close every upstream session"""
+        pass
@@ -0,0 +1,234 @@
+import threading
+import time
+from collections import deque
+
+from engines.base import VerificationEngine, PoolExhausted, UpstreamError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(PoolExhausted):
+    """Raised without touching the upstream while the breaker is open or load is being shed"""
+    pass
+
+
+class CircuitBreaker:
+    """Tracks upstream call outcomes over a sliding time window
+
+    Closed: calls go through. Once the window holds min_calls and either the
+    share of failed calls reaches failure_rate or the share of slow calls
+    reaches slow_rate, the breaker opens and calls fail fast for
+    open_seconds. It then half-opens and lets half_open_probes calls
+    through: one success closes it, one failure opens it again.
+    """
+    def __init__(self, window, min_calls, failure_rate, slow_call_seconds, slow_rate, open_seconds,
+                 half_open_probes):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_trip_reason = None
+        self._calls = deque()
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    def _prune(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def retry_after(self, now=None):
+        if self.state != OPEN:
+            return 1
+        return max(1, int(self.opened_at + self.open_seconds - (now or time.time())) + 1)
+
+    def allow(self):
+        """Reserve a call, or raise UpstreamUnavailable while open"""
+        now = time.time()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_after = self.retry_after(now)
+        raise UpstreamUnavailable('The verification site is not responding, please try again later',
+                                  retry_after=retry_after)
+
+    def record(self, duration, failed, counted=True):
+        """Record the outcome of a call that allow() let through
+
+        Calls that say nothing about the upstream (counted=False) only give
+        back their probe slot.
+        """
+        now = time.time()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if not counted:
+                if self.state == HALF_OPEN:
+                    self._probes = max(0, self._probes - 1)
+                return
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._trip(now, 'probe failed' if failed else 'probe slow')
+                else:
+                    self.state = CLOSED
+                    self._calls.clear()
+                return
+
+            self._calls.append((now, failed, slow))
+            self._prune(now)
+            if self.state != CLOSED or len(self._calls) < self.min_calls:
+                return
+            failures = sum(1 for call in self._calls if call[1])
+            slow_calls = sum(1 for call in self._calls if call[2])
+            if failures / len(self._calls) >= self.failure_rate:
+                self._trip(now, f'{failures}/{len(self._calls)} calls failed')
+            elif slow_calls / len(self._calls) >= self.slow_rate:
+                self._trip(now, f'{slow_calls}/{len(self._calls)} calls slower than {self.slow_call_seconds}s')
+
+    def _trip(self, now, reason):
+        self.state = OPEN
+        self.opened_at = now
+        self.last_trip_reason = reason
+        self.trips += 1
+        self._calls.clear()
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(sum(1 for call in self._calls if call[1]) / calls, 3) if calls else None,
+                "slow_rate": round(sum(1 for call in self._calls if call[2]) / calls, 3) if calls else None,
+                "retry_after": self.retry_after(now) if self.state == OPEN else None,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "last_trip_reason": self.last_trip_reason
+            }
+
+
+class GuardedEngine(VerificationEngine):
+    """Wraps an engine with a circuit breaker and an admission limit
+
+    Only upstream trouble feeds the breaker: a rejected submission (wrong
+    captcha) and a full pool say nothing about the upstream's health. New
+    captcha loads are refused once max_in_flight calls are already running
+    or queued for a session, with a Retry-After estimated from the backlog;
+    submissions are always let in, the client already holds a captcha.
+    """
+    def __init__(self, engine, breaker, max_in_flight):
+        self.engine = engine
+        self.name = engine.name
+        self.blocking_workers = engine.blocking_workers
+        self.breaker = breaker
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._latency = None
+        self.shed = 0
+
+    def __getattr__(self, name):
+        # Engine-specific helpers (e.g. the browser pool) stay reachable
+        return getattr(self.engine, name)
+
+    def _admit(self, admission):
+        with self._lock:
+            if admission and self.max_in_flight and self._in_flight >= self.max_in_flight:
+                self.shed += 1
+                capacity = max(1, self.blocking_workers)
+                retry_after = max(1, int(self._in_flight * (self._latency or 1) / capacity))
+                raise UpstreamUnavailable('The service is busy, please try again later', retry_after=retry_after)
+            self._in_flight += 1
+        try:
+            self.breaker.allow()
+        except UpstreamUnavailable:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        return time.perf_counter()
+
+    def _done(self, started, error):
+        duration = time.perf_counter() - started
+        with self._lock:
+            self._in_flight -= 1
+            # Smoothed latency for the Retry-After estimate
+            self._latency = duration if self._latency is None else 0.9 * self._latency + 0.1 * duration
+        # A full pool is our own backlog, not the upstream's
+        self.breaker.record(duration, failed=error is not None and not isinstance(error, UpstreamError),
+                            counted=not isinstance(error, PoolExhausted))
+
+    def _call(self, admission, func, *args):
+        started = self._admit(admission)
+        error = None
+        try:
+            return func(*args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._done(started, error)
+
+    async def _acall(self, admission, func, *args):
+        started = self._admit(admission)
+        error = None
+        try:
+            return await func(*args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._done(started, error)
+
+    def open_captcha(self, timeout=None):
+        return self._call(True, self.engine.open_captcha, timeout)
+
+    def submit(self, lease, reg_number, dob, captcha):
+        return self._call(False, self.engine.submit, lease, reg_number, dob, captcha)
+
+    def checkout(self, timeout=None):
+        return self.engine.checkout(timeout)
+
+    def release(self, lease, error=None):
+        return self.engine.release(lease, error)
+
+    async def aopen_captcha(self, timeout=None):
+        return await self._acall(True, self.engine.aopen_captcha, timeout)
+
+    async def asubmit(self, lease, reg_number, dob, captcha):
+        return await self._acall(False, self.engine.asubmit, lease, reg_number, dob, captcha)
+
+    async def arelease(self, lease, error=None):
+        return await self.engine.arelease(lease, error)
+
+    def get_stats(self):
+        stats = self.engine.get_stats()
+        with self._lock:
+            admission = {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "shed": self.shed,
+                "avg_latency": round(self._latency, 3) if self._latency is not None else None
+            }
+        stats["breaker"] = self.breaker.get_stats()
+        stats["admission"] = admission
+        return stats
+
+    def shutdown(self):
+        self.engine.shutdown()
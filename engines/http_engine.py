@@ -0,0 +1,334 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urljoin
+
+import httpx
+from lxml import html as lxml_html
+
+from config import Config
+from engines.base import VerificationEngine, UpstreamError, PoolExhausted
+from metrics import metrics
+
+REQUEST_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/124.0 Safari/537.36'),
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
+}
+
+
+def _text(node):
+    return node.text_content().strip()
+
+
+def _rows(table):
+    # Same rows as HTMLTableElement.rows, whether or not the markup has a tbody
+    return table.xpath('./tr|./thead/tr|./tbody/tr|./tfoot/tr')
+
+
+def _cells(row):
+    return row.xpath('./td|./th')
+
+
+def _first(doc, xpath):
+    nodes = doc.xpath(xpath)
+    if not nodes and '/tbody' in xpath:
+        # Browsers insert tbody, the raw markup may not have it
+        nodes = doc.xpath(xpath.replace('/tbody', ''))
+    return nodes[0] if nodes else None
+
+
+def parse_form(page):
+    """Read the action and current field values of the verification form"""
+    doc = lxml_html.fromstring(page)
+    forms = doc.xpath('//form[@id="ubrnsearchform"]')
+    if not forms:
+        raise Exception('Verification form not found')
+    form = forms[0]
+
+    fields = {}
+    for field in form.xpath('.//input[@name]'):
+        if field.get('type', '').lower() in ('submit', 'button', 'image', 'reset'):
+            continue
+        fields[field.get('name')] = field.get('value', '')
+
+    captcha = doc.xpath('//img[@id="CaptchaImage"]/@src')
+    if not captcha:
+        raise Exception('Captcha image not found')
+    return form.get('action') or '', fields, captcha[0]
+
+
+def parse_verification_result(page):
+    """Extract the raw result fields, mirroring the browser extraction script"""
+    doc = lxml_html.fromstring(page)
+
+    errors = doc.xpath('//*[contains(concat(" ", normalize-space(@class), " "), " validation-summary-errors ")]')
+    if errors:
+        raise UpstreamError(' '.join(_text(errors[0]).split()))
+
+    tables = doc.xpath('//table')
+    if not tables:
+        raise Exception('Verification result not found')
+
+    data = {}
+    if len(tables) >= 2:
+        # Extract registration details
+        reg_rows = _rows(tables[0])
+        if len(reg_rows) >= 5:
+            reg_cells = _cells(reg_rows[2])
+            birth_cells = _cells(reg_rows[4])
+            if len(reg_cells) >= 3:
+                data['Registration Date'] = _text(reg_cells[0])
+                data['Registration Office'] = _text(reg_cells[1])
+                data['Issuance Date'] = _text(reg_cells[2])
+            if len(birth_cells) >= 3:
+                data['Date of Birth'] = _text(birth_cells[0])
+                data['Birth Registration Number'] = _text(birth_cells[1])
+                data['Sex'] = _text(birth_cells[2])
+
+        # Extract personal details
+        for row in _rows(tables[1]):
+            cells = _cells(row)
+            if len(cells) >= 4:
+                key_bengali, value_bengali, key_english, value_english = [_text(c) for c in cells[:4]]
+                if key_bengali and value_bengali:
+                    data[key_bengali] = value_bengali
+                if key_english and value_english:
+                    data[key_english] = value_english
+
+    address_node = _first(doc, '/html/body/div[2]/p[2]/span/em')
+    if address_node is not None:
+        address = _text(address_node)
+        if address.endswith('.'):
+            address = address[:-1].strip()
+        data['address'] = address
+
+    birth_place_node = _first(doc, '/html/body/div[2]/div/div[2]/div/table/tbody/tr[2]/td[4]')
+    if birth_place_node is not None:
+        data['birthPlaceEn'] = _text(birth_place_node)
+    return data
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _close_on_loop(transport, loop):
+    """Close an async transport on the event loop its connections belong to"""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        # Called from the loop itself, which cannot wait on its own work
+        loop.create_task(transport.aclose())
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(transport.aclose(), loop).result(timeout=5)
+    elif running is None:
+        # The loop has stopped; the sockets can still be closed from a fresh one
+        try:
+            asyncio.run(transport.aclose())
+        except RuntimeError:
+            pass
+
+
+class HttpLease:
+    """An upstream session (cookie jar plus form state) bound to one captcha"""
+    def __init__(self):
+        self.cookies = httpx.Cookies()
+        self.form_action = None
+        self.form_fields = {}
+        self.created_at = time.time()
+
+
+class HttpEngine(VerificationEngine):
+    """Talks to the upstream form directly over pooled HTTP connections"""
+    name = 'http'
+
+    def __init__(self, base_url, max_sessions, checkout_timeout, request_timeout, tls_verify=True):
+        self.base_url = base_url
+        self.max_sessions = max_sessions
+        self.checkout_timeout = checkout_timeout
+        self.request_timeout = request_timeout
+        self.tls_verify = tls_verify
+        self.limits = httpx.Limits(max_connections=max_sessions, max_keepalive_connections=max_sessions)
+        # Every lease keeps its own cookie jar but they all share one connection pool
+        self.transport = httpx.HTTPTransport(limits=self.limits, verify=tls_verify)
+        self.async_transport = None
+        self._async_loop = None
+        self._sessions = threading.BoundedSemaphore(max_sessions)
+        self._lock = threading.Lock()
+        # (loop, future) of coroutines waiting for a session, woken by release()
+        self._async_waiters = set()
+        self.in_use = 0
+        self.requests = 0
+        self.failures = 0
+
+    def _client(self, lease):
+        # Clients are cheap views over the shared transport; they are never closed
+        return httpx.Client(
+            transport=self.transport,
+            cookies=lease.cookies,
+            headers=REQUEST_HEADERS,
+            timeout=self.request_timeout,
+            follow_redirects=True
+        )
+
+    def _async_client(self, lease):
+        with self._lock:
+            if self.async_transport is None:
+                # Made on first async use; its connections belong to the loop that made it
+                self.async_transport = httpx.AsyncHTTPTransport(limits=self.limits, verify=self.tls_verify)
+                self._async_loop = asyncio.get_running_loop()
+        return httpx.AsyncClient(
+            transport=self.async_transport,
+            cookies=lease.cookies,
+            headers=REQUEST_HEADERS,
+            timeout=self.request_timeout,
+            follow_redirects=True
+        )
+
+    def _acquire(self, timeout):
+        if not self._sessions.acquire(timeout=timeout):
+            raise PoolExhausted('All upstream sessions are busy')
+        with self._lock:
+            self.in_use += 1
+        return HttpLease()
+
+    async def _aacquire(self, timeout):
+        # Sessions are shared with threads, so wait on a future that release() resolves
+        # from whichever thread frees one, instead of an asyncio primitive bound to this loop
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = (loop, loop.create_future())
+            with self._lock:
+                # Registered before trying, so a release in between still wakes us
+                self._async_waiters.add(waiter)
+            try:
+                if self._sessions.acquire(blocking=False):
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise PoolExhausted('All upstream sessions are busy')
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._lock:
+                    self._async_waiters.discard(waiter)
+        with self._lock:
+            self.in_use += 1
+        return HttpLease()
+
+    def _read_form(self, lease, response):
+        response.raise_for_status()
+        action, lease.form_fields, captcha_src = parse_form(response.text)
+        lease.form_action = urljoin(str(response.url), action)
+        return urljoin(str(response.url), captcha_src)
+
+    def _build_submission(self, lease, reg_number, dob, captcha):
+        fields = dict(lease.form_fields)
+        fields.update({
+            'ubrn': reg_number,
+            'BirthDate': dob,
+            'CaptchaInputText': captcha
+        })
+        return fields
+
+    def open_captcha(self, timeout=None):
+        with metrics.span('pool_wait'):
+            lease = self._acquire(self.checkout_timeout if timeout is None else timeout)
+        try:
+            client = self._client(lease)
+            with metrics.span('page_load'):
+                captcha_url = self._read_form(lease, client.get(self.base_url))
+            with metrics.span('captcha_capture'):
+                captcha = client.get(captcha_url)
+                captcha.raise_for_status()
+            lease.cookies = client.cookies
+            return lease, captcha.content
+        except Exception as e:
+            self.release(lease, error=e)
+            raise
+
+    async def aopen_captcha(self, timeout=None):
+        with metrics.span('pool_wait'):
+            lease = await self._aacquire(self.checkout_timeout if timeout is None else timeout)
+        try:
+            client = self._async_client(lease)
+            with metrics.span('page_load'):
+                captcha_url = self._read_form(lease, await client.get(self.base_url))
+            with metrics.span('captcha_capture'):
+                captcha = await client.get(captcha_url)
+                captcha.raise_for_status()
+            lease.cookies = client.cookies
+            return lease, captcha.content
+        except Exception as e:
+            self.release(lease, error=e)
+            raise
+
+    def submit(self, lease, reg_number, dob, captcha):
+        client = self._client(lease)
+        with metrics.span('form_submit'):
+            response = client.post(lease.form_action, data=self._build_submission(lease, reg_number, dob, captcha))
+            response.raise_for_status()
+        return parse_verification_result(response.text)
+
+    async def asubmit(self, lease, reg_number, dob, captcha):
+        client = self._async_client(lease)
+        with metrics.span('form_submit'):
+            response = await client.post(lease.form_action, data=self._build_submission(lease, reg_number, dob, captcha))
+            response.raise_for_status()
+        return parse_verification_result(response.text)
+
+    def release(self, lease, error=None):
+        with self._lock:
+            self.in_use -= 1
+            self.requests += 1
+            if error is not None and not isinstance(error, UpstreamError):
+                self.failures += 1
+        self._sessions.release()
+        with self._lock:
+            waiters, self._async_waiters = self._async_waiters, set()
+        # Every waiter retries; the ones that lose the race wait again
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # Its loop has closed
+                pass
+
+    async def arelease(self, lease, error=None):
+        self.release(lease, error)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "engine": self.name,
+                "size": self.max_sessions,
+                "busy": self.in_use,
+                "idle": self.max_sessions - self.in_use,
+                "requests": self.requests,
+                "failures": self.failures
+            }
+
+    def shutdown(self):
+        self.transport.close()
+        with self._lock:
+            transport, self.async_transport = self.async_transport, None
+            loop, self._async_loop = self._async_loop, None
+        if transport is not None:
+            _close_on_loop(transport, loop)
+
+
+def create_http_engine():
+    return HttpEngine(
+        base_url=Config.UPSTREAM_URL,
+        max_sessions=Config.HTTP_ENGINE_MAX_SESSIONS,
+        checkout_timeout=Config.BROWSER_POOL_CHECKOUT_TIMEOUT,
+        request_timeout=Config.HTTP_ENGINE_TIMEOUT,
+        tls_verify=Config.UPSTREAM_TLS_VERIFY
+    )
@@ -0,0 +1,330 @@
+import base64
+import threading
+import time
+import weakref
+
+from browser_pool import browser_pool, BrowserSlot
+from config import Config
+from engines.base import VerificationEngine, UpstreamError
+from metrics import metrics
+from waits import waiter, form_ready, captcha_ready
+
+# Defines window.__ubrnVerify, which fills the form, posts it with fetch (the page never
+# navigates, so the async script survives), waits for the response and parses it in
+# place, answering with {data}, {error} for validation errors or {failure}
+VERIFY_SCRIPT = """
+    window.__ubrnVerify = function(regNumber, dob, captcha, timeoutMs, done) {
+        function text(node) {
+            return node ? node.textContent.trim() : '';
+        }
+
+        function first(doc, path) {
+            return doc.evaluate(path, doc, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        }
+
+        function extractData(doc) {
+            const data = {};
+            const tables = doc.querySelectorAll('table');
+
+            if (tables.length >= 2) {
+                // Extract registration details
+                const regRows = tables[0].rows;
+                if (regRows.length >= 5) {
+                    const regCells = regRows[2].cells;
+                    const birthCells = regRows[4].cells;
+
+                    if (regCells.length >= 3) {
+                        Object.assign(data, {
+                            'Registration Date': text(regCells[0]),
+                            'Registration Office': text(regCells[1]),
+                            'Issuance Date': text(regCells[2])
+                        });
+                    }
+
+                    if (birthCells.length >= 3) {
+                        Object.assign(data, {
+                            'Date of Birth': text(birthCells[0]),
+                            'Birth Registration Number': text(birthCells[1]),
+                            'Sex': text(birthCells[2])
+                        });
+                    }
+                }
+
+                // Extract personal details
+                for (const row of tables[1].rows) {
+                    const cells = row.cells;
+                    if (cells.length >= 4) {
+                        const [keyBengali, valueBengali, keyEnglish, valueEnglish] =
+                            Array.from(cells).slice(0, 4).map(text);
+
+                        if (keyBengali && valueBengali) data[keyBengali] = valueBengali;
+                        if (keyEnglish && valueEnglish) data[keyEnglish] = valueEnglish;
+                    }
+                }
+            }
+
+            const addressNode = first(doc, '/html/body/div[2]/p[2]/span/em');
+            if (addressNode) {
+                let address = text(addressNode);
+                if (address.endsWith('.')) {
+                    address = address.slice(0, -1).trim(); // remove last "." if exists
+                }
+                data['address'] = address;
+            }
+
+            const birthPlaceEnNode = first(doc, '/html/body/div[2]/div/div[2]/div/table/tbody/tr[2]/td[4]');
+            if (birthPlaceEnNode) {
+                data['birthPlaceEn'] = text(birthPlaceEnNode);
+            }
+            return data;
+        }
+
+        const form = document.getElementById('ubrnsearchform');
+        if (!form) {
+            done({failure: 'Verification form not found'});
+            return;
+        }
+        document.getElementById('ubrn').value = regNumber;
+        document.getElementById('BirthDate').value = dob;
+        document.getElementById('CaptchaInputText').value = captcha;
+
+        const body = new URLSearchParams(new FormData(form));
+        const submitButton = form.querySelector('input[type="submit"]');
+        if (submitButton && submitButton.name) {
+            body.append(submitButton.name, submitButton.value);
+        }
+
+        const controller = new AbortController();
+        const timer = setTimeout(function() { controller.abort(); }, timeoutMs);
+        fetch(form.action || location.href, {
+            method: 'POST',
+            body: body,
+            credentials: 'same-origin',
+            signal: controller.signal
+        }).then(function(response) {
+            return response.text();
+        }).then(function(html) {
+            clearTimeout(timer);
+            const doc = new DOMParser().parseFromString(html, 'text/html');
+            const errors = doc.querySelector('.validation-summary-errors');
+            if (errors) {
+                done({error: errors.textContent.replace(/\\s+/g, ' ').trim()});
+            } else if (!doc.querySelector('table')) {
+                done({failure: 'Verification result not found'});
+            } else {
+                done({data: extractData(doc)});
+            }
+        }).catch(function(e) {
+            clearTimeout(timer);
+            done({failure: e.name === 'AbortError' ? 'Timed out waiting for the verification result' : String(e)});
+        });
+    };
+"""
+
+# Calls the pinned verify function, or reports that this page does not have it yet
+CALL_VERIFY_SCRIPT = """
+    var done = arguments[arguments.length - 1];
+    if (!window.__ubrnVerify) {
+        done({missing: true});
+        return;
+    }
+    window.__ubrnVerify(arguments[0], arguments[1], arguments[2], arguments[3], done);
+"""
+
+
+# Reads the captcha's original bytes from the HTTP cache without asking the upstream
+# for a new one; falls back to exporting the decoded image through a canvas
+CAPTURE_SCRIPT = """
+    var done = arguments[arguments.length - 1];
+    var img = document.getElementById('CaptchaImage');
+    if (!img || !img.complete || !img.naturalWidth) {
+        done(null);
+        return;
+    }
+
+    function fromCanvas() {
+        try {
+            var canvas = document.createElement('canvas');
+            canvas.width = img.naturalWidth;
+            canvas.height = img.naturalHeight;
+            canvas.getContext('2d').drawImage(img, 0, 0);
+            done({source: 'canvas', data: canvas.toDataURL('image/png').split(',')[1]});
+        } catch (e) {
+            done(null);
+        }
+    }
+
+    fetch(img.currentSrc || img.src, {cache: 'only-if-cached', mode: 'same-origin', credentials: 'same-origin'})
+        .then(function(response) {
+            if (!response.ok) throw new Error('not cached');
+            return response.blob();
+        })
+        .then(function(blob) {
+            var reader = new FileReader();
+            reader.onload = function() { done({source: 'cache', data: reader.result.split(',')[1]}); };
+            reader.onerror = fromCanvas;
+            reader.readAsDataURL(blob);
+        })
+        .catch(fromCanvas);
+"""
+
+
+def load_verification_form(driver):
+    """Navigate a browser to a fresh verification form"""
+    from selenium.common.exceptions import TimeoutException
+
+    with metrics.span('page_load'):
+        driver.execute_script('window.stop();')  # Stop any current loading
+        driver.get(Config.UPSTREAM_URL)
+        try:
+            waiter.wait(driver, 'form', form_ready)
+        except TimeoutException as e:
+            print(f"Error waiting for page load: {str(e)}")
+            driver.refresh()
+            waiter.wait(driver, 'form', form_ready, timeout=waiter.ceiling('form'))
+
+
+def get_captcha_image(driver, timeout=None):
+    """Get the captcha's image bytes, as served when possible"""
+    with metrics.span('captcha_capture'):
+        return _capture_captcha(driver, timeout)
+
+
+def _capture_captcha(driver, timeout):
+    try:
+        # Wait until the captcha image has actually decoded
+        if waiter.wait(driver, 'captcha', captcha_ready(), timeout=timeout) != 'ready':
+            raise Exception("Captcha image failed to load")
+
+        captured = driver.execute_async_script(CAPTURE_SCRIPT)
+        if captured and captured.get('data'):
+            return base64.b64decode(captured['data'])
+
+        # Last resort, the old way
+        from selenium.webdriver.common.by import By
+        captcha_element = driver.find_element(By.ID, 'CaptchaImage')
+        driver.execute_script("arguments[0].scrollIntoView(true);", captcha_element)
+        captcha_screenshot = captcha_element.screenshot_as_png
+        if not captcha_screenshot:
+            raise Exception("Screenshot was empty")
+
+        return captcha_screenshot
+    except Exception as e:
+        print(f"Error capturing captcha: {str(e)}")
+        return None
+
+
+def load_fresh_captcha(driver):
+    """Load a new verification form and capture its captcha"""
+    load_verification_form(driver)
+    captcha_image = get_captcha_image(driver)
+    if not captcha_image:
+        # Try refreshing the page once, this time allowing the full budget
+        driver.refresh()
+        waiter.wait(driver, 'form', form_ready, timeout=waiter.ceiling('form'))
+        captcha_image = get_captcha_image(driver, timeout=waiter.ceiling('captcha'))
+    return captcha_image
+
+
+class SeleniumEngine(VerificationEngine):
+    """Drives the upstream form with pooled headless Chrome browsers"""
+    name = 'selenium'
+
+    def __init__(self, pool):
+        self.pool = pool
+        # One thread per browser; async callers beyond that wait on the event loop
+        self.blocking_workers = pool.size
+        self._pinned = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.submits = 0
+        self.submit_commands = 0
+        self.submit_time = 0.0
+
+    def open_captcha(self, timeout=None):
+        with metrics.span('pool_wait'):
+            slot = self.pool.checkout(timeout)
+        try:
+            try:
+                # Pinned before the form loads, so submit finds it already defined
+                self.pin_verify_script(slot.driver)
+            except Exception as e:
+                print(f"Error pinning verify script: {str(e)}")
+            captcha_image = load_fresh_captcha(slot.driver)
+        except Exception as e:
+            self.pool.checkin(slot, error=e)
+            raise
+        if not captcha_image:
+            self.pool.checkin(slot, error=Exception('Failed to capture captcha'))
+            raise Exception('Failed to capture captcha')
+        # The browser now shows a captcha that only this lease may answer
+        slot.state = BrowserSlot.RESERVED
+        return slot, captcha_image
+
+    def pin_verify_script(self, driver):
+        """Have the browser define the verify function on every page it loads"""
+        if driver in self._pinned:
+            return False
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': VERIFY_SCRIPT})
+        self._pinned.add(driver)
+        return True
+
+    def submit(self, lease, reg_number, dob, captcha):
+        driver = lease.driver
+        lease.state = BrowserSlot.BUSY
+        # A captcha answer can't be retried, so always allow the full budget here
+        timeout_ms = int(waiter.ceiling('result') * 1000)
+
+        started = time.monotonic()
+        commands = 1
+        # One round trip posts the form and waits for the result table
+        with metrics.span('form_submit'):
+            result = driver.execute_async_script(CALL_VERIFY_SCRIPT, reg_number, dob, captcha, timeout_ms)
+            if result.get('missing'):
+                # Page loaded before the script was pinned: define it inline this once
+                try:
+                    commands += self.pin_verify_script(driver)
+                except Exception as e:
+                    print(f"Error pinning verify script: {str(e)}")
+                commands += 1
+                result = driver.execute_async_script(VERIFY_SCRIPT + CALL_VERIFY_SCRIPT, reg_number, dob, captcha, timeout_ms)
+        elapsed = time.monotonic() - started
+
+        waiter.stages['result'].observe(elapsed, timed_out='data' not in result and 'error' not in result)
+        with self._lock:
+            self.submits += 1
+            self.submit_commands += commands
+            self.submit_time += elapsed
+
+        if 'error' in result:
+            raise UpstreamError(result['error'])
+        if 'failure' in result:
+            raise Exception(result['failure'])
+        return result['data']
+
+    def checkout(self, timeout=None):
+        return self.pool.checkout(timeout)
+
+    def release(self, lease, error=None):
+        # A rejected submission says nothing about the browser's health
+        if isinstance(error, UpstreamError):
+            error = None
+        self.pool.checkin(lease, error=error)
+
+    def get_stats(self):
+        stats = self.pool.get_stats()
+        stats["engine"] = self.name
+        stats["waits"] = waiter.get_stats()
+        with self._lock:
+            stats["submit"] = {
+                "count": self.submits,
+                "avg_ms": round(self.submit_time * 1000 / self.submits, 1) if self.submits else None,
+                "commands_per_submit": round(self.submit_commands / self.submits, 2) if self.submits else None
+            }
+        return stats
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def create_selenium_engine():
+    return SeleniumEngine(browser_pool)
@@ -0,0 +1,68 @@
+import atexit
+import threading
+
+
+class BackgroundFlusher:
+    """Base for write-behind buffers written out by a background thread
+
+    Subclasses buffer writes in memory and implement flush(). The thread
+    starts with the first buffered write (call _ensure_flusher()) and calls
+    flush() every flush_interval seconds, or sooner after wake(). stop() is
+    registered to run at exit and flushes what is left, so writes from a
+    process that exits normally are not lost.
+    """
+    thread_name = 'flusher'
+    # Printed with the exception when a background flush fails
+    flush_error = 'Error flushing buffered writes'
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Held for a whole flush, so flushes never interleave
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def flush(self):
+        """Write everything buffered so far"""
+        raise NotImplementedError
+
+    def wake(self):
+        """Flush now instead of at the end of the interval"""
+        self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            if not self._thread:
+                atexit.register(self.stop)
+            self._stopped.clear()
+            self._wakeup.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"{self.flush_error}: {str(e)}")
+
+    def stop(self):
+        """Stop the thread and flush whatever is still buffered"""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread and thread.is_alive():
+            thread.join(timeout=5)
+        self._safe_flush()
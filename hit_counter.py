@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from config import Config
+from database import add_api_key_hits
+from flusher import BackgroundFlusher
+
+
+class HitCounter(BackgroundFlusher):
+    """Write-behind API key usage counters
+
+    Requests charge hits against the in-memory APIKey (so limits are
+    enforced without a database write) and the increments are added to
+    the database in one transaction every flush_interval seconds, or
+    sooner once flush_threshold hits are pending. Increments are applied
+    as `hits_used = hits_used + n`, so workers never overwrite each other.
+    """
+    thread_name = 'hit-counter-flusher'
+    flush_error = 'Error writing API key hits'
+
+    def __init__(self, flush_interval, flush_threshold):
+        super().__init__(flush_interval)
+        self.flush_threshold = flush_threshold
+        self._pending = defaultdict(int)
+        self._flushing = {}
+        self._pending_total = 0
+        self.flushes = 0
+
+    def charge(self, key, hits):
+        """Use up hits of a key, or return False when its limit has no room for them"""
+        with self._lock:
+            if key.hit_limit > 0 and key.hits_used + hits > key.hit_limit:
+                return False
+            key.hits_used += hits
+            self._pending[key.id] += hits
+            self._pending_total += hits
+            self._ensure_flusher()
+            if self._pending_total >= self.flush_threshold:
+                self.wake()
+        return True
+
+    def unflushed(self, key_id):
+        """Hits charged in this process that the database does not have yet"""
+        with self._lock:
+            return self._pending.get(key_id, 0) + self._flushing.get(key_id, 0)
+
+    def snapshot(self):
+        """Lock to hold while reading hits_used from the database and adding unflushed()
+
+        A flush commits its increments and forgets them while holding it, so
+        the row and unflushed() never both include the same hits.
+        """
+        return self._flush_lock
+
+    def flush(self):
+        """Write the pending increments; on failure they stay pending for the next try"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing = dict(self._pending)
+                self._pending.clear()
+                self._pending_total = 0
+            try:
+                add_api_key_hits(self._flushing)
+            except Exception:
+                with self._lock:
+                    for key_id, hits in self._flushing.items():
+                        self._pending[key_id] += hits
+                        self._pending_total += hits
+                    self._flushing = {}
+                raise
+            with self._lock:
+                written = sum(self._flushing.values())
+                self._flushing = {}
+                self.flushes += 1
+            return written
+
+
+# Create global instance for use across the application
+hit_counter = HitCounter(flush_interval=Config.HIT_FLUSH_INTERVAL, flush_threshold=Config.HIT_FLUSH_THRESHOLD)
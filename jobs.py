@@ -0,0 +1,422 @@
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from config import Config
+from database import get_db
+from batch_verify import verify_item
+from captcha_tickets import ticket_store
+from mapping import map_verification_data
+from models import stats, user_activity
+from result_cache import result_cache
+from upstream import engine
+
+# Job states, in the order a job moves through them
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Webhook delivery states (NULL when the key has no webhook)
+PENDING = 'pending'
+DELIVERED = 'delivered'
+
+HOST = socket.gethostname()
+
+
+def worker_id(pid=None):
+    """host:pid of a worker process, this one by default
+
+    Recorded on claimed jobs so a restarted process can tell which ones it
+    orphaned, and on queued jobs to pin them to the worker holding their
+    captcha. Read the pid on every call, workers fork after import.
+    """
+    return f'{HOST}:{pid or os.getpid()}'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def worker_gone(worker):
+    """Whether a worker recorded by worker_id() is known to have exited (only checkable on this host)"""
+    host, _, pid = (worker or '').rpartition(':')
+    return host == HOST and pid.isdigit() and not process_alive(int(pid))
+
+
+def run_verification(payload):
+    """Verify one queued job's payload, returning its result record"""
+    outcome = verify_item(engine, map_verification_data, 0, payload, use_cache=payload.get('use_cache', True))
+    outcome.pop('index', None)
+    return outcome
+
+
+def sign_payload(secret, body):
+    """Signature sent in X-Webhook-Signature so receivers can check who posted"""
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class JobQueue:
+    """Durable verification queue in SQLite, run by background worker threads
+
+    Jobs are rows in verification_jobs, so they outlive the process that
+    accepted them. Workers claim the oldest queued job with a conditional
+    UPDATE, which stays safe when several processes share the database.
+    A captcha ticket can only be redeemed by the worker process that issued
+    it, so a job is pinned to that process and only its workers claim it;
+    the pin is dropped once the process is gone or pin_timeout (the ticket
+    lifetime) has passed, and the job then fails or is served from the
+    cache wherever it runs. A job left running by a process that died is
+    put back in the queue: at start-up when the process was on this host,
+    otherwise once it has been running for longer than running_timeout.
+    Results are kept for polling, encrypted with the result cache key, and,
+    when the key has a webhook, POSTed to it with exponential backoff
+    between attempts.
+    """
+    def __init__(self, handler, workers, poll_interval, max_attempts, running_timeout, pin_timeout, retention,
+                 webhook_timeout, webhook_max_attempts, webhook_backoff, webhook_max_backoff):
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.running_timeout = running_timeout
+        self.pin_timeout = pin_timeout
+        self.retention = retention
+        self.webhook_timeout = webhook_timeout
+        self.webhook_max_attempts = webhook_max_attempts
+        self.webhook_backoff = webhook_backoff
+        self.webhook_max_backoff = webhook_max_backoff
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._webhooks_due = threading.Event()
+        self._stopped = False
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.webhooks_delivered = 0
+        self.webhook_failures = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def submit(self, api_key, payload, webhook_url=None):
+        """Queue a verification and return its job id"""
+        job_id = uuid.uuid4().hex
+        # Run it where the captcha was issued; a token that does not verify fails in any worker
+        issuer = ticket_store.issuer(payload['captcha_token']) if payload.get('captcha_token') else None
+        pinned_to = worker_id(issuer) if issuer else None
+        conn = get_db()
+        try:
+            conn.execute('''INSERT INTO verification_jobs
+                (id, api_key, status, payload, created_at, pinned_to, webhook_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (job_id, api_key, QUEUED, json.dumps(payload, ensure_ascii=False), time.time(), pinned_to,
+                 webhook_url))
+            conn.commit()
+        finally:
+            conn.close()
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id, api_key):
+        """Return a job as the API shows it, or None if the key does not own it"""
+        self.start()
+        conn = get_db()
+        try:
+            row = conn.execute('SELECT * FROM verification_jobs WHERE id = ? AND api_key = ?',
+                               (job_id, api_key)).fetchone()
+        finally:
+            conn.close()
+        return self._describe(row) if row else None
+
+    @staticmethod
+    def _describe(row):
+        job = {
+            'job_id': row['id'],
+            'status': row['status'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+        if row['result']:
+            from cryptography.fernet import InvalidToken
+            try:
+                job['result'] = result_cache.decrypt(row['result'])
+            except InvalidToken:
+                # Stored before a key change
+                job['result'] = {'success': False, 'error': 'The job result can no longer be read'}
+        if row['webhook_status']:
+            job['webhook'] = {
+                'status': row['webhook_status'],
+                'attempts': row['webhook_attempts'],
+                'error': row['webhook_error']
+            }
+        return job
+
+    def _claim(self):
+        """Move the oldest queued job this process may run to running, or return None if there is none"""
+        worker = worker_id()
+        conn = get_db()
+        try:
+            while True:
+                row = conn.execute('''SELECT * FROM verification_jobs
+                    WHERE status = ? AND (pinned_to IS NULL OR pinned_to = ?) ORDER BY created_at LIMIT 1''',
+                    (QUEUED, worker)).fetchone()
+                if not row:
+                    return None
+                claimed = conn.execute('''UPDATE verification_jobs
+                    SET status = ?, started_at = ?, claimed_by = ?, attempts = attempts + 1
+                    WHERE id = ? AND status = ?''', (RUNNING, time.time(), worker, row['id'], QUEUED)).rowcount
+                conn.commit()
+                if claimed:
+                    return row
+                # Another worker took it first, try the next one
+        finally:
+            conn.close()
+
+    def _finish(self, row, result):
+        now = time.time()
+        status = SUCCEEDED if result.get('success') else FAILED
+        webhook_status = PENDING if row['webhook_url'] else None
+        conn = get_db()
+        try:
+            # The payload holds the captcha answer and personal data, it is not needed any more
+            conn.execute('''UPDATE verification_jobs
+                SET status = ?, result = ?, payload = NULL, finished_at = ?, webhook_status = ?, next_webhook_at = ?
+                WHERE id = ?''',
+                (status, result_cache.encrypt(result), now, webhook_status, now, row['id']))
+            conn.commit()
+        finally:
+            conn.close()
+
+        if status == SUCCEEDED:
+            self._count('completed')
+            data = result.get('data') or {}
+            details = {
+                'job_id': row['id'],
+                'nameEn': data.get('nameEn', ''),
+                'brn': data.get('brn', ''),
+                'dob': data.get('dob', ''),
+                'birthPlaceEn': data.get('birthPlaceEn', ''),
+                'status': 'Success',
+                'cached': result.get('cached', False),
+                'endpoint': 'api_job'
+            }
+            user_activity.add_activity(row['api_key'], 'api_job', details, success=True)
+        else:
+            self._count('failed')
+            stats.register_request(success=False)
+        if webhook_status:
+            self._webhooks_due.set()
+
+    def _work_loop(self):
+        while not self._stopped:
+            row = None
+            try:
+                row = self._claim()
+                if not row:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                result = self.handler(json.loads(row['payload']))
+            except Exception as e:
+                print(f"Error running verification job: {str(e)}")
+                if not row:
+                    time.sleep(self.poll_interval)
+                    continue
+                result = {'success': False, 'error': 'Could not extract verification data'}
+            try:
+                self._finish(row, result)
+            except Exception as e:
+                print(f"Error saving verification job {row['id']}: {str(e)}")
+
+    def _orphaned(self, conn, now):
+        """Running jobs whose worker is gone: timed out, or claimed by a dead process on this host"""
+        return [row for row in conn.execute(
+                    'SELECT id, attempts, webhook_url, started_at, claimed_by FROM verification_jobs WHERE status = ?',
+                    (RUNNING,)).fetchall()
+                if row['started_at'] < now - self.running_timeout or worker_gone(row['claimed_by'])]
+
+    def _unpin_stale(self, conn, now):
+        """Let any worker run queued jobs whose pinned process is gone or whose captcha has expired"""
+        unpinned = 0
+        for row in conn.execute('''SELECT id, created_at, pinned_to FROM verification_jobs
+                WHERE status = ? AND pinned_to IS NOT NULL''', (QUEUED,)).fetchall():
+            if row['created_at'] < now - self.pin_timeout or worker_gone(row['pinned_to']):
+                unpinned += conn.execute('UPDATE verification_jobs SET pinned_to = NULL WHERE id = ? AND status = ?',
+                                         (row['id'], QUEUED)).rowcount
+        return unpinned
+
+    def _requeue_stale(self, conn, now):
+        """Give jobs whose worker died another try, or fail them after max_attempts, and unpin stranded jobs"""
+        stale = self._orphaned(conn, now)
+        for row in stale:
+            if row['attempts'] < self.max_attempts:
+                # The captcha went with the worker, the retry may run anywhere
+                conn.execute('''UPDATE verification_jobs SET status = ?, started_at = NULL, claimed_by = NULL, pinned_to = NULL
+                    WHERE id = ? AND status = ?''', (QUEUED, row['id'], RUNNING))
+                self._count('requeued')
+            else:
+                result = {'success': False, 'error': 'The job was interrupted too many times'}
+                conn.execute('''UPDATE verification_jobs
+                    SET status = ?, result = ?, payload = NULL, finished_at = ?, webhook_status = ?, next_webhook_at = ?
+                    WHERE id = ? AND status = ?''',
+                    (FAILED, result_cache.encrypt(result), now, PENDING if row['webhook_url'] else None, now,
+                     row['id'], RUNNING))
+                self._count('failed')
+        unpinned = self._unpin_stale(conn, now)
+        conn.execute('DELETE FROM verification_jobs WHERE finished_at < ? AND (webhook_status IS NULL OR webhook_status != ?)',
+                     (now - self.retention, PENDING))
+        conn.commit()
+        if stale or unpinned:
+            self._wake.set()
+
+    def _backoff(self, attempts):
+        return min(self.webhook_max_backoff, self.webhook_backoff * 2 ** (attempts - 1))
+
+    def _deliver(self, client, row):
+        job = self._describe(row)
+        job.pop('webhook', None)
+        body = json.dumps(job, ensure_ascii=False).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'X-Job-Id': row['id'],
+            'X-Webhook-Signature': sign_payload(row['api_key'], body)
+        }
+        try:
+            response = client.post(row['webhook_url'], content=body, headers=headers)
+            if 200 <= response.status_code < 300:
+                return None
+            return f'HTTP {response.status_code}'
+        except Exception as e:
+            return str(e) or e.__class__.__name__
+
+    def _deliver_webhooks(self, client):
+        now = time.time()
+        conn = get_db()
+        try:
+            due = conn.execute('''SELECT * FROM verification_jobs
+                WHERE webhook_status = ? AND next_webhook_at <= ? ORDER BY next_webhook_at LIMIT 50''',
+                (PENDING, now)).fetchall()
+        finally:
+            conn.close()
+
+        for row in due:
+            if self._stopped:
+                return
+            error = self._deliver(client, row)
+            attempts = row['webhook_attempts'] + 1
+            if error is None:
+                webhook_status = DELIVERED
+                self._count('webhooks_delivered')
+            elif attempts >= self.webhook_max_attempts:
+                webhook_status = FAILED
+                self._count('webhook_failures')
+            else:
+                webhook_status = PENDING
+            conn = get_db()
+            try:
+                conn.execute('''UPDATE verification_jobs
+                    SET webhook_status = ?, webhook_attempts = ?, webhook_error = ?, next_webhook_at = ?
+                    WHERE id = ?''',
+                    (webhook_status, attempts, error, time.time() + self._backoff(attempts), row['id']))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _maintenance_loop(self):
+        # Webhooks are rare next to verifications, so httpx only loads with this thread
+        import httpx
+        with httpx.Client(timeout=self.webhook_timeout, follow_redirects=False) as client:
+            while not self._stopped:
+                try:
+                    conn = get_db()
+                    try:
+                        self._requeue_stale(conn, time.time())
+                    finally:
+                        conn.close()
+                    self._deliver_webhooks(client)
+                except Exception as e:
+                    print(f"Error in job maintenance: {str(e)}")
+                self._webhooks_due.wait(self.poll_interval)
+                self._webhooks_due.clear()
+
+    def start(self):
+        """Start the workers if they are not already running
+
+        Called when the app starts and on every submit or poll, so jobs queued
+        before a restart are picked up again as soon as the process is back.
+        """
+        with self._lock:
+            if self._threads or self._stopped or self.workers <= 0:
+                return
+            self._threads = [threading.Thread(target=self._work_loop, name=f'job-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._maintenance_loop, name='job-maintenance', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop taking new jobs; queued ones stay in the table for the next start"""
+        self._stopped = True
+        self._wake.set()
+        self._webhooks_due.set()
+
+    def get_stats(self):
+        """Get queue depth by state plus worker counters"""
+        counts = {}
+        webhooks = {}
+        conn = get_db()
+        try:
+            for row in conn.execute('SELECT status, COUNT(*) AS n FROM verification_jobs GROUP BY status'):
+                counts[row['status']] = row['n']
+            for row in conn.execute('''SELECT webhook_status, COUNT(*) AS n FROM verification_jobs
+                    WHERE webhook_status IS NOT NULL GROUP BY webhook_status'''):
+                webhooks[row['webhook_status']] = row['n']
+        finally:
+            conn.close()
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": bool(self._threads) and not self._stopped,
+                "queued": counts.get(QUEUED, 0),
+                "in_progress": counts.get(RUNNING, 0),
+                "succeeded": counts.get(SUCCEEDED, 0),
+                "failed": counts.get(FAILED, 0),
+                "webhooks_pending": webhooks.get(PENDING, 0),
+                "webhooks_failed": webhooks.get(FAILED, 0),
+                "completed": self.completed,
+                "requeued": self.requeued,
+                "webhooks_delivered": self.webhooks_delivered,
+                "webhook_failures": self.webhook_failures
+            }
+
+
+# Create global instance for use across the application
+job_queue = JobQueue(
+    handler=run_verification,
+    workers=Config.JOB_WORKERS,
+    poll_interval=Config.JOB_POLL_INTERVAL,
+    max_attempts=Config.JOB_MAX_ATTEMPTS,
+    running_timeout=Config.JOB_RUNNING_TIMEOUT,
+    pin_timeout=Config.CAPTCHA_TICKET_TTL,
+    retention=Config.JOB_RETENTION,
+    webhook_timeout=Config.JOB_WEBHOOK_TIMEOUT,
+    webhook_max_attempts=Config.JOB_WEBHOOK_MAX_ATTEMPTS,
+    webhook_backoff=Config.JOB_WEBHOOK_BACKOFF,
+    webhook_max_backoff=Config.JOB_WEBHOOK_MAX_BACKOFF
+)
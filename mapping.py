@@ -0,0 +1,118 @@
+import re
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+
+from metrics import metrics
+
+# Any character the old per-character test `'a' <= c.lower() <= 'z'` accepted:
+# ASCII letters plus the two code points whose lowercase form is ASCII
+_LATIN = re.compile('[A-Za-z\u0130\u212a]')
+
+# The shape strptime('%d %B %Y') accepts
+_DATE = re.compile(r'(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\s+([^\W\d_]+)\s+(\d\d\d\d)\Z')
+
+MONTHS = {name: number for number, name in enumerate(
+    ('january', 'february', 'march', 'april', 'may', 'june', 'july',
+     'august', 'september', 'october', 'november', 'december'), 1)}
+
+# Upstream records repeat the same few dates, keep the recent conversions
+DATE_CACHE_SIZE = 4096
+
+
+def to_title_case_if_latin(text):
+    if not isinstance(text, str):
+        return text
+    # Only title-case if text contains Latin letters
+    if _LATIN.search(text):
+        return text.title()
+    return text
+
+
+def parse_date(text):
+    """Turn '05 March 2010' into '05/03/2010', or None when it is not such a date"""
+    match = _DATE.match(text)
+    if not match:
+        return None
+    day, month_name, year = match.groups()
+    month = MONTHS.get(month_name.lower())
+    if month is None:
+        return None
+    day, year = int(day), int(year)
+    try:
+        # Rejects days the month does not have
+        date(year, month, day)
+    except ValueError:
+        return None
+    return f'{day:02d}/{month:02d}/{year}'
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _date_field(text):
+    return parse_date(text) or to_title_case_if_latin(text)
+
+
+def date_field(value):
+    """A date as dd/mm/YYYY, anything else title-cased like the other fields"""
+    if not isinstance(value, str):
+        return value
+    return _date_field(value)
+
+
+# (output key, raw keys tried in order, conversion or None to copy as is)
+FIELDS = (
+    ("office", ("Registration Office",), to_title_case_if_latin),
+    ("address", ("address",), to_title_case_if_latin),
+    ("register", ("Registration Date",), date_field),
+    ("issue", ("Issuance Date",), date_field),
+    ("brn", ("Birth Registration Number",), to_title_case_if_latin),
+    ("dob", ("Date of Birth",), date_field),
+    ("sex", ("Sex",), to_title_case_if_latin),
+    ("nameEn", ("Registered Person Name",), to_title_case_if_latin),
+    ("nameBn", ("নিবন্ধিত ব্যক্তির নাম",), None),
+    ("fatherNameEn", ("Father's Name",), to_title_case_if_latin),
+    ("fatherNameBn", ("পিতার নাম",), None),
+    ("fatherNationalityEn", ("Father's Nationality",), to_title_case_if_latin),
+    # The upstream has spelled these labels with both the decomposed and the precomposed ya
+    ("fatherNationalityBn", ("পিতার জাতীয়তা", "পিতার জাতী\u09dfতা"), None),
+    ("motherNameEn", ("Mother's Name",), to_title_case_if_latin),
+    ("motherNameBn", ("মাতার নাম",), None),
+    ("motherNationalityEn", ("Mother's Nationality",), to_title_case_if_latin),
+    ("motherNationalityBn", ("মাতার জাতীয়তা", "মাতার জাতী\u09dfতা"), None),
+    # Historically run through the date conversion as well
+    ("birthPlaceEn", ("birthPlaceEn",), date_field),
+    ("birthPlaceBn", ("জন্মস্থান",), None),
+)
+
+
+def compile_plan(fields):
+    """Split the field table into flat steps: single-key lookups skip the fallback loop"""
+    plan = []
+    for output, sources, convert in fields:
+        plan.append((output, sources[0] if len(sources) == 1 else None, sources, convert))
+    return tuple(plan)
+
+
+PLAN = compile_plan(FIELDS)
+
+
+def _map_verification_data(raw_data):
+    get = raw_data.get
+    items = []
+    for output, source, sources, convert in PLAN:
+        if source is not None:
+            value = get(source, "")
+        else:
+            value = ""
+            for source in sources:
+                if source in raw_data:
+                    value = raw_data[source]
+                    break
+        items.append((output, convert(value) if convert else value))
+    return OrderedDict(items)
+
+
+def map_verification_data(raw_data):
+    """Map the raw upstream fields to the ordered API result"""
+    with metrics.span('map'):
+        return _map_verification_data(raw_data)
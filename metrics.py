@@ -0,0 +1,149 @@
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from config import Config
+
+# Upper bounds in seconds, from a fast SQLite write up to a stalled upstream
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Spans of the request being handled, for its Server-Timing header
+_current = ContextVar('request_timings', default=None)
+
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestTimings:
+    """Per-stage totals of one request"""
+    __slots__ = ('started', 'stages')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def header(self):
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items()]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+class _Span:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    """Stage and request latency histograms, exported in Prometheus text format
+
+    Code wraps a stage in `with metrics.span('page_load'):`. Each span feeds
+    the stage histogram and the Server-Timing totals of the request it runs
+    in. When disabled, span() hands back a shared no-op context manager.
+    """
+    def __init__(self, enabled, prefix='ubrn'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._stages = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        """Time a block as one stage"""
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+        timings = _current.get()
+        if timings is not None:
+            timings.stages[stage] = timings.stages.get(stage, 0.0) + seconds
+
+    def start_request(self):
+        """Start collecting spans for the current request"""
+        if self.enabled:
+            _current.set(RequestTimings())
+
+    def server_timing(self):
+        """The Server-Timing header value for the current request, or None"""
+        timings = _current.get()
+        return timings.header() if timings is not None else None
+
+    def end_request(self, endpoint, method, status):
+        """Record the current request's duration and stop collecting"""
+        timings = _current.get()
+        if timings is None:
+            return
+        _current.set(None)
+        key = (endpoint or 'unknown', method, str(status))
+        with self._lock:
+            histogram = self._requests.get(key)
+            if histogram is None:
+                histogram = self._requests[key] = Histogram()
+            histogram.observe(time.perf_counter() - timings.started)
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format"""
+        stage_name = f'{self.prefix}_stage_duration_seconds'
+        request_name = f'{self.prefix}_request_duration_seconds'
+        lines = [
+            f'# HELP {stage_name} Time spent in each stage of handling a request.',
+            f'# TYPE {stage_name} histogram'
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                lines.extend(histogram.render(stage_name, f'stage="{stage}"'))
+            lines.append(f'# HELP {request_name} Time to produce a response, by endpoint and status.')
+            lines.append(f'# TYPE {request_name} histogram')
+            for (endpoint, method, status), histogram in sorted(self._requests.items()):
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                lines.extend(histogram.render(request_name, labels))
+        return '\n'.join(lines) + '\n'
+
+
+# Create global instance for use across the application
+metrics = Metrics(enabled=Config.METRICS_ENABLED)
@@ -1,110 +1,182 @@
 from functools import wraps
 from flask import request, jsonify, session, redirect, url_for
 from models import key_store, stats, user_activity
+from hit_counter import hit_counter
+from rate_limit import rate_limiter
 from database import get_user_by_id, get_user
-from urllib.parse import urlparse
-def require_api_key(func):
-    """Decorator to require an API key for access"""
-    @wraps(func)
-    def decorated_function(*args, **kwargs):
-        api_key = request.headers.get('X-API-Key')
-        
-        # Get the current endpoint
-        endpoint = request.endpoint.split('.')[-1] if '.' in request.endpoint else request.endpoint
-        
-        if not api_key:
+from metrics import metrics
+from origins import parse_origin_host
+class APIRequest:
+    """The parts of an API request that key checks need, independent of the web framework"""
+    def __init__(self, api_key, endpoint, method, path, remote_addr, origin_header=None):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.remote_addr = remote_addr
+        self.origin_header = origin_header
+        # Set when the request is refused with 429
+        self.retry_after = None
+
+    @classmethod
+    def from_flask(cls):
+        """Build from the current Flask request"""
+        return cls(
+            api_key=request.headers.get('X-API-Key'),
+            endpoint=request.endpoint,
+            method=request.method,
+            path=request.path,
+            remote_addr=request.remote_addr,
+            origin_header=request.headers.get('Origin') or request.headers.get('Referer')
+        )
+
+    @property
+    def event_type(self):
+        return self.endpoint.split('.')[-1] if '.' in self.endpoint else self.endpoint
+
+
+def authorize_api_request(api_request, hits=1, register_success=True):
+    """Validate the API key of a request and record its usage
+
+    `hits` is how many units of the key's hit limit the request uses (one
+    per item for batches, none for polling); they are charged in a single
+    write, and a batch takes that many tokens from the key's rate limit.
+    With register_success=False an accepted request is left out of the
+    request stats, for endpoints that count their own outcomes (batches
+    count each item). On 429, api_request.retry_after holds the seconds to wait. Returns
+    (None, None) when the request may proceed, otherwise the error message
+    and HTTP status to reply with.
+    """
+    api_key = api_request.api_key
+
+    # Get the current endpoint
+    endpoint = api_request.event_type
+
+    if not api_key:
+        stats.register_request(success=False, endpoint=endpoint)
+        log_api_failure(api_request, None, 'API key is required')
+        return 'API key is required', 401
+
+    try:
+        # Get the key from the store
+        key_obj = key_store.get_key(api_key)
+
+        if not key_obj:
             stats.register_request(success=False, endpoint=endpoint)
-            log_api_failure(None, 'API key is required')
-            return jsonify({
-                'success': False,
-                'error': 'API key is required'
-            }), 401
-        
-        try:
-            # Get the key from the store
-            key_obj = key_store.get_key(api_key)
-            
-            if not key_obj:
-                stats.register_request(success=False, endpoint=endpoint)
-                log_api_failure(api_key, 'Invalid API key')
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid API key'
-                }), 401
-            
-            # Check if the key is valid (not expired and within limits)
-            if not key_obj.is_valid():
+            log_api_failure(api_request, api_key, 'Invalid API key')
+            return 'Invalid API key', 401
+
+        # Check if the key is valid (not expired and within limits)
+        if not key_obj.is_valid(hits=min(hits, 1)):
+            stats.register_request(success=False, endpoint=endpoint)
+            error_message = 'API key has expired or exceeded usage limits'
+            if key_obj.hits_used >= key_obj.hit_limit:
+                error_message = 'API key has exceeded usage limits'
+            elif not key_obj.active:
+                error_message = 'API key has been deactivated'
+            else:
+                error_message = 'API key has expired'
+
+            log_api_failure(api_request, api_key, error_message)
+            return error_message, 403
+
+        if hits > 1 and key_obj.hit_limit > 0 and key_obj.hits_used + hits > key_obj.hit_limit:
+            stats.register_request(success=False, endpoint=endpoint)
+            error_message = (f'API key has {key_obj.hit_limit - key_obj.hits_used} hits left, '
+                             f'this request needs {hits}')
+            log_api_failure(api_request, api_key, error_message)
+            return error_message, 403
+
+
+        # Check if the origin is allowed
+        origin_header = api_request.origin_header
+        origin_host = parse_origin_host(origin_header) if origin_header else None
+
+        matcher = key_obj.origin_matcher
+        if matcher:
+            if origin_host:
+                if not matcher.match(origin_host):
+                    stats.register_request(success=False, endpoint=endpoint)
+                    error_message = f'Origin {origin_host} is not allowed for this API key'
+                    log_api_failure(api_request, api_key, error_message)
+                    return error_message, 403
+            else:
+                # fallback to IP check only if needed
+                client_ip = api_request.remote_addr
+                if not matcher.match(client_ip):
+                    stats.register_request(success=False, endpoint=endpoint)
+                    error_message = f'IP {client_ip} is not allowed for this API key'
+                    log_api_failure(api_request, api_key, error_message)
+                    return error_message, 403
+
+
+        # Per-key rate limit, checked before the request can reach the upstream
+        if key_obj.rate_limit_rps:
+            retry_after = rate_limiter.acquire(key_obj.id, key_obj.rate_limit_rps, key_obj.rate_limit_burst,
+                                               cost=hits)
+            if retry_after:
                 stats.register_request(success=False, endpoint=endpoint)
-                error_message = 'API key has expired or exceeded usage limits'
-                if key_obj.hits_used >= key_obj.hit_limit:
-                    error_message = 'API key has exceeded usage limits'
-                elif not key_obj.active:
-                    error_message = 'API key has been deactivated'
-                else:
-                    error_message = 'API key has expired'
-                    
-                log_api_failure(api_key, error_message)
-                return jsonify({
-                    'success': False,
-                    'error': error_message
-                }), 403
-            
-            
-            # Check if the origin is allowed
-            origin_header = request.headers.get('Origin') or request.headers.get('Referer')
-            origin_host = None
-
-            if origin_header:
-                try:
-                    parsed_url = urlparse(origin_header if '://' in origin_header else f'http://{origin_header}')
-                    origin_host = parsed_url.hostname
-                except Exception as e:
-                    origin_host = None
-
-            if key_obj.allowed_origins:
-                if origin_host:
-                    if origin_host not in key_obj.allowed_origins:
-                        stats.register_request(success=False, endpoint=endpoint)
-                        error_message = f'Origin {origin_host} is not allowed for this API key'
-                        log_api_failure(api_key, error_message)
-                        return jsonify({'success': False, 'error': error_message}), 403
-                else:
-                    # fallback to IP check only if needed
-                    client_ip = request.remote_addr
-                    if client_ip not in key_obj.allowed_origins:
-                        stats.register_request(success=False, endpoint=endpoint)
-                        error_message = f'IP {client_ip} is not allowed for this API key'
-                        log_api_failure(api_key, error_message)
-                        return jsonify({'success': False, 'error': error_message}), 403
-
-            
-            # Register request and increment usage counter
+                error_message = f'Rate limit of {key_obj.rate_limit_rps:g} requests per second exceeded'
+                log_api_failure(api_request, api_key, error_message)
+                api_request.retry_after = retry_after
+                return error_message, 429
+
+        # Increment the usage counter; a concurrent request may have taken the last hits
+        if hits and not hit_counter.charge(key_obj, hits):
+            stats.register_request(success=False, endpoint=endpoint)
+            error_message = 'API key has exceeded usage limits'
+            log_api_failure(api_request, api_key, error_message)
+            return error_message, 403
+
+        if register_success:
             stats.register_request(success=True, endpoint=endpoint)
-            key_obj.hits_used += 1
-            key_store.add_key(key_obj)
-            
-            # Log successful request
-            event_type = request.endpoint.split('.')[-1] if '.' in request.endpoint else request.endpoint
-            details = {
-                'endpoint': request.endpoint,
-                'method': request.method,
-                'path': request.path,
-                'remote_addr': request.remote_addr,
-                'origin': origin_header or request.remote_addr or 'unknown'
-            }
-            user_activity.add_activity(api_key, event_type, details, success=True)
-            
-            return func(*args, **kwargs)
-            
-        except Exception as e:
-            print(f"Error in API key validation: {e}")
-            stats.register_request(success=False)
-            log_api_failure(api_key, f"Internal server error: {str(e)}")
-            return jsonify({
+
+        # Log successful request
+        details = {
+            'endpoint': api_request.endpoint,
+            'method': api_request.method,
+            'path': api_request.path,
+            'remote_addr': api_request.remote_addr,
+            'origin': origin_header or api_request.remote_addr or 'unknown'
+        }
+        user_activity.add_activity(api_key, api_request.event_type, details, success=True)
+
+        return None, None
+
+    except Exception as e:
+        print(f"Error in API key validation: {e}")
+        stats.register_request(success=False)
+        log_api_failure(api_request, api_key, f"Internal server error: {str(e)}")
+        return 'Internal server error', 500
+
+
+def require_api_key(func=None, hits=None, register_success=True):
+    """Decorator to require an API key for access
+
+    `hits` is how many hits the current request is charged (1 by default),
+    or a callable returning it, e.g. one per item of a batch.
+    `register_success` is passed on to authorize_api_request.
+    """
+    if func is None:
+        return lambda f: require_api_key(f, hits=hits, register_success=register_success)
+
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        count = hits() if callable(hits) else (1 if hits is None else hits)
+        api_request = APIRequest.from_flask()
+        error_message, status = authorize_api_request(api_request, hits=count, register_success=register_success)
+        if error_message:
+            response = jsonify({
                 'success': False,
-                'error': 'Internal server error'
-            }), 500
-    
+                'error': error_message
+            })
+            response.status_code = status
+            if api_request.retry_after:
+                response.headers['Retry-After'] = str(api_request.retry_after)
+            return response
+
+        return func(*args, **kwargs)
+
     return decorated_function
 
 
@@ -126,22 +198,36 @@ def require_admin(func):
     return decorated_function
 
 
-def log_api_failure(api_key, error_message):
+def log_api_failure(api_request, api_key, error_message):
     """Log a failed API request"""
     # Don't log captcha or get_captcha failures
-    if request.path not in ['/api/captcha', '/get_captcha']:
-        event_type = request.endpoint.split('.')[-1] if '.' in request.endpoint else request.endpoint
+    if api_request.path not in ['/api/captcha', '/get_captcha']:
         details = {
             'error': error_message,
-            'endpoint': request.endpoint,
-            'method': request.method,
-            'path': request.path,
-            'remote_addr': request.remote_addr,
-            'origin': request.headers.get('Origin') or request.headers.get('Referer') or request.remote_addr or 'unknown'
+            'endpoint': api_request.endpoint,
+            'method': api_request.method,
+            'path': api_request.path,
+            'remote_addr': api_request.remote_addr,
+            'origin': api_request.origin_header or api_request.remote_addr or 'unknown'
         }
-        user_activity.add_activity(api_key, event_type, details, success=False)
+        user_activity.add_activity(api_key, api_request.event_type, details, success=False)
+
+
+def start_timing():
+    metrics.start_request()
+
+
+def add_server_timing(response):
+    """Report the request's stage timings in a Server-Timing header"""
+    if metrics.enabled:
+        server_timing = metrics.server_timing()
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+        metrics.end_request(request.endpoint, request.method, response.status_code)
+    return response
 
 
 def init_middleware(app):
     """Initialize middleware for the Flask app"""
-    app.before_request(lambda: None)  # Placeholder for future use
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
@@ -1,13 +1,39 @@
 from datetime import datetime, timedelta
 import secrets
 import json
-from database import (get_db, get_user, get_user_by_id, get_api_key, update_api_key_hits,
-                     get_all_api_keys, get_stats, update_stats, log_activity,
-                     get_user_activities)
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from metrics import metrics
+from hit_counter import hit_counter
+from origins import OriginMatcher
+from rate_limit import rate_limiter
+from activity_writer import activity_writer
+from stats_aggregator import stats_aggregator
+from database import (get_db, get_user, get_user_by_id, get_api_key,
+                     get_all_api_keys, get_api_key_version, bump_api_key_version,
+                     get_stats, activity_row, get_user_activities)
+
+EXPIRY_FORMATS = ("%Y-%m-%d %I:%M:%S %p", "%Y-%m-%d")
+
+_UNSET = object()
+
+
+def parse_expiry(expiry_date):
+    """Epoch seconds of an expiry date, or None when it can't be read"""
+    for expiry_format in EXPIRY_FORMATS:
+        try:
+            return datetime.strptime(expiry_date, expiry_format).timestamp()
+        except (ValueError, TypeError):
+            pass
+    return None
+
 
 class APIKey:
     """Model for API key management"""
-    def __init__(self, owner_name, expiry_date, hit_limit, allowed_origins=None, key=None, active=True):
+    def __init__(self, owner_name, expiry_date, hit_limit, allowed_origins=None, key=None, active=True,
+                 webhook_url=None, rate_limit_rps=0, rate_limit_burst=0):
         self.id = secrets.token_hex(4)
         self.key = key or secrets.token_hex(16)
         self.owner_name = owner_name
@@ -17,6 +43,30 @@ class APIKey:
         self.allowed_origins = allowed_origins or []
         self.created_at = datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
         self.active = active
+        self.webhook_url = webhook_url
+        # Requests per second and bucket size; 0 means no rate limit
+        self.rate_limit_rps = rate_limit_rps
+        self.rate_limit_burst = rate_limit_burst
+        self._expiry_source = _UNSET
+        self._expires_at = None
+        self._origins_source = None
+        self._origin_matcher = None
+
+    @property
+    def expires_at(self):
+        """expiry_date as epoch seconds (None if unreadable), parsed once per value"""
+        if self._expiry_source != self.expiry_date:
+            self._expires_at = parse_expiry(self.expiry_date)
+            self._expiry_source = self.expiry_date
+        return self._expires_at
+
+    @property
+    def origin_matcher(self):
+        """allowed_origins compiled into an OriginMatcher, rebuilt when the list is replaced"""
+        if self._origins_source is not self.allowed_origins:
+            self._origin_matcher = OriginMatcher(self.allowed_origins)
+            self._origins_source = self.allowed_origins
+        return self._origin_matcher
 
     def to_dict(self):
         return {
@@ -28,56 +78,82 @@ class APIKey:
             "hits_used": self.hits_used,
             "allowed_origins": self.allowed_origins,
             "created_at": self.created_at,
-            "active": self.active
+            "active": self.active,
+            "webhook_url": self.webhook_url,
+            "rate_limit_rps": self.rate_limit_rps,
+            "rate_limit_burst": self.rate_limit_burst
         }
 
-    def is_valid(self):
-        """Check if the API key is valid based on expiry date and usage"""
+    def is_valid(self, hits=1):
+        """Check if the API key is valid based on expiry date and usage
+
+        `hits` is what the request is about to use; 0 checks everything but
+        the hit limit (e.g. polling for a job result).
+        """
         if not self.active:
             return False
 
         # Check expiry
-        try:
-            expiry = datetime.strptime(self.expiry_date, "%Y-%m-%d %I:%M:%S %p")
-            if expiry < datetime.now():
-                return False
-        except:
-            # If expiry date is just a date without time
-            try:
-                expiry = datetime.strptime(self.expiry_date, "%Y-%m-%d")
-                if expiry < datetime.now():
-                    return False
-            except:
-                return False
-        
+        expires_at = self.expires_at
+        if expires_at is None or expires_at < time.time():
+            return False
+
         # Check hit limit
-        if self.hit_limit > 0 and self.hits_used >= self.hit_limit:
+        if self.hit_limit > 0 and self.hits_used + hits > self.hit_limit:
             return False
         
         return True
 
     def increment_usage(self):
         """Increment the usage counter for this key"""
-        self.hits_used += 1
-        update_api_key_hits(self.id, self.hits_used)
+        hit_counter.charge(self, 1)
         return self.hits_used
 
     def can_access_from_origin(self, origin):
         """Check if the key can be used from the given origin"""
         if not self.allowed_origins:
             return True
-        return origin in self.allowed_origins
+        return self.origin_matcher.match(origin)
 
 
 class KeyStore:
-    """Storage for API keys"""
-    def __init__(self):
-        self.keys = {}
-        self.load_keys()
+    """Storage for API keys
+
+    get_key() serves request authentication from an in-process LRU cache
+    keyed by the key value. Saving or deleting a key bumps a version row in
+    the database; every worker reads it at most once per version_interval
+    seconds and drops its whole cache when it has changed, so admin changes
+    reach all workers within that bound. Entries are also reloaded after
+    cache_ttl seconds, which picks up other workers' hit counts.
+    """
+    def __init__(self, cache_ttl=Config.KEY_CACHE_TTL, cache_max_entries=Config.KEY_CACHE_MAX_ENTRIES,
+                 version_interval=Config.KEY_CACHE_VERSION_INTERVAL):
+        # Loaded on first use so importing models doesn't query the database
+        self._keys = None
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.version_interval = version_interval
+        self._cache = OrderedDict()  # key value -> (APIKey, loaded at), least recently used first
+        self._cached_ids = {}        # key id -> key value
+        self._cache_lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = None
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self.load_keys()
+        return self._keys
+
+    @keys.setter
+    def keys(self, value):
+        self._keys = value
 
     def load_keys(self):
         """Load keys from the database"""
-        keys_data = get_all_api_keys()
+        with hit_counter.snapshot():
+            keys_data = get_all_api_keys()
+            unflushed = {key_id: hit_counter.unflushed(key_id) for key_id in keys_data}
         self.keys = {}
         for key_id, key_data in keys_data.items():
             api_key = APIKey(
@@ -86,10 +162,13 @@ class KeyStore:
                 hit_limit=key_data.get('hit_limit', 0),
                 allowed_origins=key_data.get('allowed_origins', []),  # Already deserialized in database.py
                 key=key_data.get('key', ''),
-                active=key_data.get('active', True)
+                active=key_data.get('active', True),
+                webhook_url=key_data.get('webhook_url'),
+                rate_limit_rps=key_data.get('rate_limit_rps') or 0,
+                rate_limit_burst=key_data.get('rate_limit_burst') or 0
             )
             api_key.id = key_id
-            api_key.hits_used = key_data.get('hits_used', 0)
+            api_key.hits_used = key_data.get('hits_used', 0) + unflushed.get(key_id, 0)
             api_key.created_at = key_data.get('created_at', api_key.created_at)
             self.keys[key_id] = api_key
 
@@ -98,8 +177,64 @@ class KeyStore:
         pass
 
     def get_key(self, api_key):
-        """Get a key by its value"""
-        key_data = get_api_key(api_key)
+        """Get a key by its value, from the cache when it was loaded recently"""
+        now = time.monotonic()
+        if self.cache_ttl > 0:
+            self._check_version(now)
+        with self._cache_lock:
+            entry = self._cache.get(api_key)
+            if entry and now - entry[1] < self.cache_ttl:
+                self._cache.move_to_end(api_key)
+                return entry[0]
+            version = self._version
+
+        key = self._load_key(api_key)
+        if key and self.cache_ttl > 0:
+            with self._cache_lock:
+                # An admin change seen while loading may predate what was read, don't keep it
+                if version != self._version:
+                    return key
+                # The key's value may have changed since it was cached
+                self._forget(key.id)
+                if len(self._cache) >= self.cache_max_entries:
+                    _, (oldest, _) = self._cache.popitem(last=False)
+                    self._cached_ids.pop(oldest.id, None)
+                self._cache[api_key] = (key, now)
+                self._cached_ids[key.id] = api_key
+        return key
+
+    def _check_version(self, now):
+        """Drop every cached key when an admin has changed keys, from any worker"""
+        checked_at = self._version_checked_at
+        if checked_at is not None and now - checked_at < self.version_interval:
+            return
+        with self._cache_lock:
+            # Only one thread reads the version per interval
+            if self._version_checked_at != checked_at:
+                return
+            self._version_checked_at = now
+        with metrics.span('db_key'):
+            version = get_api_key_version()
+        with self._cache_lock:
+            if version != self._version:
+                self._version = version
+                self._cache.clear()
+                self._cached_ids.clear()
+
+    def invalidate(self, key_id):
+        """Drop a key from the cache so the next request reads it from the database"""
+        with self._cache_lock:
+            self._forget(key_id)
+
+    def _forget(self, key_id):
+        value = self._cached_ids.pop(key_id, None)
+        if value is not None:
+            self._cache.pop(value, None)
+
+    def _load_key(self, api_key):
+        with metrics.span('db_key'), hit_counter.snapshot():
+            key_data = get_api_key(api_key)
+            unflushed = hit_counter.unflushed(key_data['id']) if key_data else 0
         if not key_data:
             return None
         
@@ -109,10 +244,13 @@ class KeyStore:
             hit_limit=key_data['hit_limit'],
             allowed_origins=key_data['allowed_origins'],
             key=key_data['key'],
-            active=key_data['active']
+            active=key_data['active'],
+            webhook_url=key_data.get('webhook_url'),
+            rate_limit_rps=key_data.get('rate_limit_rps') or 0,
+            rate_limit_burst=key_data.get('rate_limit_burst') or 0
         )
         api_key.id = key_data['id']
-        api_key.hits_used = key_data['hits_used']
+        api_key.hits_used = key_data['hits_used'] + unflushed
         api_key.created_at = key_data['created_at']
         return api_key
 
@@ -123,6 +261,10 @@ class KeyStore:
 
     def add_key(self, key):
         """Add a new key"""
+        with metrics.span('db_key'):
+            return self._save_key(key)
+
+    def _save_key(self, key):
         try:
             conn = get_db()
             # Check if key exists
@@ -130,24 +272,32 @@ class KeyStore:
             existing = cursor.fetchone()
             
             if existing:
-                # Update existing key
+                # Update existing key; hits_used only changes through hit_counter
+                bump_api_key_version(conn)
                 conn.execute('''UPDATE api_keys SET 
                     key = ?, owner_name = ?, expiry_date = ?, hit_limit = ?, 
-                    hits_used = ?, allowed_origins = ?, active = ?
+                    allowed_origins = ?, active = ?, webhook_url = ?, rate_limit_rps = ?, rate_limit_burst = ?
                     WHERE id = ?''',
                     (key.key, key.owner_name, key.expiry_date, key.hit_limit,
-                     key.hits_used, json.dumps(key.allowed_origins), key.active, key.id))
+                     json.dumps(key.allowed_origins), key.active, key.webhook_url,
+                     key.rate_limit_rps, key.rate_limit_burst, key.id))
             else:
                 # Insert new key
                 conn.execute('''INSERT INTO api_keys 
-                    (id, key, owner_name, expiry_date, hit_limit, hits_used, allowed_origins, created_at, active)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (id, key, owner_name, expiry_date, hit_limit, hits_used, allowed_origins, created_at, active,
+                     webhook_url, rate_limit_rps, rate_limit_burst)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (key.id, key.key, key.owner_name, key.expiry_date,
                      key.hit_limit, key.hits_used, json.dumps(key.allowed_origins),
-                     key.created_at, key.active))
+                     key.created_at, key.active, key.webhook_url, key.rate_limit_rps, key.rate_limit_burst))
             
             conn.commit()
             self.keys[key.id] = key
+            # Saving the cached object itself keeps it; any other copy (an admin edit) replaces it
+            with self._cache_lock:
+                entry = self._cache.get(key.key)
+                if entry is None or entry[0] is not key:
+                    self._forget(key.id)
             return key
         except Exception as e:
             print(f"Error in add_key: {e}")
@@ -161,9 +311,12 @@ class KeyStore:
         if key_id in self.keys:
             conn = get_db()
             conn.execute('DELETE FROM api_keys WHERE id = ?', (key_id,))
+            bump_api_key_version(conn)
             conn.commit()
             conn.close()
             del self.keys[key_id]
+            self.invalidate(key_id)
+            rate_limiter.reset(key_id)
             return True
         return False
 
@@ -231,10 +384,23 @@ class Stats:
         if endpoint == 'api_get_captcha':
             return
             
-        update_stats(success)
+        # Counted in memory, stats_aggregator writes the totals every few seconds
+        with metrics.span('db_stats'):
+            stats_aggregator.add(1 if success else 0, 0 if success else 1)
+
+    def register_requests(self, successful, failed):
+        """Register the outcome of many requests (e.g. batch items) at once"""
+        if successful or failed:
+            with metrics.span('db_stats'):
+                stats_aggregator.add(successful, failed)
 
     def get_stats(self):
         """Get all statistics"""
+        # Include this process's latest requests
+        try:
+            stats_aggregator.flush()
+        except Exception as e:
+            print(f"Error writing request stats: {str(e)}")
         return get_stats()
 
 
@@ -249,7 +415,12 @@ class UserActivity:
         if event_type == "api_get_captcha" or (details and details.get('endpoint') == 'api_get_captcha'):
             return None
             
-        return log_activity(api_key, event_type, details or {}, success, ip_address)
+        row = activity_row(api_key, event_type, details or {}, success, ip_address)
+        if row is None:
+            return None
+        # Written in the background, so requests don't wait for the commit
+        with metrics.span('db_activity'):
+            activity_writer.submit(row)
 
     def get_activities(self, page=1, per_page=10):
         """Get paginated activities"""
@@ -0,0 +1,162 @@
+import ipaddress
+import re
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# Marks a trie node as the end of a "*.domain" entry
+_WILDCARD = '*'
+
+_HOSTNAME = re.compile(r'(?=.{1,253}\Z)([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?)(\.[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?)*\Z')
+
+# Origin headers and client addresses repeat, keep the recent parses
+ORIGIN_CACHE_SIZE = 1024
+
+
+class OriginError(ValueError):
+    """Raised for an allowed_origins entry that is not a host, *.domain, IP or CIDR block"""
+    pass
+
+
+def parse_entry(entry):
+    """Classify an allowed_origins entry as ('host', name), ('wildcard', labels) or ('network', network)
+
+    Entries may be written as URLs (https://example.com:8443), the scheme and
+    port are ignored like they are for incoming origins.
+    """
+    text = entry.strip().lower()
+    if '://' in text:
+        try:
+            text = urlparse(text).hostname or ''
+        except ValueError:
+            raise OriginError(f'{entry} is not a valid URL')
+    text = text.rstrip('.')
+
+    if '/' in text or ':' in text or text.replace('.', '').isdigit():
+        try:
+            network = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            host, _, port = text.rpartition(':')
+            if '/' in text or not port.isdigit() or ':' in host:
+                raise OriginError(f'{entry} is not a valid IP address or CIDR block')
+            # host:port
+            return parse_entry(host)
+        return 'network', network
+
+    if text.startswith('*.'):
+        domain = text[2:]
+        if not _HOSTNAME.match(domain):
+            raise OriginError(f'{entry} is not a valid wildcard domain')
+        return 'wildcard', domain.split('.')
+
+    if not _HOSTNAME.match(text):
+        raise OriginError(f'{entry} is not a valid host name')
+    return 'host', text
+
+
+class OriginMatcher:
+    """An API key's allowed_origins compiled for per-request checks
+
+    Exact hosts are a set lookup, "*.domain" entries a walk down a trie of
+    reversed labels (one step per label of the host) and CIDR blocks one set
+    lookup per distinct prefix length. "*.example.com" matches any subdomain
+    of example.com but not example.com itself. Entries that cannot be parsed
+    are kept as exact strings, as they were compared before.
+    """
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self._hosts = set()
+        self._trie = {}
+        # ip version -> {prefix length: set of network prefixes as ints}
+        self._networks = {4: {}, 6: {}}
+        for entry in self.entries:
+            try:
+                kind, value = parse_entry(entry)
+            except OriginError:
+                self._hosts.add(entry)
+                continue
+            if kind == 'host':
+                self._hosts.add(value)
+            elif kind == 'wildcard':
+                node = self._trie
+                for label in reversed(value):
+                    node = node.setdefault(label, {})
+                node[_WILDCARD] = True
+            else:
+                shift = value.max_prefixlen - value.prefixlen
+                prefixes = self._networks[value.version].setdefault(value.prefixlen, set())
+                prefixes.add(int(value.network_address) >> shift)
+        self._has_networks = bool(self._networks[4] or self._networks[6])
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def match(self, host):
+        """Whether a host name or IP address is allowed"""
+        if not host:
+            return False
+        if host in self._hosts:
+            return True
+        host = host.lower().rstrip('.')
+        if host in self._hosts:
+            return True
+        # Host names never end in a digit (top-level domains are letters), addresses always do
+        if self._has_networks and (host[-1].isdigit() or ':' in host) and self._match_address(host):
+            return True
+        return self._match_wildcard(host)
+
+    def _match_wildcard(self, host):
+        node = self._trie
+        if not node:
+            return False
+        labels = host.split('.')
+        # Stop before the first label, a wildcard needs at least one of its own
+        for label in labels[:0:-1]:
+            node = node.get(label)
+            if node is None:
+                return False
+            if _WILDCARD in node:
+                return True
+        return False
+
+    def _match_address(self, host):
+        address = parse_address(host)
+        if address is None:
+            return False
+        version, value, bits = address
+        for prefixlen, prefixes in self._networks[version].items():
+            if value >> (bits - prefixlen) in prefixes:
+                return True
+        return False
+
+
+@lru_cache(maxsize=ORIGIN_CACHE_SIZE)
+def parse_address(host):
+    """(version, integer value, bits) of an IP address, or None; IPv4-mapped IPv6 counts as IPv4"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.version, int(address), address.max_prefixlen
+
+
+def invalid_entries(entries):
+    """The entries parse_entry() rejects, with the reason for each"""
+    errors = []
+    for entry in entries:
+        try:
+            parse_entry(entry)
+        except OriginError as e:
+            errors.append(str(e))
+    return errors
+
+
+@lru_cache(maxsize=ORIGIN_CACHE_SIZE)
+def parse_origin_host(origin_header):
+    """The host of an Origin or Referer header, or None"""
+    try:
+        parsed_url = urlparse(origin_header if '://' in origin_header else f'http://{origin_header}')
+        return parsed_url.hostname
+    except Exception:
+        return None
@@ -0,0 +1,88 @@
+import math
+import threading
+import time
+
+from database import get_db
+
+# Refill the bucket for the time since its last update, then take the tokens
+# only if enough are there. One statement, so it is atomic across processes;
+# no row comes back when the request has to wait.
+_TAKE = '''INSERT INTO rate_limit_buckets (key_id, tokens, updated_at)
+    VALUES (:key_id, :burst - :cost, :now)
+    ON CONFLICT(key_id) DO UPDATE SET
+        tokens = MIN(:burst, tokens + MAX(0, :now - updated_at) * :rate) - :cost,
+        updated_at = MAX(updated_at, :now)
+    WHERE MIN(:burst, tokens + MAX(0, :now - updated_at) * :rate) >= :cost
+    RETURNING tokens'''
+
+
+class RateLimiter:
+    """Per-key token buckets shared by every worker process
+
+    A key with rate_limit_rps > 0 gets a bucket of rate_limit_burst tokens
+    (at least one second's worth when unset) that refills at rate_limit_rps
+    per second. Buckets live in SQLite and are updated with a single
+    atomic UPSERT, so the limit holds however many workers serve the key.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def burst_for(rate, burst):
+        return burst if burst and burst > 0 else max(1, math.ceil(rate))
+
+    def acquire(self, key_id, rate, burst, cost=1):
+        """Take cost tokens from a key's bucket
+
+        Returns None when the request may go ahead, otherwise the whole
+        seconds until the tokens are there (for Retry-After). A cost larger
+        than the bucket is capped at its size, so big batches wait for a
+        full bucket instead of never passing.
+        """
+        if not rate or rate <= 0:
+            return None
+        burst = self.burst_for(rate, burst)
+        cost = min(max(cost, 1), burst)
+        now = time.time()
+        params = {'key_id': key_id, 'rate': rate, 'burst': burst, 'cost': cost, 'now': now}
+        conn = get_db()
+        try:
+            taken = conn.execute(_TAKE, params).fetchone()
+            conn.commit()
+            if taken:
+                self._count('allowed')
+                return None
+            row = conn.execute('SELECT tokens, updated_at FROM rate_limit_buckets WHERE key_id = ?',
+                               (key_id,)).fetchone()
+        finally:
+            conn.close()
+
+        self._count('limited')
+        available = min(burst, row['tokens'] + max(0, now - row['updated_at']) * rate) if row else 0
+        return max(1, math.ceil((cost - available) / rate))
+
+    def reset(self, key_id):
+        """Forget a key's bucket, e.g. when the key is deleted"""
+        conn = get_db()
+        try:
+            conn.execute('DELETE FROM rate_limit_buckets WHERE key_id = ?', (key_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "limited": self.limited
+            }
+
+
+# Create global instance for use across the application
+rate_limiter = RateLimiter()
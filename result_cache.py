@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import hmac
+import importlib.util
+import json
+import threading
+import time
+
+from config import Config
+from database import get_db
+from single_flight import verification_key
+
+
+class ResultCache:
+    """Encrypted SQLite cache of mapped verification results
+
+    Entries are keyed by an HMAC of the registration number and date of
+    birth, so neither is stored in the clear, and the record itself is
+    Fernet-encrypted. Each entry carries its own expiry; once the cache is
+    over max_entries the least recently read entries are evicted.
+    """
+    def __init__(self, enabled, ttl, max_entries, secret_key, encryption_key=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._hmac_key = hashlib.sha256(b'result-cache-key:' + secret_key.encode()).digest()
+        self._encryption_key = encryption_key or base64.urlsafe_b64encode(
+            hashlib.sha256(b'result-cache-encryption:' + secret_key.encode()).digest())
+        self._fernet = None
+        if enabled and importlib.util.find_spec('cryptography') is None:
+            print("Result cache disabled: the cryptography package is not installed")
+            enabled = False
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _key(self, reg_number, dob):
+        message = '|'.join(verification_key(reg_number, dob)).encode()
+        return hmac.new(self._hmac_key, message, hashlib.sha256).hexdigest()
+
+    @property
+    def fernet(self):
+        if self._fernet is None:
+            from cryptography.fernet import Fernet
+            self._fernet = Fernet(self._encryption_key)
+        return self._fernet
+
+    def encrypt(self, record):
+        """Fernet token of a record, also used for job results kept for polling"""
+        return self.fernet.encrypt(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+
+    def decrypt(self, token):
+        """The record in a token from encrypt(); raises InvalidToken for one made with another key"""
+        return json.loads(self.fernet.decrypt(token))
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, reg_number, dob):
+        """Return the cached mapped record, or None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        cache_key = self._key(reg_number, dob)
+        conn = get_db()
+        try:
+            row = conn.execute('SELECT payload, expires_at FROM verification_cache WHERE cache_key = ?',
+                               (cache_key,)).fetchone()
+            if not row or row['expires_at'] <= now:
+                if row:
+                    conn.execute('DELETE FROM verification_cache WHERE cache_key = ?', (cache_key,))
+                    conn.commit()
+                self._count('misses')
+                return None
+            from cryptography.fernet import InvalidToken
+            try:
+                record = self.decrypt(row['payload'])
+            except InvalidToken:
+                # Written under a different key; treat as absent
+                conn.execute('DELETE FROM verification_cache WHERE cache_key = ?', (cache_key,))
+                conn.commit()
+                self._count('misses')
+                return None
+            conn.execute('UPDATE verification_cache SET last_access = ?, hits = hits + 1 WHERE cache_key = ?',
+                         (now, cache_key))
+            conn.commit()
+        finally:
+            conn.close()
+        self._count('hits')
+        return record
+
+    def set(self, reg_number, dob, record, ttl=None):
+        """Store a mapped record for ttl seconds (the cache default if None)"""
+        if not self.enabled:
+            return
+        now = time.time()
+        payload = self.encrypt(record)
+        conn = get_db()
+        try:
+            conn.execute('''INSERT OR REPLACE INTO verification_cache
+                (cache_key, payload, created_at, expires_at, last_access, hits)
+                VALUES (?, ?, ?, ?, ?, 0)''',
+                (self._key(reg_number, dob), payload, now, now + (self.ttl if ttl is None else ttl), now))
+            evicted = self._evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self.stores += 1
+            self.evictions += evicted
+
+    def _evict(self, conn, now):
+        evicted = conn.execute('DELETE FROM verification_cache WHERE expires_at <= ?', (now,)).rowcount
+        count = conn.execute('SELECT COUNT(*) FROM verification_cache').fetchone()[0]
+        if count > self.max_entries:
+            evicted += conn.execute('''DELETE FROM verification_cache WHERE cache_key IN (
+                SELECT cache_key FROM verification_cache ORDER BY last_access ASC LIMIT ?)''',
+                (count - self.max_entries,)).rowcount
+        return evicted
+
+    def invalidate(self, reg_number, dob):
+        """Drop the cached record for one registration number and date of birth"""
+        if not self.enabled:
+            return False
+        conn = get_db()
+        try:
+            removed = conn.execute('DELETE FROM verification_cache WHERE cache_key = ?',
+                                   (self._key(reg_number, dob),)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self.invalidations += removed
+        return removed > 0
+
+    def clear(self):
+        """Drop every cached record"""
+        if not self.enabled:
+            return 0
+        conn = get_db()
+        try:
+            removed = conn.execute('DELETE FROM verification_cache').rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self.invalidations += removed
+        return removed
+
+    def get_stats(self):
+        """Get hit/miss counters and the current size"""
+        entries = 0
+        if self.enabled:
+            conn = get_db()
+            try:
+                entries = conn.execute('SELECT COUNT(*) FROM verification_cache WHERE expires_at > ?',
+                                       (time.time(),)).fetchone()[0]
+            finally:
+                conn.close()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+def cache_bypassed(cache_control):
+    """Check whether a client asked to skip the cache with Cache-Control: no-cache"""
+    directives = [d.strip().lower() for d in (cache_control or '').split(',')]
+    return 'no-cache' in directives or 'no-store' in directives
+
+
+# Create global instance for use across the application
+result_cache = ResultCache(
+    enabled=Config.RESULT_CACHE_ENABLED,
+    ttl=Config.RESULT_CACHE_TTL,
+    max_entries=Config.RESULT_CACHE_MAX_ENTRIES,
+    secret_key=Config.SECRET_KEY,
+    encryption_key=Config.RESULT_CACHE_ENCRYPTION_KEY
+)
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+
+from config import Config
+
+
+def verification_key(reg_number, dob):
+    """Normalize a (registration number, date of birth) pair so equal queries match"""
+    return ''.join(str(reg_number).split()), ''.join(str(dob).split())
+
+
+class _Call:
+    """One upstream execution that concurrent duplicates can wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def resolve(self, result=None, error=None):
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.done.set()
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(self._wake, future)
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def add_future(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.done.is_set():
+                future.set_result(None)
+            else:
+                self._futures.append((loop, future))
+        return future
+
+
+class SingleFlight:
+    """Lets concurrent identical verifications share one upstream execution
+
+    The first caller for a key leads and runs the work; callers arriving
+    while it runs wait for its result instead. When the leader fails (its
+    captcha may simply have been wrong) or takes too long, waiters fall back
+    to running the work themselves.
+
+    Waiters never submit their own captcha: they get the record because the
+    leader solved one for the same query, just as a result_cache hit needs
+    no captcha at all. Their leases go back unused. With enabled=False
+    (SINGLE_FLIGHT_ENABLED=false) every caller runs its own work, so every
+    record costs a solved captcha.
+    """
+    def __init__(self, wait_timeout, enabled=True):
+        self.wait_timeout = wait_timeout
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.resolve(result, error)
+
+    def _shared(self, call):
+        with self._lock:
+            if call.done.is_set() and call.error is None:
+                self.coalesced += 1
+                return True
+            self.fallbacks += 1
+            return False
+
+    def run(self, key, func):
+        """Run func() once per key among concurrent callers; returns (result, coalesced)"""
+        if not self.enabled:
+            return func(), False
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait(self.wait_timeout)
+            if self._shared(call):
+                return call.result, True
+            return func(), False
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result, False
+
+    async def arun(self, key, coro_func):
+        """Async variant of run, for coroutine functions"""
+        if not self.enabled:
+            return await coro_func(), False
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                await asyncio.wait_for(call.add_future(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self._shared(call):
+                return call.result, True
+            return await coro_func(), False
+
+        try:
+            result = await coro_func()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result, False
+
+    def get_stats(self):
+        """Get coalescing counters"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "fallbacks": self.fallbacks
+            }
+
+
+# Create global instance for use across the application
+single_flight = SingleFlight(wait_timeout=Config.SINGLE_FLIGHT_WAIT_TIMEOUT, enabled=Config.SINGLE_FLIGHT_ENABLED)
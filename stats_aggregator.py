@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta
+
+from config import Config
+from database import add_hourly_stats
+from flusher import BackgroundFlusher
+
+
+class StatsAggregator(BackgroundFlusher):
+    """Request counters aggregated in memory and flushed periodically
+
+    Outcomes are counted per hour (and so per day) as they happen, and the
+    totals are added to the stats tables in one transaction every
+    flush_interval seconds. The writes are additive UPSERTs, so every
+    worker process can flush its own counts without coordination, and the
+    SQLite write rate no longer follows the request rate. A flush_interval
+    of 0 writes every request inline.
+    """
+    thread_name = 'stats-flusher'
+    flush_error = 'Error writing request stats'
+
+    def __init__(self, flush_interval):
+        super().__init__(flush_interval)
+        self._pending = {}
+        self._hour = None
+        self._hour_ends = 0
+        self.flushes = 0
+
+    def _current_hour(self):
+        # Formatting the time costs more than the rest of add(), so reuse the label until the hour is over
+        now = time.time()
+        if now >= self._hour_ends:
+            start = datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+            self._hour = start.strftime('%Y-%m-%d %H')
+            self._hour_ends = (start + timedelta(hours=1)).timestamp()
+        return self._hour
+
+    def add(self, successful, failed):
+        """Count requests towards the current hour"""
+        hour = self._current_hour()
+        if not self.flush_interval:
+            add_hourly_stats({hour: (successful, failed)})
+            return
+        with self._lock:
+            counts = self._pending.get(hour)
+            if counts is None:
+                counts = self._pending[hour] = [0, 0]
+            counts[0] += successful
+            counts[1] += failed
+            self._ensure_flusher()
+
+    def flush(self):
+        """Write the pending counts; on failure they stay pending for the next try"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+            try:
+                add_hourly_stats(pending)
+            except Exception:
+                with self._lock:
+                    for hour, (successful, failed) in pending.items():
+                        counts = self._pending.setdefault(hour, [0, 0])
+                        counts[0] += successful
+                        counts[1] += failed
+                raise
+            with self._lock:
+                self.flushes += 1
+
+
+# Create global instance for use across the application
+stats_aggregator = StatsAggregator(flush_interval=Config.STATS_FLUSH_INTERVAL)
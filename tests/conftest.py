@@ -0,0 +1,27 @@
+import pytest
+
+import database
+from activity_writer import activity_writer
+from hit_counter import hit_counter
+from stats_aggregator import stats_aggregator
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    """Give every test its own SQLite database instead of app.db"""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'app.db'))
+    monkeypatch.setattr(database, '_schema_migrated', False)
+    database.init_db()
+    yield database.DB_PATH
+    # Write what the test left buffered into its own database, not into app.db at exit
+    for flusher in (hit_counter, activity_writer, stats_aggregator):
+        flusher.flush()
+
+
+@pytest.fixture(scope='session')
+def fake_upstream():
+    """URL of a local stand-in of the upstream site (bench/fake_upstream.py)"""
+    from bench.page_load import start_fake_upstream
+    server, url = start_fake_upstream()
+    yield url
+    server.shutdown()
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+import activity_writer as activity_writer_module
+from activity_writer import BLOCK, DROP_NEWEST, DROP_OLDEST, ActivityWriter
+from database import activity_row, get_user_activities
+
+
+def row(name):
+    return activity_row('key', 'api_verify', {'nameEn': name}, True)
+
+
+def names():
+    return [activity['details']['nameEn'] for activity in reversed(get_user_activities())]
+
+
+def make_writer(max_queue=2, overflow=DROP_NEWEST, batch_size=100):
+    # A long interval keeps the background thread from writing until it is woken or stopped
+    return ActivityWriter(max_queue=max_queue, batch_size=batch_size, flush_interval=60, overflow=overflow,
+                          block_timeout=1)
+
+
+def test_rejects_unknown_overflow_policies():
+    with pytest.raises(ValueError):
+        make_writer(overflow='drop_all')
+
+
+def test_rows_wait_for_the_flush():
+    writer = make_writer()
+    writer.submit(row('a'))
+    writer.submit(row('b'))
+    assert names() == []
+    writer.flush()
+    assert names() == ['a', 'b']
+    assert writer.get_stats()['written'] == 2
+    writer.stop()
+
+
+def test_drop_newest_keeps_the_queued_rows():
+    writer = make_writer(overflow=DROP_NEWEST)
+    for name in 'abc':
+        writer.submit(row(name))
+    writer.stop()
+    assert names() == ['a', 'b']
+    assert writer.get_stats()['dropped'] == 1
+
+
+def test_drop_oldest_keeps_the_newest_rows():
+    writer = make_writer(overflow=DROP_OLDEST)
+    for name in 'abc':
+        writer.submit(row(name))
+    writer.stop()
+    assert names() == ['b', 'c']
+    assert writer.get_stats()['dropped'] == 1
+
+
+def test_block_waits_for_the_writer_to_make_room():
+    writer = make_writer(max_queue=1, overflow=BLOCK)
+    for name in 'abc':
+        writer.submit(row(name))
+    writer.stop()
+    assert names() == ['a', 'b', 'c']
+    assert writer.get_stats()['dropped'] == 0
+
+
+def test_a_full_batch_wakes_the_writer():
+    writer = make_writer(max_queue=10, batch_size=2)
+    writer.submit(row('a'))
+    writer.submit(row('b'))
+    deadline = time.monotonic() + 5
+    while writer.get_stats()['written'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert names() == ['a', 'b']
+    writer.stop()
+
+
+def test_stop_flushes_what_is_queued():
+    writer = make_writer(max_queue=10)
+    writer.submit(row('a'))
+    writer.stop()
+    assert names() == ['a']
+    assert not writer._thread.is_alive()
+
+
+def test_failed_batches_are_counted_and_dropped(monkeypatch):
+    writer = make_writer(max_queue=10)
+
+    def fail(rows):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(activity_writer_module, 'log_activities', fail)
+    writer.submit(row('a'))
+    writer.stop()
+    stats = writer.get_stats()
+    assert (stats['errors'], stats['dropped'], stats['written']) == (1, 1, 0)
+
+
+def test_no_queue_writes_inline():
+    writer = make_writer(max_queue=0)
+    writer.submit(row('a'))
+    assert names() == ['a']
+    assert writer._thread is None
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+import app as app_module
+import batch_verify
+from activity_writer import activity_writer
+from batch_verify import batch_error, batch_items, batch_summary, count_items, verify_item
+from captcha_tickets import CaptchaTicketStore
+from config import Config
+from database import get_user_activities
+from engines import UpstreamError
+from mapping import map_verification_data
+from models import APIKey, key_store
+
+RECORD = {'Registered Person Name': 'RAHIM UDDIN', 'Birth Registration Number': '19901234',
+          'Date of Birth': '05 March 2010'}
+
+
+class FakeEngine:
+    """Stands in for the upstream engine: answers 'right' captchas with RECORD"""
+    blocking_workers = 4
+
+    def __init__(self):
+        self.submitted = []
+        self.released = []
+
+    def submit(self, lease, reg_number, dob, captcha):
+        self.submitted.append((lease, reg_number, dob, captcha))
+        if captcha != 'right':
+            raise UpstreamError('Captcha mismatch')
+        return dict(RECORD)
+
+    def release(self, lease, error=None):
+        self.released.append((lease, error))
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(batch_verify, 'ticket_store', CaptchaTicketStore(engine, 'secret', 60, 60))
+    return engine
+
+
+def item(engine, captcha='right', **fields):
+    fields.setdefault('reg_number', '19901234')
+    fields.setdefault('dob', '2010-03-05')
+    return dict(fields, captcha=captcha, captcha_token=batch_verify.ticket_store.issue(object()))
+
+
+def test_batch_items_accepts_a_list_or_an_items_object():
+    assert batch_items([{'a': 1}]) == [{'a': 1}]
+    assert batch_items({'items': [{'a': 1}]}) == [{'a': 1}]
+    for body in (None, [], {'items': []}, [1], {'items': 'x'}):
+        assert batch_items(body) is None
+
+
+def test_count_items_charges_a_rejected_batch_once():
+    assert count_items({'items': [{}, {}, {}]}) == 3
+    assert count_items(None) == 1
+    assert count_items([{}] * (Config.BATCH_MAX_ITEMS + 1)) == 1
+    assert batch_error([{}] * (Config.BATCH_MAX_ITEMS + 1))
+
+
+def test_verify_item_returns_the_mapped_record(engine):
+    outcome = verify_item(engine, map_verification_data, 3, item(engine, id='a'), use_cache=False)
+    assert outcome['success'] and outcome['index'] == 3 and outcome['id'] == 'a'
+    assert outcome['data']['nameEn'] == 'Rahim Uddin'
+    assert outcome['cached'] is False
+    assert len(engine.released) == 1 and engine.released[0][1] is None
+
+
+def test_verify_item_reports_failures_instead_of_raising(engine):
+    outcome = verify_item(engine, map_verification_data, 0, item(engine, captcha='wrong'), use_cache=False)
+    assert not outcome['success'] and outcome['error'] == 'Captcha mismatch'
+    # The lease goes back with the error, so the engine can retire the session
+    assert isinstance(engine.released[0][1], UpstreamError)
+
+    outcome = verify_item(engine, map_verification_data, 1, {'reg_number': '1'}, use_cache=False)
+    assert not outcome['success'] and 'Missing required fields' in outcome['error']
+
+    outcome = verify_item(engine, map_verification_data, 2, dict(item(engine), captcha_token='bad'), use_cache=False)
+    assert outcome == {'index': 2, 'success': False, 'error': 'Invalid captcha token'}
+
+
+def test_batch_summary():
+    outcomes = [{'success': True, 'cached': True}, {'success': True, 'cached': False}, {'success': False}]
+    assert batch_summary(outcomes) == {'total': 3, 'succeeded': 2, 'failed': 1, 'cached': 1}
+
+
+def test_batch_logs_an_activity_per_verified_item(engine, monkeypatch):
+    monkeypatch.setattr(app_module, 'engine', engine)
+    key = key_store.add_key(APIKey('tester', '2099-01-01', 100))
+    items = [item(engine), item(engine, captcha='wrong', reg_number='19909999'), item(engine, reg_number='19905678')]
+
+    response = app_module.app.test_client().post('/api/verify/batch', json={'items': items},
+                                                 headers={'X-API-KEY': key.key, 'Cache-Control': 'no-cache'})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]['summary'] == {'total': 3, 'succeeded': 2, 'failed': 1, 'cached': 0}
+
+    activity_writer.flush()
+    entries = [a for a in get_user_activities() if a['event_type'] == 'api_verify_batch']
+    assert len(entries) == 2
+    assert all(entry['details']['nameEn'] == 'Rahim Uddin' for entry in entries)
+    assert all(entry['api_key'] == key.key for entry in entries)
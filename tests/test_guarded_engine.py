@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+from engines import PoolExhausted, UpstreamError
+from engines import guarded
+from engines.guarded import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, GuardedEngine, UpstreamUnavailable
+
+
+class Clock:
+    """Stands in for the time module so the breaker's window and open period can be stepped through"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(guarded, 'time', clock)
+    return clock
+
+
+class FakeEngine:
+    """Raises the next queued error from each call, or answers"""
+    name = 'fake'
+    blocking_workers = 2
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.errors = []
+        self.duration = 0.1
+        self.calls = 0
+
+    def _answer(self):
+        self.calls += 1
+        self.clock.now += self.duration
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+    def open_captcha(self, timeout=None):
+        return self._answer()
+
+    def submit(self, lease, reg_number, dob, captcha):
+        return self._answer()
+
+    async def asubmit(self, lease, reg_number, dob, captcha):
+        return self._answer()
+
+    def get_stats(self):
+        return {'engine': self.name}
+
+
+def make_engine(clock, max_in_flight=0, **overrides):
+    options = dict(window=60, min_calls=4, failure_rate=0.5, slow_call_seconds=5, slow_rate=0.8,
+                   open_seconds=30, half_open_probes=1)
+    options.update(overrides)
+    fake = FakeEngine(clock)
+    return GuardedEngine(fake, CircuitBreaker(**options), max_in_flight=max_in_flight), fake
+
+
+def fail(engine, fake, error):
+    fake.errors.append(error)
+    with pytest.raises(type(error)):
+        engine.open_captcha()
+
+
+def test_opens_once_enough_calls_fail(clock):
+    engine, fake = make_engine(clock)
+    engine.open_captcha()
+    fail(engine, fake, RuntimeError('connection reset'))
+    engine.open_captcha()
+    assert engine.breaker.state == CLOSED
+    fail(engine, fake, RuntimeError('connection reset'))
+    assert engine.breaker.state == OPEN
+
+    calls = fake.calls
+    with pytest.raises(UpstreamUnavailable) as error:
+        engine.open_captcha()
+    # Fails fast without reaching the upstream
+    assert fake.calls == calls
+    assert error.value.retry_after == 31
+    stats = engine.get_stats()['breaker']
+    assert (stats['trips'], stats['rejected'], stats['last_trip_reason']) == (1, 1, '2/4 calls failed')
+
+
+def test_opens_on_slow_calls(clock):
+    engine, fake = make_engine(clock)
+    fake.duration = 6
+    for _ in range(4):
+        engine.open_captcha()
+    assert engine.breaker.state == OPEN
+    assert engine.breaker.last_trip_reason == '4/4 calls slower than 5s'
+
+
+def test_failures_outside_the_window_are_forgotten(clock):
+    engine, fake = make_engine(clock)
+    fail(engine, fake, RuntimeError('timeout'))
+    fail(engine, fake, RuntimeError('timeout'))
+    clock.now += 61
+    for _ in range(3):
+        engine.open_captcha()
+    assert engine.breaker.state == CLOSED
+
+
+def trip(engine, fake):
+    for _ in range(4):
+        fail(engine, fake, RuntimeError('connection reset'))
+    assert engine.breaker.state == OPEN
+
+
+def test_half_open_probe_success_closes(clock):
+    engine, fake = make_engine(clock)
+    trip(engine, fake)
+    clock.now += 30
+    assert engine.open_captcha() == 'ok'
+    assert engine.breaker.state == CLOSED
+    assert engine.get_stats()['breaker']['calls'] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    engine, fake = make_engine(clock)
+    trip(engine, fake)
+    clock.now += 30
+    fail(engine, fake, RuntimeError('connection reset'))
+    assert engine.breaker.state == OPEN
+    assert engine.breaker.last_trip_reason == 'probe failed'
+    assert engine.breaker.trips == 2
+
+
+def test_half_open_lets_only_the_probes_through(clock):
+    engine, fake = make_engine(clock)
+    trip(engine, fake)
+    clock.now += 30
+    engine.breaker.allow()
+    assert engine.breaker.state == HALF_OPEN
+    with pytest.raises(UpstreamUnavailable):
+        engine.open_captcha()
+
+
+def test_rejected_captchas_and_full_pools_are_not_failures(clock):
+    engine, fake = make_engine(clock)
+    for _ in range(4):
+        fake.errors.append(UpstreamError('Captcha mismatch'))
+        with pytest.raises(UpstreamError):
+            engine.submit(None, '1', '2010-03-05', 'wrong')
+    # Counted, but as successes: a wrong answer says nothing about the upstream
+    assert engine.breaker.state == CLOSED
+    assert engine.get_stats()['breaker']['failure_rate'] == 0
+
+    for _ in range(4):
+        fail(engine, fake, PoolExhausted('No upstream session is free', retry_after=1))
+    # Not counted at all
+    assert engine.get_stats()['breaker']['calls'] == 4
+    assert engine.breaker.state == CLOSED
+
+
+def test_full_pool_gives_back_the_probe(clock):
+    engine, fake = make_engine(clock)
+    trip(engine, fake)
+    clock.now += 30
+    fail(engine, fake, PoolExhausted('No upstream session is free', retry_after=1))
+    assert engine.breaker.state == HALF_OPEN
+    assert engine.open_captcha() == 'ok'
+    assert engine.breaker.state == CLOSED
+
+
+def test_async_calls_feed_the_breaker(clock):
+    engine, fake = make_engine(clock, min_calls=2)
+
+    async def submit_all():
+        for _ in range(2):
+            fake.errors.append(RuntimeError('connection reset'))
+            with pytest.raises(RuntimeError):
+                await engine.asubmit(None, '1', '2010-03-05', 'abc')
+
+    asyncio.run(submit_all())
+    assert engine.breaker.state == OPEN
+
+
+def test_sheds_captcha_loads_over_max_in_flight(clock):
+    engine, fake = make_engine(clock, max_in_flight=1)
+    engine._in_flight = 1
+    with pytest.raises(UpstreamUnavailable):
+        engine.open_captcha()
+    # Submissions are let in, the client already holds a captcha
+    assert engine.submit(None, '1', '2010-03-05', 'abc') == 'ok'
+    assert engine.get_stats()['admission']['shed'] == 1
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+import hit_counter as hit_counter_module
+import models
+from database import get_api_key
+from hit_counter import HitCounter
+from models import APIKey, KeyStore
+
+
+@pytest.fixture
+def counter():
+    counter = HitCounter(flush_interval=60, flush_threshold=1000)
+    yield counter
+    counter.stop()
+
+
+def make_key(hit_limit=10):
+    key = APIKey(owner_name='test', expiry_date='2099-01-01', hit_limit=hit_limit)
+    KeyStore().add_key(key)
+    return key
+
+
+def stored_hits(key):
+    return get_api_key(key.key)['hits_used']
+
+
+def test_charge_stops_at_the_limit(counter):
+    key = make_key(hit_limit=3)
+    assert counter.charge(key, 2)
+    assert not counter.charge(key, 2)
+    assert counter.charge(key, 1)
+    assert not counter.charge(key, 1)
+    assert key.hits_used == 3
+    assert counter.unflushed(key.id) == 3
+
+
+def test_unlimited_key(counter):
+    key = make_key(hit_limit=0)
+    assert counter.charge(key, 500)
+
+
+def test_flush_adds_to_what_other_workers_wrote(counter):
+    key = make_key(hit_limit=0)
+    other_worker = HitCounter(flush_interval=60, flush_threshold=1000)
+    counter.charge(key, 3)
+    other_worker.charge(key, 4)
+    assert counter.flush() == 3
+    assert other_worker.flush() == 4
+    other_worker.stop()
+    assert stored_hits(key) == 7
+    assert counter.unflushed(key.id) == 0
+
+
+def test_failed_flush_keeps_hits_pending(counter, monkeypatch):
+    key = make_key()
+    counter.charge(key, 2)
+
+    def unavailable(increments):
+        raise RuntimeError('database is locked')
+
+    write = hit_counter_module.add_api_key_hits
+    monkeypatch.setattr(hit_counter_module, 'add_api_key_hits', unavailable)
+    with pytest.raises(RuntimeError):
+        counter.flush()
+    assert counter.unflushed(key.id) == 2
+
+    monkeypatch.setattr(hit_counter_module, 'add_api_key_hits', write)
+    assert counter.flush() == 2
+    assert stored_hits(key) == 2
+
+
+def test_threshold_wakes_the_flusher():
+    counter = HitCounter(flush_interval=60, flush_threshold=3)
+    key = make_key()
+    for _ in range(3):
+        counter.charge(key, 1)
+    deadline = time.monotonic() + 5
+    while stored_hits(key) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    counter.stop()
+    assert stored_hits(key) == 3
+
+
+def test_stop_writes_pending_hits(counter):
+    key = make_key()
+    counter.charge(key, 5)
+    counter.stop()
+    assert stored_hits(key) == 5
+
+
+def test_key_loaded_during_a_flush_counts_hits_once(counter, monkeypatch):
+    monkeypatch.setattr(models, 'hit_counter', counter)
+    key = make_key()
+    counter.charge(key, 4)
+    loaded = []
+    write = hit_counter_module.add_api_key_hits
+
+    def write_then_load(increments):
+        write(increments)
+        # The commit is done but the flush has not forgotten its hits yet
+        loader = threading.Thread(target=lambda: loaded.append(KeyStore()._load_key(key.key)))
+        loader.start()
+        loader.join(0.2)
+
+    monkeypatch.setattr(hit_counter_module, 'add_api_key_hits', write_then_load)
+    counter.flush()
+    deadline = time.monotonic() + 5
+    while not loaded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert loaded[0].hits_used == 4
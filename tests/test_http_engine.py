@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import pytest
+
+from engines import PoolExhausted, UpstreamError
+from engines.http_engine import HttpEngine
+
+
+@pytest.fixture
+def engine(fake_upstream):
+    engine = HttpEngine(base_url=fake_upstream, max_sessions=2, checkout_timeout=1, request_timeout=5)
+    yield engine
+    engine.shutdown()
+
+
+def test_captcha_and_submit(engine):
+    lease, image = engine.open_captcha()
+    try:
+        assert image.startswith(b'\x89PNG')
+        data = engine.submit(lease, '19901234567890123', '2010-03-05', 'abc')
+    finally:
+        engine.release(lease)
+
+    assert data['Birth Registration Number'] == '19901234567890123'
+    assert data['Date of Birth'] == '05 March 2010'
+    assert data['নিবন্ধিত ব্যক্তির নাম'] == 'রহিম আহমেদ'
+    assert data['address'] == 'HOUSE 12, ROAD 5, DHANMONDI, DHAKA'
+    assert data['birthPlaceEn'] == 'DHAKA'
+    assert engine.get_stats()['busy'] == 0
+
+
+def test_rejected_captcha_raises_upstream_error(engine):
+    lease, _ = engine.open_captcha()
+    with pytest.raises(UpstreamError, match='Captcha mismatch'):
+        engine.submit(lease, '19901234567890123', '2010-03-05', 'wrong')
+    engine.release(lease, error=UpstreamError('Captcha mismatch'))
+    # A rejected answer is the caller's mistake, not an engine failure
+    assert engine.get_stats()['failures'] == 0
+
+
+def test_missing_record(engine):
+    lease, _ = engine.open_captcha()
+    with pytest.raises(UpstreamError, match='No record found'):
+        engine.submit(lease, '0000', '2010-03-05', 'abc')
+    engine.release(lease)
+
+
+def test_pool_exhausted(engine):
+    leases = [engine.open_captcha()[0] for _ in range(2)]
+    with pytest.raises(PoolExhausted):
+        engine.open_captcha(timeout=0.1)
+    for lease in leases:
+        engine.release(lease)
+    lease, _ = engine.open_captcha(timeout=0.1)
+    engine.release(lease)
+
+
+def test_async_captcha_and_submit(engine):
+    async def verify():
+        lease, _ = await engine.aopen_captcha()
+        try:
+            return await engine.asubmit(lease, '19901234567890123', '2010-03-05', 'abc')
+        finally:
+            await engine.arelease(lease)
+
+    assert asyncio.run(verify())['Birth Registration Number'] == '19901234567890123'
+
+
+def test_shutdown_closes_the_async_transport_on_its_loop(engine):
+    # The ASGI server shuts the engine down from a worker thread while its loop still runs
+    async def serve():
+        lease, _ = await engine.aopen_captcha()
+        await engine.arelease(lease)
+        transport = engine.async_transport
+        close = transport.aclose
+        closed_on = []
+
+        async def aclose():
+            closed_on.append(asyncio.get_running_loop())
+            await close()
+
+        transport.aclose = aclose
+        await asyncio.to_thread(engine.shutdown)
+        return closed_on == [asyncio.get_running_loop()]
+
+    assert asyncio.run(serve())
+    assert engine.async_transport is None
+
+
+def test_async_waiter_woken_by_release_from_thread(engine):
+    leases = [engine.open_captcha()[0] for _ in range(2)]
+
+    async def wait_for_session():
+        loop = asyncio.get_running_loop()
+        threading.Timer(0.1, engine.release, args=(leases.pop(),)).start()
+        started = loop.time()
+        lease = await engine._aacquire(timeout=5)
+        return lease, loop.time() - started
+
+    lease, waited = asyncio.run(wait_for_session())
+    assert waited < 1
+    assert not engine._async_waiters
+    engine.release(lease)
+    engine.release(leases.pop())
+
+
+def test_async_acquire_times_out(engine):
+    leases = [engine.open_captcha()[0] for _ in range(2)]
+    with pytest.raises(PoolExhausted):
+        asyncio.run(engine._aacquire(timeout=0.1))
+    assert not engine._async_waiters
+    for lease in leases:
+        engine.release(lease)
+
+
+def test_tls_verification_follows_config(monkeypatch):
+    from config import Config
+    from engines.http_engine import create_http_engine
+
+    assert HttpEngine('https://example.invalid/', 1, 1, 1).tls_verify is True
+    monkeypatch.setattr(Config, 'UPSTREAM_TLS_VERIFY', False)
+    assert create_http_engine().tls_verify is False
@@ -0,0 +1,210 @@
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('cryptography')
+
+import jobs
+from captcha_tickets import CaptchaTicketStore
+from database import get_db
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, sign_payload, worker_id
+
+RECORD = {'nameEn': 'Rahim Uddin', 'brn': '19901234', 'dob': '05/03/2010'}
+PAYLOAD = {'reg_number': '19901234', 'dob': '2010-03-05', 'captcha': 'abc'}
+
+
+class Clock:
+    """Stands in for the time module so pins and running jobs can be aged"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobs, 'time', clock)
+    return clock
+
+
+def make_queue(handler=None, workers=0, **overrides):
+    # Without workers nothing runs in the background; tests claim and finish jobs themselves
+    options = dict(workers=workers, poll_interval=0.05, max_attempts=2, running_timeout=300, pin_timeout=600,
+                   retention=86400, webhook_timeout=5, webhook_max_attempts=3, webhook_backoff=1,
+                   webhook_max_backoff=10)
+    options.update(overrides)
+    return JobQueue(handler or (lambda payload: {'success': True, 'data': RECORD, 'cached': False}), **options)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def job_row(job_id):
+    conn = get_db()
+    try:
+        return conn.execute('SELECT * FROM verification_jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def pin(job_id, worker):
+    conn = get_db()
+    conn.execute('UPDATE verification_jobs SET pinned_to = ? WHERE id = ?', (worker, job_id))
+    conn.commit()
+    conn.close()
+
+
+def requeue_stale(queue, clock):
+    conn = get_db()
+    try:
+        queue._requeue_stale(conn, clock.now)
+    finally:
+        conn.close()
+
+
+def test_jobs_are_pinned_to_the_worker_that_issued_their_captcha(clock, monkeypatch):
+    tickets = CaptchaTicketStore(engine=None, secret_key='secret', ttl=600, reap_interval=600)
+    monkeypatch.setattr(jobs, 'ticket_store', tickets)
+    queue = make_queue()
+    pinned = queue.submit('key', dict(PAYLOAD, captcha_token=tickets.issue(object())))
+    unpinned = queue.submit('key', dict(PAYLOAD, captcha_token='not a ticket'))
+    assert job_row(pinned)['pinned_to'] == worker_id()
+    assert job_row(unpinned)['pinned_to'] is None
+
+
+def test_jobs_pinned_to_another_worker_wait_for_it(clock):
+    queue = make_queue(pin_timeout=600)
+    job_id = queue.submit('key', PAYLOAD)
+    # A live process that is not this one
+    pin(job_id, worker_id(os.getppid()))
+    assert queue._claim() is None
+
+    requeue_stale(queue, clock)
+    assert queue._claim() is None
+
+    # The captcha has expired, so any worker may run it now
+    clock.now += 601
+    requeue_stale(queue, clock)
+    assert queue._claim()['id'] == job_id
+
+
+def test_jobs_pinned_to_a_dead_worker_are_released_at_once(clock):
+    queue = make_queue()
+    job_id = queue.submit('key', PAYLOAD)
+    pin(job_id, worker_id(dead_pid()))
+    requeue_stale(queue, clock)
+    assert job_row(job_id)['pinned_to'] is None
+    assert queue._claim()['id'] == job_id
+
+
+def test_jobs_of_a_dead_worker_are_requeued_then_failed(clock):
+    queue = make_queue(max_attempts=2)
+    job_id = queue.submit('key', PAYLOAD)
+    gone = worker_id(dead_pid())
+
+    def orphan():
+        assert queue._claim()['id'] == job_id
+        conn = get_db()
+        conn.execute('UPDATE verification_jobs SET claimed_by = ?, pinned_to = ? WHERE id = ?', (gone, gone, job_id))
+        conn.commit()
+        conn.close()
+        requeue_stale(queue, clock)
+
+    orphan()
+    row = job_row(job_id)
+    assert (row['status'], row['attempts'], row['claimed_by'], row['pinned_to']) == (QUEUED, 1, None, None)
+
+    orphan()
+    job = queue.get(job_id, 'key')
+    assert job['status'] == FAILED
+    assert job['result'] == {'success': False, 'error': 'The job was interrupted too many times'}
+    assert job_row(job_id)['payload'] is None
+    assert queue.get_stats()['requeued'] == 1
+
+
+def test_long_running_jobs_are_requeued(clock):
+    queue = make_queue(running_timeout=300)
+    job_id = queue.submit('key', PAYLOAD)
+    queue._claim()
+    clock.now += 299
+    requeue_stale(queue, clock)
+    assert job_row(job_id)['status'] == RUNNING
+    clock.now += 2
+    requeue_stale(queue, clock)
+    assert job_row(job_id)['status'] == QUEUED
+
+
+def test_results_are_stored_encrypted(clock):
+    queue = make_queue()
+    job_id = queue.submit('key', PAYLOAD)
+    row = queue._claim()
+    queue._finish(row, {'success': True, 'data': RECORD, 'cached': False})
+    stored = job_row(job_id)
+    assert b'Rahim' not in stored['result'] and stored['payload'] is None
+    job = queue.get(job_id, 'key')
+    assert job['status'] == SUCCEEDED and job['result']['data'] == RECORD
+    # Another key cannot see the job
+    assert queue.get(job_id, 'other') is None
+
+
+def test_sign_payload():
+    body = b'{"job_id": "1"}'
+    assert sign_payload('secret', body) == 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def webhook_receiver():
+    received = []
+    done = threading.Event()
+
+    class Receiver(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            received.append((dict(self.headers), body))
+            self.send_response(204)
+            self.end_headers()
+            done.set()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Receiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/hook', received, done
+    server.shutdown()
+
+
+def test_finished_jobs_are_posted_to_the_webhook_signed(webhook_receiver):
+    url, received, done = webhook_receiver
+    queue = make_queue(workers=1)
+    try:
+        job_id = queue.submit('api-key-value', PAYLOAD, webhook_url=url)
+        assert done.wait(5)
+    finally:
+        queue.stop()
+        for thread in queue._threads:
+            thread.join(5)
+
+    headers, body = received[0]
+    assert headers['X-Job-Id'] == job_id
+    # Receivers check the signature with the API key as the secret
+    expected = hmac.new(b'api-key-value', body, hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(headers['X-Webhook-Signature'], 'sha256=' + expected)
+    job = json.loads(body)
+    assert job['status'] == SUCCEEDED and job['result']['data'] == RECORD
+    assert queue.get_stats()['webhooks_delivered'] == 1
@@ -0,0 +1,104 @@
+import pytest
+
+import models
+from models import APIKey, KeyStore
+
+
+class Clock:
+    """Stands in for the time module so cache ages and version checks can be stepped through"""
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(models, 'time', clock)
+    return clock
+
+
+def make_store(**overrides):
+    options = dict(cache_ttl=300, cache_max_entries=100, version_interval=1)
+    options.update(overrides)
+    return KeyStore(**options)
+
+
+def new_key(store, owner='tester'):
+    return store.add_key(APIKey(owner, '2099-01-01', 100))
+
+
+def test_cached_keys_are_served_without_the_database(clock, monkeypatch):
+    store = make_store()
+    key = new_key(store)
+    assert store.get_key(key.key).owner_name == 'tester'
+    monkeypatch.setattr(models, 'get_api_key', lambda api_key: pytest.fail('read the database'))
+    assert store.get_key(key.key).owner_name == 'tester'
+
+
+def test_an_edit_in_one_worker_reaches_the_others(clock):
+    admin, worker = make_store(), make_store()
+    key = new_key(admin)
+    assert worker.get_key(key.key).active
+
+    # The admin edits a copy read from the database, as the admin pages do
+    edited = admin.get_keys()[key.id]
+    edited.active = False
+    admin.add_key(edited)
+
+    # The worker may serve its cached copy until it next checks the version
+    assert worker.get_key(key.key).active
+    clock.now += 1
+    assert not worker.get_key(key.key).active
+
+
+def test_a_deletion_in_one_worker_reaches_the_others(clock):
+    admin, worker = make_store(), make_store()
+    key = new_key(admin)
+    assert worker.get_key(key.key)
+    assert admin.delete_key(key.id)
+    clock.now += 1
+    assert worker.get_key(key.key) is None
+
+
+def test_a_changed_key_value_stops_working_at_once_in_its_worker(clock):
+    store = make_store()
+    key = new_key(store)
+    old_value = key.key
+    assert store.get_key(old_value)
+    edited = store.get_keys()[key.id]
+    edited.key = 'rotated'
+    store.add_key(edited)
+    assert store.get_key(old_value) is None
+    assert store.get_key('rotated').id == key.id
+
+
+def test_saving_the_cached_key_itself_keeps_it_cached(clock):
+    store = make_store()
+    key = new_key(store)
+    cached = store.get_key(key.key)
+    store.add_key(cached)
+    assert store.get_key(key.key) is cached
+
+
+def test_least_recently_used_key_is_evicted(clock):
+    store = make_store(cache_max_entries=2)
+    first, second, third = new_key(store, 'a'), new_key(store, 'b'), new_key(store, 'c')
+    store.get_key(first.key)
+    store.get_key(second.key)
+    # Using the first key again leaves the second as least recently used
+    store.get_key(first.key)
+    store.get_key(third.key)
+    assert list(store._cache) == [first.key, third.key]
+    assert set(store._cached_ids) == {first.id, third.id}
+
+
+def test_entries_are_reloaded_after_the_cache_ttl(clock):
+    store = make_store(cache_ttl=10, version_interval=60)
+    key = new_key(store)
+    cached = store.get_key(key.key)
+    clock.now += 10
+    reloaded = store.get_key(key.key)
+    assert reloaded is not cached and reloaded.id == key.id
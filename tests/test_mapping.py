@@ -0,0 +1,135 @@
+import random
+from collections import OrderedDict
+from datetime import datetime
+
+import pytest
+
+from mapping import FIELDS, map_verification_data, parse_date
+
+
+# The mapper as it was before the field table, kept to check the rewrite against
+
+
+def old_title_case(text):
+    if not isinstance(text, str):
+        return text
+    # Only title-case if text contains Latin letters
+    if any('a' <= c.lower() <= 'z' for c in text):
+        return text.title()
+    return text
+
+
+def old_format_date(date_str):
+    try:
+        dt = datetime.strptime(date_str, "%d %B %Y")
+        return dt.strftime("%d/%m/%Y")
+    except Exception:
+        return date_str
+
+
+def old_map_verification_data(raw_data):
+    def get(key):
+        val = raw_data.get(key, "")
+        if key in ["Registration Date", "Issuance Date", "Date of Birth", "birthPlaceEn"]:
+            # Try to format as date
+            val = old_format_date(val)
+        return old_title_case(val)
+    return OrderedDict([
+        ("office", get("Registration Office")),
+        ("address", old_title_case(raw_data.get("address", ""))),
+        ("register", get("Registration Date")),
+        ("issue", get("Issuance Date")),
+        ("brn", get("Birth Registration Number")),
+        ("dob", get("Date of Birth")),
+        ("sex", get("Sex")),
+        ("nameEn", get("Registered Person Name")),
+        ("nameBn", raw_data.get("নিবন্ধিত ব্যক্তির নাম", "")),
+        ("fatherNameEn", get("Father's Name")),
+        ("fatherNameBn", raw_data.get("পিতার নাম", "")),
+        ("fatherNationalityEn", get("Father's Nationality")),
+        ("fatherNationalityBn", raw_data.get("পিতার জাতীয়তা", raw_data.get("পিতার জাতীয়তা", ""))),
+        ("motherNameEn", get("Mother's Name")),
+        ("motherNameBn", raw_data.get("মাতার নাম", "")),
+        ("motherNationalityEn", get("Mother's Nationality")),
+        ("motherNationalityBn", raw_data.get("মাতার জাতীয়তা", raw_data.get("মাতার জাতীয়তা", ""))),
+        ("birthPlaceEn", get("birthPlaceEn")),
+        ("birthPlaceBn", raw_data.get("জন্মস্থান", "")),
+    ])
+
+
+RECORD = {
+    "Registration Office": "DHAKA NORTH CITY CORPORATION",
+    "address": "HOUSE 12, ROAD 5, DHANMONDI, DHAKA",
+    "Registration Date": "12 April 2010",
+    "Issuance Date": "01 January 2011",
+    "Birth Registration Number": "19901234567890123",
+    "Date of Birth": "05 March 2010",
+    "Sex": "MALE",
+    "Registered Person Name": "RAHIM AHMED",
+    "নিবন্ধিত ব্যক্তির নাম": "রহিম আহমেদ",
+    "Father's Name": "KARIM AHMED",
+    "পিতার নাম": "করিম আহমেদ",
+    "Father's Nationality": "BANGLADESHI",
+    "পিতার জাতীয়তা": "বাংলাদেশী",
+    "Mother's Name": "FATEMA BEGUM",
+    "মাতার নাম": "ফাতেমা বেগম",
+    "Mother's Nationality": "BANGLADESHI",
+    "মাতার জাতীয়তা": "বাংলাদেশী",
+    "birthPlaceEn": "DHAKA",
+    "জন্মস্থান": "ঢাকা",
+}
+
+RAW_KEYS = [key for _, sources, _ in FIELDS for key in sources]
+
+DATES = [
+    '05 March 2010', '5 March 2010', ' 5 March 2010', '05 march 2010', '05 MARCH 2010', '05  March  2010',
+    '05\tMarch 2010', '31 February 2010', '29 February 2012', '29 February 2010', '00 March 2010',
+    '32 March 2010', '05 Mar 2010', '05 March 10', '05 March 2010 ', 'March 05 2010', '05-03-2010',
+    '2010-03-05', '05 Marchh 2010', '٠٥ March 2010', '05 March ٢٠١٠', '',
+]
+
+TEXTS = [
+    '', 'DHAKA', 'dhaka', "o'brien", 'রহিম আহমেদ', 'রহিম DHAKA', '12/05', 'İSTANBUL', '\u212aELVIN', 'STRASSE ß',
+    'ǅEMAL', 'mcDONALD-smith', '  SPACED  ', None, 0, 17,
+]
+
+
+def test_matches_the_previous_mapper_on_an_upstream_record():
+    mapped = map_verification_data(RECORD)
+    assert mapped == old_map_verification_data(RECORD)
+    assert list(mapped) == list(old_map_verification_data(RECORD))
+    assert mapped['dob'] == '05/03/2010' and mapped['nameEn'] == 'Rahim Ahmed'
+
+
+@pytest.mark.parametrize('value', DATES + TEXTS)
+def test_matches_the_previous_mapper_on_every_field(value):
+    raw = {key: value for key in RAW_KEYS}
+    assert map_verification_data(raw) == old_map_verification_data(raw)
+
+
+@pytest.mark.parametrize('text', DATES)
+def test_parse_date_matches_strptime(text):
+    assert (parse_date(text) or text) == old_format_date(text)
+
+
+def test_matches_the_previous_mapper_on_missing_and_alternate_keys():
+    assert map_verification_data({}) == old_map_verification_data({})
+    # The upstream has spelled the nationality labels with the precomposed ya too
+    raw = {"পিতার জাতী\u09dfতা": "বাংলাদেশী", "মাতার জাতী\u09dfতা": "বাংলাদেশী"}
+    assert map_verification_data(raw) == old_map_verification_data(raw)
+
+
+def test_matches_the_previous_mapper_on_random_records():
+    rng = random.Random(19)
+    alphabet = 'aZ İ\u212a0159 /-\'রহিম'
+    for _ in range(2000):
+        raw = {}
+        for key in RAW_KEYS:
+            choice = rng.random()
+            if choice < 0.3:
+                raw[key] = rng.choice(DATES)
+            elif choice < 0.6:
+                raw[key] = rng.choice(TEXTS)
+            elif choice < 0.9:
+                raw[key] = ''.join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+        assert map_verification_data(raw) == old_map_verification_data(raw), raw
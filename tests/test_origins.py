@@ -0,0 +1,99 @@
+import ipaddress
+
+import pytest
+
+from origins import OriginError, OriginMatcher, invalid_entries, parse_entry, parse_origin_host
+
+
+@pytest.mark.parametrize('entry, expected', [
+    ('example.com', ('host', 'example.com')),
+    ('Example.COM.', ('host', 'example.com')),
+    ('https://example.com:8443', ('host', 'example.com')),
+    ('localhost:3000', ('host', 'localhost')),
+    ('*.example.com', ('wildcard', ['example', 'com'])),
+    ('10.0.0.0/8', ('network', ipaddress.ip_network('10.0.0.0/8'))),
+    ('192.168.1.7', ('network', ipaddress.ip_network('192.168.1.7/32'))),
+    ('10.1.2.3/8', ('network', ipaddress.ip_network('10.0.0.0/8'))),
+    ('2001:db8::/32', ('network', ipaddress.ip_network('2001:db8::/32'))),
+    ('http://[2001:db8::1]:8080', ('network', ipaddress.ip_network('2001:db8::1/128'))),
+])
+def test_parse_entry(entry, expected):
+    assert parse_entry(entry) == expected
+
+
+@pytest.mark.parametrize('entry', ['exa mple.com', '*.', '10.0.0.0/33', '300.1.1.1', '-bad-.com', 'a:b:c'])
+def test_parse_entry_rejects(entry):
+    with pytest.raises(OriginError):
+        parse_entry(entry)
+
+
+def test_invalid_entries_lists_every_bad_entry():
+    assert len(invalid_entries(['example.com', 'exa mple.com', '10.0.0.0/33'])) == 2
+
+
+def test_exact_hosts():
+    matcher = OriginMatcher(['example.com', 'http://localhost:3000'])
+    assert matcher.match('example.com')
+    assert matcher.match('EXAMPLE.com.')
+    assert matcher.match('localhost')
+    assert not matcher.match('www.example.com')
+    assert not matcher.match('')
+
+
+def test_wildcards_match_subdomains_only():
+    matcher = OriginMatcher(['*.example.com', '*.api.other.org'])
+    assert matcher.match('www.example.com')
+    assert matcher.match('a.b.example.com')
+    assert not matcher.match('example.com')
+    assert not matcher.match('badexample.com')
+    assert not matcher.match('example.com.evil.net')
+    assert matcher.match('v1.api.other.org')
+    assert not matcher.match('api.other.org')
+    assert not matcher.match('www.other.org')
+
+
+def test_ipv4_networks():
+    matcher = OriginMatcher(['10.0.0.0/8', '192.168.1.0/24', '203.0.113.9'])
+    assert matcher.match('10.200.3.4')
+    assert matcher.match('192.168.1.255')
+    assert not matcher.match('192.168.2.1')
+    assert matcher.match('203.0.113.9')
+    assert not matcher.match('203.0.113.10')
+    assert not matcher.match('11.0.0.1')
+
+
+def test_ipv6_networks_and_mapped_ipv4():
+    matcher = OriginMatcher(['2001:db8::/32', '10.0.0.0/8'])
+    assert matcher.match('2001:db8:1::5')
+    assert not matcher.match('2001:db9::1')
+    # A dual-stack server reports IPv4 clients as IPv4-mapped IPv6
+    assert matcher.match('::ffff:10.1.1.1')
+    assert not matcher.match('::ffff:11.1.1.1')
+
+
+def test_host_names_are_not_parsed_as_addresses():
+    matcher = OriginMatcher(['10.0.0.0/8', '*.example.com'])
+    assert matcher.match('www.example.com')
+    assert not matcher.match('10.example.org')
+
+
+def test_unparseable_entries_are_kept_as_exact_strings():
+    matcher = OriginMatcher(['not a host'])
+    assert matcher.match('not a host')
+    assert not matcher.match('not')
+
+
+def test_empty_matcher_is_falsy():
+    assert not OriginMatcher([])
+    assert OriginMatcher(['example.com'])
+
+
+@pytest.mark.parametrize('header, host', [
+    ('https://www.example.com', 'www.example.com'),
+    ('https://www.example.com:8443/path?q=1', 'www.example.com'),
+    ('http://[2001:db8::1]:80', '2001:db8::1'),
+    ('example.com', 'example.com'),
+    ('http://[bad', None),
+])
+def test_parse_origin_host(header, host):
+    assert parse_origin_host(header) == host
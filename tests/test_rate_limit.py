@@ -0,0 +1,92 @@
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter
+
+
+class Clock:
+    """Stands in for the time module so refills can be stepped through"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_burst_then_limited(clock):
+    limiter = RateLimiter()
+    assert [limiter.acquire('k', rate=2, burst=3) for _ in range(3)] == [None, None, None]
+    assert limiter.acquire('k', rate=2, burst=3) == 1
+    assert limiter.get_stats() == {'allowed': 3, 'limited': 1}
+
+
+def test_bucket_refills_at_the_rate(clock):
+    limiter = RateLimiter()
+    for _ in range(3):
+        limiter.acquire('k', rate=2, burst=3)
+    clock.now += 0.5
+    assert limiter.acquire('k', rate=2, burst=3) is None
+    assert limiter.acquire('k', rate=2, burst=3) == 1
+    # An idle bucket never holds more than burst
+    clock.now += 60
+    assert [limiter.acquire('k', rate=2, burst=3) for _ in range(4)] == [None, None, None, 1]
+
+
+def test_retry_after_covers_the_missing_tokens(clock):
+    limiter = RateLimiter()
+    assert limiter.acquire('k', rate=0.1, burst=1) is None
+    assert limiter.acquire('k', rate=0.1, burst=1) == 10
+    clock.now += 4
+    assert limiter.acquire('k', rate=0.1, burst=1) == 6
+
+
+def test_refused_request_takes_no_tokens(clock):
+    limiter = RateLimiter()
+    limiter.acquire('k', rate=1, burst=2)
+    assert limiter.acquire('k', rate=1, burst=2, cost=2) == 1
+    assert limiter.acquire('k', rate=1, burst=2) is None
+
+
+def test_batch_cost_is_capped_at_the_bucket_size(clock):
+    limiter = RateLimiter()
+    assert limiter.acquire('k', rate=1, burst=5, cost=50) is None
+    assert limiter.acquire('k', rate=1, burst=5, cost=50) == 5
+
+
+def test_workers_share_a_bucket(clock):
+    workers = [RateLimiter(), RateLimiter()]
+    results = [workers[i % 2].acquire('k', rate=1, burst=4) for i in range(6)]
+    assert results.count(None) == 4
+
+
+def test_keys_have_separate_buckets(clock):
+    limiter = RateLimiter()
+    assert limiter.acquire('a', rate=1, burst=1) is None
+    assert limiter.acquire('b', rate=1, burst=1) is None
+    assert limiter.acquire('a', rate=1, burst=1) == 1
+
+
+def test_default_burst_is_one_seconds_worth():
+    assert RateLimiter.burst_for(2.5, 0) == 3
+    assert RateLimiter.burst_for(0.2, 0) == 1
+    assert RateLimiter.burst_for(2.5, 10) == 10
+
+
+def test_no_rate_means_no_limit(clock):
+    limiter = RateLimiter()
+    assert all(limiter.acquire('k', rate=0, burst=0) is None for _ in range(100))
+
+
+def test_reset_refills_the_bucket(clock):
+    limiter = RateLimiter()
+    limiter.acquire('k', rate=1, burst=1)
+    assert limiter.acquire('k', rate=1, burst=1) == 1
+    limiter.reset('k')
+    assert limiter.acquire('k', rate=1, burst=1) is None
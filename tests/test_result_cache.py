@@ -0,0 +1,131 @@
+import pytest
+
+pytest.importorskip('cryptography')
+
+import app as app_module
+import result_cache as result_cache_module
+from database import get_db
+from models import APIKey, key_store
+from result_cache import ResultCache, cache_bypassed
+
+RECORD = {'nameEn': 'Rahim Uddin', 'brn': '19901234', 'dob': '05/03/2010'}
+
+
+class Clock:
+    """Stands in for the time module so entries can be aged"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache_module, 'time', clock)
+    return clock
+
+
+def make_cache(**overrides):
+    options = dict(enabled=True, ttl=60, max_entries=100, secret_key='secret')
+    options.update(overrides)
+    return ResultCache(**options)
+
+
+def test_stores_and_returns_records(clock):
+    cache = make_cache()
+    assert cache.get('19901234', '2010-03-05') is None
+    cache.set('19901234', '2010-03-05', RECORD)
+    # Lookups ignore whitespace the way single-flight keys do
+    assert cache.get(' 1990 1234', '2010-03-05 ') == RECORD
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['stores'], stats['entries']) == (1, 1, 1, 1)
+
+
+def test_records_are_keyed_and_stored_encrypted(clock):
+    cache = make_cache()
+    cache.set('19901234', '2010-03-05', RECORD)
+    conn = get_db()
+    cache_key, payload = conn.execute('SELECT cache_key, payload FROM verification_cache').fetchone()
+    conn.close()
+    assert '19901234' not in cache_key
+    assert b'Rahim' not in payload
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = make_cache(ttl=60)
+    cache.set('1', '2010-03-05', RECORD)
+    cache.set('2', '2010-03-05', RECORD, ttl=600)
+    clock.now += 60
+    assert cache.get('1', '2010-03-05') is None
+    assert cache.get('2', '2010-03-05') == RECORD
+    assert cache.get_stats()['entries'] == 1
+
+
+def test_least_recently_read_entries_are_evicted(clock):
+    cache = make_cache(max_entries=2)
+    cache.set('1', '2010-03-05', RECORD)
+    clock.now += 1
+    cache.set('2', '2010-03-05', RECORD)
+    clock.now += 1
+    # Reading 1 makes 2 the least recently used
+    assert cache.get('1', '2010-03-05') == RECORD
+    clock.now += 1
+    cache.set('3', '2010-03-05', RECORD)
+    assert cache.get('2', '2010-03-05') is None
+    assert cache.get('1', '2010-03-05') == RECORD
+    assert cache.get('3', '2010-03-05') == RECORD
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_records_written_under_another_key_are_misses(clock):
+    make_cache(secret_key='secret').set('1', '2010-03-05', RECORD)
+    cache = make_cache(secret_key='secret', encryption_key=make_cache(secret_key='other')._encryption_key)
+    assert cache.get('1', '2010-03-05') is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_invalidate_and_clear(clock):
+    cache = make_cache()
+    cache.set('1', '2010-03-05', RECORD)
+    cache.set('2', '2010-03-05', RECORD)
+    assert cache.invalidate('1', '2010-03-05')
+    assert not cache.invalidate('1', '2010-03-05')
+    assert cache.clear() == 1
+    assert cache.get_stats()['invalidations'] == 2
+
+
+def test_disabled_cache_stores_nothing():
+    cache = make_cache(enabled=False)
+    cache.set('1', '2010-03-05', RECORD)
+    assert cache.get('1', '2010-03-05') is None
+    assert cache.get_stats()['entries'] == 0
+
+
+@pytest.mark.parametrize('header, bypassed', [
+    (None, False),
+    ('max-age=0', False),
+    ('no-cache', True),
+    ('max-age=0, No-Store', True),
+])
+def test_cache_bypassed(header, bypassed):
+    assert cache_bypassed(header) is bypassed
+
+
+def test_verify_skips_the_cache_on_no_cache(monkeypatch):
+    cache = make_cache()
+    cache.set('19901234', '2010-03-05', RECORD)
+    monkeypatch.setattr(app_module, 'result_cache', cache)
+    key = key_store.add_key(APIKey('tester', '2099-01-01', 100))
+    client = app_module.app.test_client()
+    body = {'reg_number': '19901234', 'dob': '2010-03-05'}
+
+    response = client.post('/api/verify', json=body, headers={'X-API-KEY': key.key})
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_json()['data'] == RECORD
+
+    # Without the cache the request needs a captcha like any other
+    response = client.post('/api/verify', json=body, headers={'X-API-KEY': key.key, 'Cache-Control': 'no-cache'})
+    assert response.status_code == 400
+    assert 'X-Cache' not in response.headers
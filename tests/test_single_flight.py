@@ -0,0 +1,175 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight, verification_key
+
+
+def test_verification_key_ignores_whitespace():
+    assert verification_key(' 1990 1234 ', '2010-03-05 ') == verification_key('19901234', '2010-03-05')
+
+
+def test_concurrent_callers_share_one_run():
+    flight = SingleFlight(wait_timeout=5)
+    leader_started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        leader_started.set()
+        release.wait(5)
+        return {'brn': '1'}
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(flight.run, 'key', work)]
+        leader_started.wait(5)
+        futures += [executor.submit(flight.run, 'key', work) for _ in range(4)]
+        # Let the duplicates join the running call before it finishes
+        threading.Event().wait(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result == {'brn': '1'} for result, _ in results)
+    assert [coalesced for _, coalesced in results] == [False] + [True] * 4
+    stats = flight.get_stats()
+    assert stats['coalesced'] == 4 and stats['in_flight'] == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight(wait_timeout=5)
+    assert flight.run('a', lambda: 1) == (1, False)
+    assert flight.run('b', lambda: 2) == (2, False)
+    assert flight.get_stats()['leaders'] == 2
+
+
+def test_waiters_run_their_own_call_when_the_leader_fails():
+    flight = SingleFlight(wait_timeout=5)
+    leader_started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        leader_started.set()
+        release.wait(5)
+        raise ValueError('Captcha mismatch')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.run, 'key', failing)
+        leader_started.wait(5)
+        waiter = executor.submit(flight.run, 'key', lambda: 'own result')
+        threading.Event().wait(0.1)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result()
+        assert waiter.result() == ('own result', False)
+    assert flight.get_stats()['fallbacks'] == 1
+
+
+def test_waiters_give_up_after_wait_timeout():
+    flight = SingleFlight(wait_timeout=0.1)
+    leader_started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        leader_started.set()
+        release.wait(5)
+        return 'leader result'
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.run, 'key', slow)
+        leader_started.wait(5)
+        assert flight.run('key', lambda: 'own result') == ('own result', False)
+        release.set()
+        assert leader.result() == ('leader result', False)
+
+
+def test_async_callers_share_one_run():
+    flight = SingleFlight(wait_timeout=5)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[flight.arun('key', work) for _ in range(10)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ['result'] * 10
+    assert sum(coalesced for _, coalesced in results) == 9
+
+
+def test_async_waiter_joins_a_threaded_leader():
+    flight = SingleFlight(wait_timeout=5)
+    leader_started = threading.Event()
+    release = threading.Event()
+
+    def work():
+        leader_started.set()
+        release.wait(5)
+        return 'thread result'
+
+    async def follow():
+        threading.Timer(0.1, release.set).start()
+        return await flight.arun('key', lambda: asyncio.sleep(0, 'own result'))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(flight.run, 'key', work)
+        leader_started.wait(5)
+        assert asyncio.run(follow()) == ('thread result', True)
+        assert leader.result() == ('thread result', False)
+
+
+def test_waiters_share_the_record_without_answering_their_captcha():
+    # The trade-off SingleFlight documents: a waiter's own captcha is never checked
+    flight = SingleFlight(wait_timeout=5)
+    leader_started = threading.Event()
+    release = threading.Event()
+    submitted = []
+
+    def submit(captcha):
+        submitted.append(captcha)
+        if captcha != 'right':
+            raise ValueError('Captcha mismatch')
+        leader_started.set()
+        release.wait(5)
+        return {'brn': '1'}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.run, 'key', lambda: submit('right'))
+        leader_started.wait(5)
+        waiter = executor.submit(flight.run, 'key', lambda: submit('wrong'))
+        threading.Event().wait(0.1)
+        release.set()
+        assert waiter.result() == ({'brn': '1'}, True)
+        assert leader.result() == ({'brn': '1'}, False)
+    assert submitted == ['right']
+
+
+def test_disabled_flight_makes_every_caller_run_its_own_work():
+    flight = SingleFlight(wait_timeout=5, enabled=False)
+    leader_started = threading.Event()
+    release = threading.Event()
+
+    def submit(captcha):
+        if captcha != 'right':
+            raise ValueError('Captcha mismatch')
+        leader_started.set()
+        release.wait(5)
+        return {'brn': '1'}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.run, 'key', lambda: submit('right'))
+        leader_started.wait(5)
+        waiter = executor.submit(flight.run, 'key', lambda: submit('wrong'))
+        with pytest.raises(ValueError):
+            waiter.result()
+        release.set()
+        assert leader.result() == ({'brn': '1'}, False)
+    assert asyncio.run(flight.arun('key', lambda: asyncio.sleep(0, 'own result'))) == ('own result', False)
+    assert flight.get_stats()['leaders'] == 0
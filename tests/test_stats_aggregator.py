@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+
+import stats_aggregator as stats_aggregator_module
+from database import get_db
+from stats_aggregator import StatsAggregator
+
+
+class Clock:
+    """Stands in for the time module so counts can land in a chosen hour"""
+    def __init__(self):
+        self.now = datetime(2026, 3, 5, 14, 30).timestamp()
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stats_aggregator_module, 'time', clock)
+    return clock
+
+
+def stored():
+    conn = get_db()
+    try:
+        total = tuple(conn.execute('SELECT total_requests, successful_requests, failed_requests FROM stats').fetchone())
+        daily = {row[0]: tuple(row[1:]) for row in conn.execute('SELECT date, total, successful, failed FROM daily_stats')}
+        hourly = {row[0]: tuple(row[1:]) for row in conn.execute('SELECT hour, total, successful, failed FROM hourly_stats')}
+    finally:
+        conn.close()
+    return total, daily, hourly
+
+
+def test_counts_wait_for_the_flush(clock):
+    aggregator = StatsAggregator(flush_interval=60)
+    aggregator.add(1, 0)
+    aggregator.add(0, 1)
+    assert stored() == ((0, 0, 0), {}, {})
+    aggregator.stop()
+    assert stored() == ((2, 1, 1), {'2026-03-05': (2, 1, 1)}, {'2026-03-05 14': (2, 1, 1)})
+
+
+def test_workers_add_to_each_other_s_counts(clock):
+    # Two processes flushing the same hour must both be counted
+    first, second = StatsAggregator(flush_interval=60), StatsAggregator(flush_interval=60)
+    first.add(3, 1)
+    second.add(2, 0)
+    first.flush()
+    second.flush()
+    clock.now += 3600
+    first.add(1, 0)
+    first.flush()
+    first.stop()
+    second.stop()
+    assert stored() == (
+        (7, 6, 1),
+        {'2026-03-05': (7, 6, 1)},
+        {'2026-03-05 14': (6, 5, 1), '2026-03-05 15': (1, 1, 0)}
+    )
+
+
+def test_failed_flush_keeps_the_counts(clock, monkeypatch):
+    aggregator = StatsAggregator(flush_interval=60)
+    aggregator.add(2, 0)
+
+    def fail(counts):
+        raise RuntimeError('database is locked')
+
+    add_hourly_stats = stats_aggregator_module.add_hourly_stats
+    monkeypatch.setattr(stats_aggregator_module, 'add_hourly_stats', fail)
+    with pytest.raises(RuntimeError):
+        aggregator.flush()
+    aggregator.add(1, 1)
+    monkeypatch.setattr(stats_aggregator_module, 'add_hourly_stats', add_hourly_stats)
+    aggregator.stop()
+    assert stored()[0] == (4, 3, 1)
+
+
+def test_no_interval_writes_inline(clock):
+    aggregator = StatsAggregator(flush_interval=0)
+    aggregator.add(1, 0)
+    assert stored()[0] == (1, 1, 0)
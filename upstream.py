@@ -0,0 +1,22 @@
+from config import Config
+from engines import create_engine, GuardedEngine, CircuitBreaker
+
+
+def guard(engine):
+    """Put the circuit breaker and admission limit in front of an engine"""
+    if not Config.BREAKER_ENABLED:
+        return engine
+    breaker = CircuitBreaker(
+        window=Config.BREAKER_WINDOW,
+        min_calls=Config.BREAKER_MIN_CALLS,
+        failure_rate=Config.BREAKER_FAILURE_RATE,
+        slow_call_seconds=Config.BREAKER_SLOW_CALL_SECONDS,
+        slow_rate=Config.BREAKER_SLOW_RATE,
+        open_seconds=Config.BREAKER_OPEN_SECONDS,
+        half_open_probes=Config.BREAKER_HALF_OPEN_PROBES
+    )
+    return GuardedEngine(engine, breaker, max_in_flight=Config.UPSTREAM_MAX_IN_FLIGHT)
+
+
+# Create global instance for use across the application
+engine = guard(create_engine(Config.VERIFY_ENGINE))
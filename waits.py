@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+
+# Reports the verification form and its captcha image as the page sees them
+PAGE_STATE_SCRIPT = """
+    var img = document.getElementById('CaptchaImage');
+    var rect = img ? img.getBoundingClientRect() : null;
+    return {
+        readyState: document.readyState,
+        form: !!document.getElementById('ubrnsearchform') && !!document.getElementById('ubrn'),
+        captchaComplete: !!img && img.complete,
+        captchaWidth: img ? img.naturalWidth : 0,
+        captchaVisible: !!rect && rect.width > 0 && rect.height > 0,
+        resources: performance.getEntriesByType('resource').length
+    };
+"""
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class StageBudget:
+    """Timeout budget for one wait stage, learned from how long it usually takes"""
+    def __init__(self, name, ceiling, floor=0.5, headroom=2.0, min_samples=20, window=200):
+        self.name = name
+        self.ceiling = ceiling
+        self.floor = floor
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.resolved = 0
+        self.timeouts = 0
+
+    @property
+    def budget(self):
+        """How long to wait before treating the stage as stuck"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.ceiling
+            p95 = _percentile(self._samples, 0.95)
+        return max(self.floor, min(self.ceiling, p95 * self.headroom))
+
+    def observe(self, elapsed, timed_out=False):
+        with self._lock:
+            # A timeout still tells us the stage takes at least this long
+            self._samples.append(elapsed)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.resolved += 1
+
+    def get_stats(self):
+        with self._lock:
+            samples = list(self._samples)
+            resolved, timeouts = self.resolved, self.timeouts
+        return {
+            "stage": self.name,
+            "resolved": resolved,
+            "timeouts": timeouts,
+            "p50": round(_percentile(samples, 0.5), 3) if samples else None,
+            "p95": round(_percentile(samples, 0.95), 3) if samples else None,
+            "budget": round(self.budget, 3),
+            "ceiling": self.ceiling
+        }
+
+
+class NetworkIdle:
+    """True once no new resource has been fetched for `quiet` seconds"""
+    def __init__(self, quiet=0.3):
+        self.quiet = quiet
+        self._count = None
+        self._since = None
+
+    def update(self, state):
+        now = time.monotonic()
+        if state['resources'] != self._count:
+            self._count = state['resources']
+            self._since = now
+            return False
+        return state['readyState'] == 'complete' and now - self._since >= self.quiet
+
+
+def form_ready(driver):
+    """The verification form is in the DOM"""
+    state = driver.execute_script(PAGE_STATE_SCRIPT)
+    return state if state['form'] else False
+
+
+def captcha_ready():
+    """The captcha image has decoded, or the page went idle with a broken image"""
+    idle = NetworkIdle()
+
+    def condition(driver):
+        state = driver.execute_script(PAGE_STATE_SCRIPT)
+        if state['captchaComplete'] and state['captchaWidth'] > 0 and state['captchaVisible']:
+            return 'ready'
+        if idle.update(state) and state['captchaComplete']:
+            # Nothing left to load and the image has no pixels, waiting longer won't help
+            return 'broken'
+        return False
+    return condition
+
+
+class AdaptiveWaiter:
+    """Polls readiness signals instead of sleeping, with per-stage learned budgets"""
+    def __init__(self, stages, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self.stages = {name: StageBudget(name, ceiling) for name, ceiling in stages.items()}
+
+    def budget(self, stage):
+        return self.stages[stage].budget
+
+    def ceiling(self, stage):
+        return self.stages[stage].ceiling
+
+    def wait(self, driver, stage, condition, timeout=None):
+        """Wait for a condition, timing out at the stage's learned budget unless told otherwise"""
+        from selenium.common.exceptions import TimeoutException, JavascriptException, StaleElementReferenceException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        budget = self.stages[stage]
+        timeout = budget.budget if timeout is None else timeout
+        started = time.monotonic()
+        try:
+            result = WebDriverWait(
+                driver, timeout, poll_frequency=self.poll_interval,
+                # Scripts can fail while the page navigates away
+                ignored_exceptions=(JavascriptException, StaleElementReferenceException)
+            ).until(condition)
+        except TimeoutException:
+            budget.observe(time.monotonic() - started, timed_out=True)
+            raise
+        budget.observe(time.monotonic() - started)
+        return result
+
+    def get_stats(self):
+        return [budget.get_stats() for budget in self.stages.values()]
+
+
+# Ceilings are the longest each stage has ever been allowed to take
+waiter = AdaptiveWaiter({
+    'form': 5,
+    'captcha': 10,
+    'result': 5
+})